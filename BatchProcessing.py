@@ -0,0 +1,295 @@
+import unittest
+
+import os
+import json
+import signal
+import hashlib
+import threading
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+
+#------------------------------------------------------------------------------
+
+# Parallel batch processing
+
+def runBatch(function, items, workers=1, chunkSize=None, timeout=None, verbose=True):
+    '''
+    Applies function to each item (e.g. each file in a corpus) across a pool of worker processes.
+    Set workers=None to use all available cores; workers=1 runs in this process.
+    Items are dispatched to workers in chunks of chunkSize (by default, about four chunks per worker).
+    The timeout (in seconds) applies to each item separately.
+    Errors (including timeouts) are collected, not raised.
+
+    Returns a dict with
+    'results': [(item, result)] for all successes, in the order of the input items
+        (so identical whatever the number of workers),
+    'errors': [(item, error message)],
+    'noOfFiles', 'seconds', and 'filesPerSecond' (throughput).
+
+    NB: function must be picklable (i.e. defined at the top level of a module) for workers > 1.
+    '''
+
+    items = list(items)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if chunkSize is None:
+        chunkSize = max(1, len(items) // (workers * 4))
+
+    tasks = [(function, item, timeout) for item in items]
+
+    start = time.perf_counter()
+    if workers == 1 or len(items) < 2:
+        outcomes = [runOne(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            outcomes = list(executor.map(runOne, tasks, chunksize=chunkSize))
+    seconds = time.perf_counter() - start
+
+    results = []
+    errors = []
+    for item, (succeeded, value) in zip(items, outcomes):
+        if succeeded:
+            results.append((item, value))
+        else:
+            errors.append((item, value))
+
+    filesPerSecond = len(items) / seconds if seconds else 0.0
+    returnInfo = {'results': results,
+                  'errors': errors,
+                  'noOfFiles': len(items),
+                  'seconds': seconds,
+                  'filesPerSecond': filesPerSecond,}
+
+    if verbose:
+        for item, message in errors:
+            print('Error in processing '+str(item)+': '+message)
+        print('Processed %i files in %.2f seconds (%.2f files per second); %i errors'
+              %(len(items), seconds, filesPerSecond, len(errors)))
+
+    return returnInfo
+
+def runOne(task):
+    '''
+    Runs one (function, item, timeout) task, returning (True, result) or (False, error message).
+    Timeouts use SIGALRM where available (Unix, main thread); otherwise they are not enforced.
+    '''
+
+    function, item, timeout = task
+
+    useAlarm = (timeout is not None
+                and hasattr(signal, 'SIGALRM')
+                and threading.current_thread() is threading.main_thread())
+    if useAlarm:
+        previousHandler = signal.signal(signal.SIGALRM, raiseTimeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+
+    try:
+        return (True, function(item))
+    except Exception as error:
+        return (False, type(error).__name__+': '+str(error))
+    finally:
+        if useAlarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previousHandler)
+
+def raiseTimeout(signum, frame):
+    raise TimeoutError('Timed out')
+
+#------------------------------------------------------------------------------
+
+# Incremental processing
+
+class Manifest:
+    '''
+    Records what has been processed: for each item (e.g. a file name), the mtime, size and hash
+    of its input file(s), and the outputs written; and for the whole run, the analysis parameters.
+    On a re-run, compare() picks out only what is new or changed (all of it if the parameters have
+    changed) and what has been deleted since, so outputs can be updated or removed accordingly.
+    Stored as JSON. So:
+    >>> manifest = Manifest(manifestPath, parameters={'minRhyDenom': 8})
+    >>> toDo, skipped, removed = manifest.compare({fileName: [fullPath] for ...})
+    >>> ... process toDo, manifest.record(...), manifest.retry(...), manifest.forget(...) ...
+    >>> manifest.save()
+    '''
+
+    def __init__(self, manifestPath, parameters=None):
+        self.manifestPath = manifestPath
+        self.parameters = parameters or {}
+        self.entries = {}
+        self.parametersChanged = False
+
+        if os.path.exists(manifestPath):
+            with open(manifestPath) as filein:
+                stored = json.load(filein)
+            self.entries = stored['entries']
+            self.parametersChanged = stored['parameters'] != json.loads(json.dumps(self.parameters))
+
+    def compare(self, inputs):
+        '''
+        Takes a dict of {item: [input file paths]} and returns three lists of items:
+        those to process (new, changed, or all if the parameters have changed),
+        those to skip (unchanged), and
+        those removed (in the manifest but no longer among the inputs).
+        '''
+
+        toProcess = []
+        skipped = []
+        for item, paths in inputs.items():
+            entry = self.entries.get(item)
+            if entry is None or self.parametersChanged or not self.unchanged(entry, paths):
+                toProcess.append(item)
+            else:
+                skipped.append(item)
+        removed = [item for item in self.entries if item not in inputs]
+
+        return toProcess, skipped, removed
+
+    def unchanged(self, entry, paths):
+        '''
+        Checks whether input files match their record: same mtime and size,
+        or failing that, the same content (in which case the new mtime is recorded).
+        '''
+
+        if [x['path'] for x in entry['inputs']] != list(paths):
+            return False
+        for record in entry['inputs']:
+            try:
+                info = os.stat(record['path'])
+            except OSError:
+                return False
+            if info.st_mtime == record['mtime'] and info.st_size == record['size']:
+                continue
+            if info.st_size != record['size'] or hashFile(record['path']) != record['hash']:
+                return False
+            record['mtime'] = info.st_mtime
+        return True
+
+    def outputs(self, item):
+        '''
+        Returns the outputs recorded for an item (none if it is not in the manifest).
+        '''
+
+        return self.entries.get(item, {}).get('outputs', [])
+
+    def record(self, item, paths, outputs=()):
+        '''
+        Records an item as processed, with the current state of its input file(s) and its outputs.
+        '''
+
+        inputRecords = []
+        for path in paths:
+            info = os.stat(path)
+            inputRecords.append({'path': path,
+                                 'mtime': info.st_mtime,
+                                 'size': info.st_size,
+                                 'hash': hashFile(path)})
+        self.entries[item] = {'inputs': inputRecords, 'outputs': list(outputs)}
+
+    def retry(self, item):
+        '''
+        Marks an item (e.g. one that failed) to be processed again on the next run,
+        keeping its recorded outputs (e.g. from the last run that succeeded) so they can still be removed.
+        '''
+
+        if item in self.entries:
+            self.entries[item]['inputs'] = []
+
+    def forget(self, item):
+        '''
+        Removes an item from the manifest, returning its recorded outputs.
+        '''
+
+        return self.entries.pop(item, {}).get('outputs', [])
+
+    def save(self):
+        temporaryPath = self.manifestPath + '.tmp'
+        with open(temporaryPath, 'w') as fileout:
+            json.dump({'parameters': self.parameters, 'entries': self.entries}, fileout, indent=1)
+        os.replace(temporaryPath, self.manifestPath)
+
+def removeFiles(paths):
+    '''
+    Removes output files (e.g. those recorded in a Manifest) where they exist.
+    '''
+
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+def hashFile(path):
+    '''
+    Returns the SHA-256 hash of a file's content.
+    '''
+
+    contentHash = hashlib.sha256()
+    with open(path, 'rb') as filein:
+        for block in iter(lambda: filein.read(2**20), b''):
+            contentHash.update(block)
+    return contentHash.hexdigest()
+
+def printSummary(skipped, updated, removed):
+    '''
+    Prints the summary of an incremental run.
+    '''
+
+    print('Skipped (unchanged): %i; updated: %i; removed: %i'
+          %(len(skipped), len(updated), len(removed)))
+
+#------------------------------------------------------------------------------
+
+class Test(unittest.TestCase):
+
+    def testSameResultsAnyWorkers(self):
+
+        items = ['1', 'x', '3', '4', 'y', '6']
+
+        serial = runBatch(int, items, workers=1, verbose=False)
+        parallel = runBatch(int, items, workers=3, chunkSize=2, verbose=False)
+
+        self.assertEqual(serial['results'], [('1', 1), ('3', 3), ('4', 4), ('6', 6)])
+        self.assertEqual(serial['results'], parallel['results'])
+        self.assertEqual(serial['errors'], parallel['errors'])
+        self.assertEqual([x[0] for x in serial['errors']], ['x', 'y'])
+        self.assertEqual(parallel['noOfFiles'], 6)
+
+    def testTimeout(self):
+
+        info = runBatch(time.sleep, [0, 5], timeout=0.2, verbose=False)
+
+        self.assertEqual(info['results'], [(0, None)])
+        self.assertEqual(info['errors'], [(5, 'TimeoutError: Timed out')])
+        self.assertLess(info['seconds'], 5)
+
+    def testManifest(self):
+
+        import tempfile
+        with tempfile.TemporaryDirectory() as directory:
+            paths = {}
+            for name in ['a', 'b', 'c']:
+                paths[name] = [os.path.join(directory, name+'.txt')]
+                with open(paths[name][0], 'w') as fileout:
+                    fileout.write(name)
+            manifestPath = os.path.join(directory, 'manifest.json')
+
+            manifest = Manifest(manifestPath, parameters={'minRhyDenom': 8})
+            self.assertEqual(manifest.compare(paths), (['a', 'b', 'c'], [], []))
+            for name in paths:
+                manifest.record(name, paths[name], outputs=[name+'.p'])
+            manifest.save()
+
+            with open(paths['b'][0], 'w') as fileout:
+                fileout.write('changed')
+            del paths['c']
+
+            manifest = Manifest(manifestPath, parameters={'minRhyDenom': 8})
+            self.assertEqual(manifest.compare(paths), (['b'], ['a'], ['c']))
+            self.assertEqual(manifest.forget('c'), ['c.p'])
+            manifest.retry('a')
+            self.assertEqual(manifest.compare(paths), (['a', 'b'], [], []))
+            self.assertEqual(manifest.outputs('a'), ['a.p'])
+
+            manifest = Manifest(manifestPath, parameters={'minRhyDenom': 4})
+            self.assertEqual(manifest.compare(paths)[0], ['a', 'b'])
+
+#------------------------------------------------------------------------------
@@ -1,65 +1,215 @@
+import unittest
+
 from music21 import common
 from music21 import exceptions21
 from music21 import pitch
 from music21 import interval
 from music21 import stream
 from music21 import converter
+from music21 import meter
 
 from collections import Counter
+from functools import partial
 import numpy as np
 import matplotlib.pyplot as plt
+import bisect
 import csv
+import json
 import os
 
+import BatchProcessing
+import ParseCache
+import PitchClassSets
+
 #------------------------------------------------------------------------------
 
 # Make YCAC-like CSV files
 
+objectsOfInterest = ['offset', 'chord', 'primeForm', 'normalOrder', 'beatStrength']
+
 def makeYCAC(scoreFilePath='/Users/',
             scoreFileName='ClaraSchumann.xml',
             csvFilePath='/Users/',
-            csvFileName='ClaraSchumann.csv',):
-            # objectsOfInterest
+            csvFileName='ClaraSchumann.csv',
+            cache=None,
+            columns=objectsOfInterest,):
     '''
     Makes a YCAC-like CSV file for one work from an input score.
     Modelled on White and Quinn 2014, see https://ycac.yale.edu/.
     NB: not the actual code used to generate YCAC; author unaffiliated with the YCAC project.
+    Given a ParseCache, the chordified score comes from the cache (no parsing) where possible.
+    Choose the columns from those in ycacColumns.
+    For a whole corpus, see makeYCACCorpus.
     '''
 
-    objectsOfInterest=['offset', 'chord', 'primeForm', 'normalOrder', 'beatStrength']
-    # To do: more objectsOfInterest and as settable variable (select among options)
-
     with open(csvFilePath+csvFileName, 'w') as csvfile:
         csvOut = csv.writer(csvfile, delimiter=',',
                             quotechar='"', quoting=csv.QUOTE_MINIMAL)
                             # quotechar " allows commas (e.g. in prime forms) within the CSV file
 
-        csvOut.writerow([x for x in objectsOfInterest])
-        # To do: Corpus option with one header row for all
+        csvOut.writerow([x for x in columns])
+
+        for row in getFileSlices(scoreFilePath, scoreFileName, cache=cache, columns=columns):
+            csvOut.writerow(row)
 
-        score = converter.parse(scoreFilePath+scoreFileName)
-        chordScore = score.flat.stripTies().chordify()
-        for x in chordScore:
-            offset = x.offset
-            chord = x
-            primeForm = x.primeForm
-            normalOrder = x.normalOrder
-            beatStrength = x.beatStrength # Not in YCAC (based on MIDI files)
+def getFileSlices(scoreFilePath, scoreFileName, cache=None, columns=objectsOfInterest):
+    '''
+    Returns the YCAC-like rows for a score file (see getYCACSlices).
+    Given a ParseCache, the chordified score (the slow part) comes from the cache where possible,
+    whatever the columns.
+    '''
+
+    if cache is not None:
+        chordScore = cache.get(scoreFilePath+scoreFileName, 'chordified', chordifyScore)
+    else:
+        chordScore = chordifyScore(converter.parse(scoreFilePath+scoreFileName))
+    return getChordSlices(chordScore, columns=columns)
+
+def chordifyScore(score):
+    '''
+    Returns the flat, chordified score (stripped of ties),
+    with the number of the measure each chord is in as chord.editorial.measureNumber
+    (the measures themselves are flattened away).
+    '''
+
+    part = score.parts.first() if score.hasPartLikeStreams() else score
+    measures = list(part.getElementsByClass(stream.Measure))
+    measureOffsets = [x.getOffsetInHierarchy(score) for x in measures]
+
+    chordScore = score.flatten().stripTies().chordify()
+    for x in chordScore.notes:
+        i = bisect.bisect_right(measureOffsets, x.offset) - 1
+        if i >= 0:
+            x.editorial.measureNumber = measures[i].number
+    return chordScore
+
+def getYCACSlices(score, columns=objectsOfInterest):
+    '''
+    Returns the YCAC-like rows for an already parsed score:
+    one list per chordified slice with the columns chosen (by default,
+    [offset, chord, primeForm, normalOrder, beatStrength]; see ycacColumns for the options).
+    The chord is given in its string form, exactly as written to the CSV file.
+    '''
+
+    return getChordSlices(chordifyScore(score), columns=columns)
+
+def getChordSlices(chordScore, columns=objectsOfInterest):
+    '''
+    Returns the YCAC-like rows (see getYCACSlices) for an already chordified score.
+    '''
 
-            ## More options
-            # pitches = [p.nameWithOctave for p in x.pitches]
-            # file = score.metadata.title
-            # composer = score.metadata.compose
+    getters = [ycacColumns[x] for x in columns]
 
-            csvOut.writerow([offset, chord, primeForm, normalOrder, beatStrength])
+    slices = []
+    timeSignatures = list(chordScore.getElementsByClass(meter.TimeSignature))
+    timeSignatureOffsets = [x.offset for x in timeSignatures]
+    for x in chordScore.notes: # Chords only (not clefs, layout objects etc.)
+        i = bisect.bisect_right(timeSignatureOffsets, x.offset) - 1
+        timeSignature = timeSignatures[i] if i >= 0 else None
+        slices.append([getter(x, timeSignature) for getter in getters])
+
+    return slices
+
+def getBeatStrength(x, timeSignature):
+    '''
+    Returns the beatStrength of a chord in a flat, chordified stream (no measures)
+    given the time signature in force, exactly as x.beatStrength
+    but without its (slow) search for the context.
+    '''
+
+    if timeSignature is None:
+        return float('nan')
+    measureOffset = x.offset # No measures
+    timeSignatureOffset = timeSignature.offset
+    barLength = timeSignature.barDuration.quarterLength
+    if common.opFrac(measureOffset + timeSignatureOffset) < barLength:
+        meterModulus = measureOffset
+    else:
+        meterModulus = common.opFrac((measureOffset - timeSignatureOffset) % barLength)
+    return timeSignature.getAccentWeight(meterModulus, forcePositionMatch=True, permitMeterModulus=False)
+
+def getSetForms(x):
+    '''
+    Returns (primeForm, normalOrder) for a chord from the lookup table by pitch class set
+    (see PitchClassSets.makeSetTables), rather than working them out again for every slice.
+    '''
+
+    mask = PitchClassSets.pcsToMask(x.pitchClasses)
+    return PitchClassSets.primeForms[mask], PitchClassSets.normalOrders[mask]
+
+# Column name: function(chord, time signature in force) for the value in that column
+ycacColumns = {'offset': lambda x, ts: x.offset,
+               'chord': lambda x, ts: str(x),
+               'primeForm': lambda x, ts: list(getSetForms(x)[0]),
+               'normalOrder': lambda x, ts: list(getSetForms(x)[1]),
+               'beatStrength': getBeatStrength, # Not in YCAC (based on MIDI files)
+               'quarterLength': lambda x, ts: x.quarterLength,
+               'measure': lambda x, ts: x.editorial.get('measureNumber'), # See chordifyScore
+               'pitches': lambda x, ts: [p.nameWithOctave for p in x.pitches],
+               }
+
+def makeYCACCorpus(scoreFilePath='/Users/',
+                   csvFilePath='/Users/',
+                   csvFileName='corpus.csv',
+                   extension=None,
+                   combined=True,
+                   columns=objectsOfInterest,
+                   workers=1,
+                   chunkSize=None,
+                   timeout=None,
+                   cache=None,):
+    '''
+    Makes YCAC-like CSV files for all scores in a directory (or with that extension),
+    extracting the slices across a pool of worker processes (see BatchProcessing.runBatch).
+    Either one combined file, csvFileName, with a first column, 'piece', for the score file name,
+    along with its piece index (see getPieceIndex);
+    or (combined=False) one file per work, named as the score but with the .csv extension.
+    Works are written in file name order, whatever the number of workers.
+    Returns the batch summary, with 'results' as [(score file name, number of slices)].
+    '''
+
+    fileList = sorted(getFiles(scoreFilePath, extension=extension))
+    batch = ParseCache.runBatch(partial(getFileSlices, scoreFilePath, columns=columns), fileList, cache=cache,
+                                workers=workers, chunkSize=chunkSize, timeout=timeout)
+
+    if combined:
+        starts, lengths = [], []
+        rows = 0
+        with open(csvFilePath+csvFileName, 'w') as csvfile:
+            csvOut = csv.writer(csvfile, delimiter=',',
+                                quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            csvOut.writerow(['piece'] + list(columns))
+            for fileName, slices in batch['results']:
+                if not slices:
+                    continue
+                for row in slices:
+                    csvOut.writerow([fileName] + row)
+                starts.append(rows)
+                rows += len(slices)
+                if 'offset' in columns:
+                    lengths.append(slices[-1][list(columns).index('offset')])
+        if 'offset' in columns: # Exact boundaries, saved after the file so it is up to date
+            ends = starts[1:] + [rows] if starts else [] # No pieces at all if no work has slices
+            PieceIndex(starts, ends, lengths).save(csvFilePath+csvFileName + '.pieces')
+    else:
+        for fileName, slices in batch['results']:
+            with open(csvFilePath+os.path.splitext(fileName)[0]+'.csv', 'w') as csvfile:
+                csvOut = csv.writer(csvfile, delimiter=',',
+                                    quotechar='"', quoting=csv.QUOTE_MINIMAL)
+                csvOut.writerow(list(columns))
+                for row in slices:
+                    csvOut.writerow(row)
+
+    batch['results'] = [(fileName, len(slices)) for fileName, slices in batch['results']]
+    return batch
 
 #------------------------------------------------------------------------------
 
 # Use YCAC CSV files
 
-def getFiles(filePath='/Users/'):
+def getFiles(filePath='/Users/', extension='.csv'):
     '''
-    Retrieves files in the listed directory. So:
+    Retrieves files in the listed directory (those with the extension, or all for None). So:
     >>> fileList = getFiles(directory)
     >>> for fileName in fileList:
     >>>     [Any of the below functions]
@@ -67,46 +217,307 @@ def getFiles(filePath='/Users/'):
 
     fileList = []
     for file in os.listdir(filePath):
-        if file.endswith(".csv"):
+        if extension is None or file.endswith(extension):
             fileList.append(file)
     return fileList
 
+# Streaming YCAC CSV files in chunks
+
+class PitchClassSetCodes:
+    '''
+    Interns pitch class set strings (e.g. '[0, 4, 7]') as small integer codes, and back.
+    Share one instance between files (and readers) for codes that are comparable between them.
+    '''
+
+    def __init__(self, texts=()):
+        self.codes = {} # text: code
+        self.texts = [] # code: text
+        for text in texts:
+            self.code(text)
+
+    def code(self, text):
+        '''
+        Returns the code for a set (as text), adding it if new.
+        '''
+
+        code = self.codes.get(text)
+        if code is None:
+            code = len(self.texts)
+            self.codes[text] = code
+            self.texts.append(text)
+        return code
+
+    def text(self, code):
+        return self.texts[code]
+
+    def __len__(self):
+        return len(self.texts)
+
+    def __contains__(self, text):
+        return text in self.codes
+
+    def save(self, path):
+        '''
+        Writes the dictionary to a text file, one set per line (line number = code).
+        '''
+
+        with open(path, 'w') as fileout:
+            for text in self.texts:
+                fileout.write(text + '\n')
+
+    def load(self, path):
+        '''
+        Adds the sets in a dictionary file (see save), in order, to this one.
+        '''
+
+        with open(path) as filein:
+            for line in filein:
+                self.code(line.rstrip('\n'))
+        return self
+
+class YCACReader:
+    '''
+    Reads a YCAC(-like) CSV file in chunks of up to chunkSize rows, so memory use is bounded
+    whatever the size of the file. Each chunk is a dict of typed column arrays:
+    'offset' (float), 'primeForm' and 'normalOrder' (int codes; see PitchClassSetCodes),
+    and 'beatStrength' (float) where the file has it;
+    given a PieceIndex, also 'piece' (int: the number of the piece each slice is in).
+    Use as a context manager so that the file is always closed. So:
+    >>> with YCACReader(file) as reader:
+    >>>     for chunk in reader:
+    >>>         [Anything with chunk['offset'], chunk['primeForm'] ...]
+    >>> reader.codes.text(chunk['primeForm'][0])
+    '''
+
+    # Header names recognised (lower case), and positions assumed otherwise (as makeYCAC).
+    columnNames = {'offset': ('offset',),
+                   'primeForm': ('primeform',),
+                   'normalOrder': ('normalorder', 'normalform'),
+                   'beatStrength': ('beatstrength',),}
+    defaultPositions = {'offset': 0, 'primeForm': 2, 'normalOrder': 3}
+
+    def __init__(self, file, chunkSize=100000, codes=None, pieces=None):
+        self.file = file
+        self.chunkSize = chunkSize
+        self.codes = codes if codes is not None else PitchClassSetCodes()
+        self.pieces = pieces
+        self.rowsRead = 0
+
+        self.f = open(file, newline='')
+        self.reader = csv.reader(self.f)
+        header = next(self.reader, [])
+        self.positions = self.getPositions(header)
+
+    def getPositions(self, header):
+        '''
+        Returns {column: position} from the header row, where recognised, or the defaults.
+        '''
+
+        lowerHeader = [x.strip().lower() for x in header]
+        positions = {}
+        for column, names in self.columnNames.items():
+            for name in names:
+                if name in lowerHeader:
+                    positions[column] = lowerHeader.index(name)
+                    break
+            else:
+                if column in self.defaultPositions:
+                    positions[column] = self.defaultPositions[column]
+        return positions
+
+    def __iter__(self):
+        floatColumns = [x for x in ('offset', 'beatStrength') if x in self.positions]
+        codeColumns = ['primeForm', 'normalOrder']
+        code = self.codes.code
+
+        values = {column: [] for column in self.positions}
+        for row in self.reader:
+            for column in floatColumns:
+                values[column].append(float(row[self.positions[column]]))
+            for column in codeColumns:
+                values[column].append(code(row[self.positions[column]]))
+            if len(values['offset']) == self.chunkSize:
+                yield self.makeChunk(values)
+                values = {column: [] for column in self.positions}
+        if values['offset']:
+            yield self.makeChunk(values)
+
+    def makeChunk(self, values):
+        chunk = {}
+        for column, columnValues in values.items():
+            if column in ('primeForm', 'normalOrder'):
+                chunk[column] = np.array(columnValues, dtype=np.int32)
+            else:
+                chunk[column] = np.array(columnValues, dtype=np.float64)
+        if self.pieces is not None:
+            chunk['piece'] = self.pieces.pieceOf(np.arange(self.rowsRead,
+                                                           self.rowsRead + len(values['offset'])))
+        self.rowsRead += len(values['offset'])
+        return chunk
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exceptionType, exceptionValue, traceback):
+        self.close()
+
+#------------------------------------------------------------------------------
+
+# Piece boundaries
+
+class PieceIndex:
+    '''
+    Where each piece is in a YCAC(-like) file, or YCACBinary: for piece number i,
+    starts[i] and ends[i] (its first row and one after its last) and lengths[i] (its final offset).
+    Pieces are found (once; see getPieceIndex) by the step back down in offset
+    from the end of one to the start of the next. So:
+    >>> pieces = getPieceIndex(file)
+    >>> len(pieces), pieces.lengths.sum()
+    >>> pieces.sameWindow(rows, 1) # Whether each row and the next are in the same piece
+    '''
+
+    def __init__(self, starts=(), ends=(), lengths=()):
+        self.starts = np.array(starts, dtype=np.int64)
+        self.ends = np.array(ends, dtype=np.int64)
+        self.lengths = np.array(lengths, dtype=np.float64)
+        if not len(self.starts) == len(self.ends) == len(self.lengths):
+            raise ValueError('Piece starts, ends and lengths must be one per piece.')
+
+    def __len__(self):
+        return len(self.starts)
+
+    def rows(self):
+        return int(self.ends[-1]) if len(self) else 0
+
+    def pieceOf(self, rows):
+        '''
+        Returns the number of the piece each row is in.
+        '''
+
+        return np.searchsorted(self.starts, rows, side='right') - 1
+
+    def sameWindow(self, rows, n=1):
+        '''
+        Returns a boolean array: True where each row and the n after it are all in one piece.
+        '''
+
+        rows = np.asarray(rows, dtype=np.int64)
+        return rows + n < self.ends[self.pieceOf(rows)]
+
+    def save(self, path):
+        with open(path, 'w', newline='') as csvfile:
+            csvOut = csv.writer(csvfile, delimiter=',',
+                                quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            csvOut.writerow(['start', 'end', 'length'])
+            for row in zip(self.starts.tolist(), self.ends.tolist(), self.lengths.tolist()):
+                csvOut.writerow(row)
+
+    def load(self, path):
+        with open(path, newline='') as csvfile:
+            rows = list(csv.reader(csvfile))[1:]
+        self.__init__([int(x[0]) for x in rows], [int(x[1]) for x in rows], [float(x[2]) for x in rows])
+        return self
+
+def findPieces(offsetChunks, firstRow=0):
+    '''
+    Returns the PieceIndex for successive chunks (arrays) of offsets from one file,
+    with row numbers from firstRow.
+    '''
+
+    starts = []
+    lengths = []
+    rows = firstRow
+    last = np.inf # So the first row starts a piece
+    for offsets in offsetChunks:
+        if not len(offsets):
+            continue
+        previous = np.concatenate(([last], offsets[:-1]))
+        resets = np.flatnonzero(offsets < previous)
+        starts.extend((rows + resets).tolist())
+        lengths.extend(previous[resets].tolist()) # Final offset of the piece before
+        rows += len(offsets)
+        last = offsets[-1]
+
+    if starts:
+        lengths = lengths[1:] + [float(last)]
+    return PieceIndex(starts, starts[1:] + [rows] if starts else [], lengths)
+
+def getPieceIndex(file, chunkSize=100000, indexPath=None):
+    '''
+    Returns the PieceIndex for a YCAC(-like) CSV file,
+    from indexPath (by default, file + '.pieces') if it is up to date,
+    and otherwise finding it and saving it there
+    (if possible: where indexPath can't be written, e.g. a read-only directory, it is just returned).
+    '''
+
+    if indexPath is None:
+        indexPath = file + '.pieces'
+    if os.path.exists(indexPath) and os.path.getmtime(indexPath) >= os.path.getmtime(file):
+        return PieceIndex().load(indexPath)
+
+    with YCACReader(file, chunkSize=chunkSize) as reader:
+        pieces = findPieces(chunk['offset'] for chunk in reader)
+    try:
+        pieces.save(indexPath)
+    except OSError:
+        pass
+    return pieces
+
+#------------------------------------------------------------------------------
+
 # Specific Triad Types:
 def getSetsOfType(file='ClaraSchumann.csv',
-                  chordType='[0, 4, 8]',):
+                  chordType='[0, 4, 8]',
+                  chunkSize=100000):
     '''
     Get all cases of a specific chord type (expressed as PC Set).
     Returns a dict with each transposition of the chord,
     and the number of times it occurs.
     Can be applied to a single file (e.g one composer on YCAC)
     or to several (e.g. all of YCAC)
+    The file is read in chunks (see YCACReader), so memory use is bounded.
     '''
 
-    chordList = []
-
-    f = open(file)
-    next(f)
-    for row in csv.reader(f):
-        if row[2] == chordType:
-            chordList.append(row[3])
+    query = NormalOrderCounts(chordType)
+    with YCACReader(file, chunkSize=chunkSize) as reader:
+        for chunk in reader:
+            query.update(chunk, reader.codes)
 
-    chordArray = np.array(Counter(chordList)) # TODO: Maybe add most common filter?
+    chordArray = np.array(query.result(reader.codes)) # TODO: Maybe add most common filter?
     return chordArray
 
-def getAllNormals(file):
+def getAllNormals(file, chunkSize=100000):
     '''
-    Retrieves all normal orders in a file and compares relative usage
+    Retrieves all normal orders in a file and compares relative usage:
+    the list of prime forms, one per slice, read in chunks (see YCACReader).
+    For the counts alone, countAllNormals doesn't need the whole list in memory.
     '''
 
     primeList = []
-    f = open(file)
-    next(f) # to skip header line. Ossia: f.readline(), but not f.next() which is for python 2
-
-    for row in csv.reader(f):
-            primeList.append(row[2])
+    with YCACReader(file, chunkSize=chunkSize) as reader:
+        for chunk in reader:
+            primeList.extend([reader.codes.text(code) for code in chunk['primeForm'].tolist()])
 
     return primeList
 
+def countAllNormals(file, chunkSize=100000):
+    '''
+    As getAllNormals, but returns a Counter of {prime form: count},
+    accumulated chunk by chunk so that memory use is bounded.
+    So compareAllNormals(countAllNormals(file)) == compareAllNormals(getAllNormals(file)).
+    '''
+
+    codeCounts = Counter()
+    with YCACReader(file, chunkSize=chunkSize) as reader:
+        for chunk in reader:
+            uniqueCodes, counts = np.unique(chunk['primeForm'], return_counts=True)
+            codeCounts.update(dict(zip(uniqueCodes.tolist(), counts.tolist())))
+
+    return Counter({reader.codes.text(code): count for code, count in codeCounts.items()})
+
 def compareAllNormals(primeList,
                       triadsOfInterest=('major','minor'),
                       Counts=True,
@@ -115,10 +526,20 @@ def compareAllNormals(primeList,
     Compares relative usage of triad types in a file
     expressed in terms of counts, proportion of the whole, or both.
     Options: 'major', 'minor', 'diminished', 'augmented', 'triads' (all of the above)
+    primeList can also be a Counter, as returned by countAllNormals.
     '''
 
-    overallInfo = []
-    total = len(primeList)
+    hitList = getHitList(triadsOfInterest)
+    counts = Counter(primeList) # One pass, for all triads
+    total = sum(counts.values())
+
+    return tabulateCounts(counts, total, hitList, Counts=Counts, Proportions=Proportions)
+
+def getHitList(triadsOfInterest=('major','minor')):
+    '''
+    Returns the prime forms (as text) for triad types:
+    'major', 'minor', 'diminished', 'augmented', 'triads' (all of the above)
+    '''
 
     hitList = []
     if 'major' in triadsOfInterest:
@@ -130,18 +551,27 @@ def compareAllNormals(primeList,
     if 'augmented' in triadsOfInterest:
         hitList.append('[0, 4, 8]')
     if 'triads' in triadsOfInterest:
-        hitList.append('[0, 4, 7]', '[0, 3, 7]', '[0, 3, 6]', '[0, 4, 8]')
+        hitList.extend(['[0, 4, 7]', '[0, 3, 7]', '[0, 3, 6]', '[0, 4, 8]'])
         #To do: generalise wider than triads?
         #'Diminished Seventh', '[0, 3, 6, 9]'
     if hitList == []:
         print ("Please chose one or more triad types")
         #: 'major', 'minor', 'diminished', 'augmented', 'triads' (all of the above)")
 
+    return hitList
+
+def tabulateCounts(counts, total, hitList, Counts=True, Proportions=True):
+    '''
+    Lays out counts (a dict of {triad: count}) as compareAllNormals:
+    [('Overall', total), (triad+' Count', count), (triad+' Proportion', proportion), ...]
+    '''
+
+    overallInfo = []
     if Counts:
         currentTuple = ('Overall', total)
         overallInfo.append(currentTuple)
     for triad in hitList:
-        currentCount = primeList.count(triad)
+        currentCount = counts.get(triad, 0)
         if Counts:
             currentName = triad+' Count'
             currentTuple = (currentName, currentCount)
@@ -152,46 +582,24 @@ def compareAllNormals(primeList,
             overallInfo.append(currentTuple)
     return overallInfo
 
-def offsetPositions(file):
+def offsetPositions(file, chunkSize=100000):
     '''
     Gets usage counts for augmented chord slices
     and the same weighted for 'length' (though NB issues with IOI length in YCAC)
+    The file is read in chunks (see LengthWeightedProportion), so memory use is bounded.
     '''
 
-    offs = []
-    allNorms = []
-    augs = []
-
-    f = open(file)
-    next(f)
-    for row in csv.reader(f):
-        offs.append(float(row[0])) # all offsets
-        allNorms.append(row[2]) # all normal forms
-
-    #Get piece lengths by the sudden step back down to (or near) 0.
-    totals = []
-    for index, i in enumerate(offs):
-        if i < offs[index - 1]:
-            totals.append(offs[index - 1])
-
-    #Get position info for all augmenteds
-    positions = []
-    for i in [i for i,x in enumerate(allNorms) if x == '[0, 4, 8]']:
-        positions.append(i)
-
-    #Retrieve relevant offset values and subtract using position info all augmenteds
-    for p in positions:
-    ##    print(offs[p+1]-offs[p])
-        if offs[p+1]-offs[p] > 0: #Work around in case of last chord in piece (e.g. maj / min)
-            augs.append(offs[p+1]-offs[p])
-
-    returnInfo = {'No. of Works': len(totals),
-                  'No. of Augmented Slices': len(augs),
-                  'Total Slices': len(offs),
-                  'Count Proportion': len(augs)/len(offs),
-                  'Total augs weighted for length': sum(augs),
-                  'Total overall weighted for length': sum(totals),
-                  'Weighted Proportion': sum(augs)/sum(totals),}
+    engine = YCACQueryEngine(chunkSize=chunkSize)
+    engine.register('augs', LengthWeightedProportion('[0, 4, 8]'))
+    info = engine.run(file)['augs']
+
+    returnInfo = {'No. of Works': info['No. of Works'],
+                  'No. of Augmented Slices': info['No. of Slices of Type'],
+                  'Total Slices': info['Total Slices'],
+                  'Count Proportion': info['Count Proportion'],
+                  'Total augs weighted for length': info['Total of Type weighted for length'],
+                  'Total overall weighted for length': info['Total overall weighted for length'],
+                  'Weighted Proportion': info['Weighted Proportion'],}
 
     return returnInfo
 
@@ -199,35 +607,18 @@ def whatFollows(file,
                 targetChord = '[0, 4, 8]',
                 histogram=True,
                 howMany=15,
-                ignoreFirst=True):
+                ignoreFirst=True,
+                chunkSize=100000):
     '''
-    Get data for the chords which follow an input target chord of interest.
+    Get data for the chords which follow an input target chord of interest
+    (within the same piece).
     Optionally, return a histogram for the most common.
+    The file is read in chunks (see Successors), so memory use is bounded.
     '''
 
-    f = open(file)
-    next(f)
-
-    pcs = []
-    for row in csv.reader(f):
-        pcs.append(row[3])
-
-    #Get position info for targetChord
-    positions = []
-    for i in [i for i,x in enumerate(pcs) if x == targetChord]:
-        positions.append(i)
-
-
-    #Retrieve following chord
-    following = []
-    for p in positions:
-        following.append(pcs[p+1])
-
-    if ignoreFirst==True:
-        value=1
-    else:
-        value=0
-    count = Counter(following).most_common()[value:15:1]
+    engine = YCACQueryEngine(chunkSize=chunkSize)
+    engine.register('following', Successors(targetChord, howMany=howMany, ignoreFirst=ignoreFirst))
+    count = engine.run(file)['following']
 
     if histogram==False:
         return count
@@ -248,3 +639,1062 @@ def whatFollows(file,
         return plt
 
 #------------------------------------------------------------------------------
+
+# Binary, columnar YCAC format
+
+def writeYCACBinary(files, binaryPath, chunkSize=100000):
+    '''
+    Converts YCAC(-like) CSV files (e.g. from makeYCAC, or the YCAC itself)
+    to a binary, columnar format in the directory binaryPath, appending if it already exists:
+    offset.f8 and beatStrength.f8 (little-endian float64; NaN where there's no beatStrength column),
+    primeForm.u2 and normalOrder.u2 (little-endian uint16 codes) for every slice in turn;
+    codes.txt, the dictionary of pitch class sets for those codes (see PitchClassSetCodes);
+    sources.csv, each source file and its number of slices.
+    Read with YCACBinary.
+    '''
+
+    if isinstance(files, str):
+        files = [files]
+    os.makedirs(binaryPath, exist_ok=True)
+
+    codes = PitchClassSetCodes()
+    codesPath = os.path.join(binaryPath, 'codes.txt')
+    if os.path.exists(codesPath):
+        codes.load(codesPath)
+
+    for file in files:
+        with YCACReader(file, chunkSize=chunkSize, codes=codes) as reader:
+            for chunk in reader:
+                if len(codes) > 2**16:
+                    raise ValueError('Too many distinct pitch class sets for uint16 codes.')
+                length = len(chunk['offset'])
+                columns = {'offset': chunk['offset'],
+                           'beatStrength': chunk.get('beatStrength', np.full(length, np.nan)),
+                           'primeForm': chunk['primeForm'],
+                           'normalOrder': chunk['normalOrder'],}
+                for column, values in columns.items():
+                    dtype = YCACBinary.dtypes[column]
+                    with open(os.path.join(binaryPath, column + '.' + dtype[1:]), 'ab') as fileout:
+                        fileout.write(values.astype(dtype).tobytes())
+            rowsRead = reader.rowsRead
+
+        with open(os.path.join(binaryPath, 'sources.csv'), 'a', newline='') as csvfile:
+            csvOut = csv.writer(csvfile, delimiter=',',
+                                quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            csvOut.writerow([file, rowsRead])
+
+    codes.save(codesPath)
+
+class YCACBinary:
+    '''
+    Reads the binary, columnar YCAC format (see writeYCACBinary) by memory map, so loading is
+    immediate and filtering is a vectorised comparison on the codes. So:
+    >>> ycac = YCACBinary(binaryPath)
+    >>> augs = ycac.rows(primeForm='[0, 4, 8]') # Positions of all augmented triad slices
+    >>> ycac.offset[augs]
+    '''
+
+    dtypes = {'offset': '<f8',
+              'beatStrength': '<f8',
+              'primeForm': '<u2',
+              'normalOrder': '<u2',}
+
+    def __init__(self, binaryPath):
+        self.binaryPath = binaryPath
+        self.codes = PitchClassSetCodes().load(os.path.join(binaryPath, 'codes.txt'))
+
+        for column, dtype in self.dtypes.items():
+            columnPath = os.path.join(binaryPath, column + '.' + dtype[1:])
+            if os.path.getsize(columnPath):
+                values = np.memmap(columnPath, dtype=dtype, mode='r')
+            else:
+                values = np.array([], dtype=dtype)
+            setattr(self, column, values)
+
+        self.sources = []
+        with open(os.path.join(binaryPath, 'sources.csv'), newline='') as csvfile:
+            for row in csv.reader(csvfile):
+                self.sources.append((row[0], int(row[1])))
+
+        self.pieces = self.getPieces()
+
+    def getPieces(self):
+        '''
+        Returns the PieceIndex (pieces never span two source files),
+        from binaryPath/pieces.csv if it is up to date, and otherwise finding it and saving it there
+        (if possible, as for getPieceIndex).
+        '''
+
+        indexPath = os.path.join(self.binaryPath, 'pieces.csv')
+        if os.path.exists(indexPath):
+            pieces = PieceIndex().load(indexPath)
+            if pieces.rows() == len(self):
+                return pieces
+
+        starts, ends, lengths = [], [], []
+        firstRow = 0
+        for source, noOfRows in self.sources:
+            sourcePieces = findPieces([self.offset[firstRow:firstRow + noOfRows]], firstRow=firstRow)
+            starts.extend(sourcePieces.starts)
+            ends.extend(sourcePieces.ends)
+            lengths.extend(sourcePieces.lengths)
+            firstRow += noOfRows
+        pieces = PieceIndex(starts, ends, lengths)
+        try:
+            pieces.save(indexPath)
+        except OSError:
+            pass
+        return pieces
+
+    def __len__(self):
+        return len(self.offset)
+
+    def code(self, text):
+        '''
+        Returns the code for a set (as text), or -1 if it does not occur at all.
+        '''
+
+        return self.codes.codes.get(text, -1)
+
+    def mask(self, primeForm=None, normalOrder=None):
+        '''
+        Returns a boolean array: True for the slices of this primeForm and / or normalOrder.
+        '''
+
+        selected = np.ones(len(self), dtype=bool)
+        if primeForm is not None:
+            selected &= self.primeForm == self.code(primeForm)
+        if normalOrder is not None:
+            selected &= self.normalOrder == self.code(normalOrder)
+        return selected
+
+    def rows(self, primeForm=None, normalOrder=None):
+        '''
+        Returns the positions of the slices of this primeForm and / or normalOrder.
+        '''
+
+        return np.flatnonzero(self.mask(primeForm=primeForm, normalOrder=normalOrder))
+
+    def texts(self, column, positions=None):
+        '''
+        Returns the sets (as text) in the primeForm or normalOrder column (at positions, if given).
+        '''
+
+        values = getattr(self, column)
+        if positions is not None:
+            values = values[positions]
+        return [self.codes.texts[x] for x in values.tolist()]
+
+def mapPieces(function, binaryPath, workers=1, chunkSize=None, timeout=None, verbose=False):
+    '''
+    Applies function(ycac, start, end) to each piece in a YCACBinary (its rows from start to end)
+    across a pool of worker processes (see BatchProcessing.runBatch), returning the batch dict:
+    'results' are [(piece number, result)] in piece order. So:
+    >>> info = mapPieces(countAugs, binaryPath, workers=None)
+    NB: function must be picklable (i.e. defined at the top level of a module) for workers > 1.
+    '''
+
+    noOfPieces = len(YCACBinary(binaryPath).pieces)
+    return BatchProcessing.runBatch(partial(doOnePiece, function, binaryPath), range(noOfPieces),
+                                    workers=workers, chunkSize=chunkSize, timeout=timeout,
+                                    verbose=verbose)
+
+def doOnePiece(function, binaryPath, piece):
+    ycac = YCACBinary(binaryPath) # Memory mapped, so quick to open in each worker
+    return function(ycac, int(ycac.pieces.starts[piece]), int(ycac.pieces.ends[piece]))
+
+class PitchClassSetIndex:
+    '''
+    Inverted index from each prime form and normal order to the positions of its slices
+    in a YCACBinary, built once and saved alongside it (in binaryPath/index/).
+    Queries take time in proportion to the number of hits (or of distinct sets), not of slices.
+    So:
+    >>> index = PitchClassSetIndex(YCACBinary(binaryPath))
+    >>> index.count(primeForm='[0, 4, 8]')
+    >>> index.transpositions('[0, 4, 8]') # As getSetsOfType
+    >>> index.supersets([0, 4, 7]) # Every slice containing a major triad
+    '''
+
+    columns = ('primeForm', 'normalOrder')
+
+    def __init__(self, ycac):
+        self.ycac = ycac
+        self.indexPath = os.path.join(ycac.binaryPath, 'index')
+        try:
+            self.load()
+        except (OSError, ValueError):
+            self.build()
+            self.save()
+
+    def build(self):
+        '''
+        Builds the index: for each column, slice positions sorted by code (then by position),
+        and where each code starts in them.
+        '''
+
+        noOfCodes = len(self.ycac.codes)
+        self.arrays = {}
+        for column in self.columns:
+            values = getattr(self.ycac, column)
+            positions = np.argsort(values, kind='stable').astype(np.int64)
+            starts = np.concatenate(([0], np.cumsum(np.bincount(values, minlength=noOfCodes))))
+            self.arrays[column + 'Positions'] = positions
+            self.arrays[column + 'Starts'] = starts.astype(np.int64)
+
+        # Prime form of each normal order (from its first slice); -1 for codes not used as such.
+        starts = self.arrays['normalOrderStarts']
+        used = starts[1:] > starts[:-1]
+        normalToPrime = np.full(noOfCodes, -1, dtype=np.int64)
+        firstSlices = self.arrays['normalOrderPositions'][starts[:-1][used]]
+        normalToPrime[used] = self.ycac.primeForm[firstSlices]
+        self.arrays['normalToPrime'] = normalToPrime
+
+        self.arrays['masks'] = np.array([PitchClassSets.textToMask(x) for x in self.ycac.codes.texts],
+                                        dtype=np.int64)
+
+    def save(self):
+        os.makedirs(self.indexPath, exist_ok=True)
+        for name, values in self.arrays.items():
+            np.save(os.path.join(self.indexPath, name + '.npy'), values)
+
+    def load(self):
+        '''
+        Loads a saved index (by memory map), checking that it is for the current data.
+        '''
+
+        self.arrays = {}
+        for name in [x + y for x in self.columns for y in ('Positions', 'Starts')] + ['normalToPrime', 'masks']:
+            self.arrays[name] = np.load(os.path.join(self.indexPath, name + '.npy'), mmap_mode='r')
+        for column in self.columns:
+            starts = self.arrays[column + 'Starts']
+            if len(starts) != len(self.ycac.codes) + 1 or starts[-1] != len(self.ycac):
+                raise ValueError('Index out of date')
+
+    def codePositions(self, column, code):
+        starts = self.arrays[column + 'Starts']
+        if code < 0 or code >= len(starts) - 1:
+            return np.array([], dtype=np.int64)
+        return self.arrays[column + 'Positions'][starts[code]:starts[code + 1]]
+
+    def positions(self, primeForm=None, normalOrder=None):
+        '''
+        Returns the (sorted) positions of the slices of this primeForm and / or normalOrder.
+        '''
+
+        if normalOrder is not None:
+            hits = self.codePositions('normalOrder', self.ycac.code(normalOrder))
+            if primeForm is not None:
+                hits = hits[self.ycac.primeForm[hits] == self.ycac.code(primeForm)]
+            return hits
+        if primeForm is not None:
+            return self.codePositions('primeForm', self.ycac.code(primeForm))
+        return np.arange(len(self.ycac))
+
+    def count(self, primeForm=None, normalOrder=None):
+        return len(self.positions(primeForm=primeForm, normalOrder=normalOrder))
+
+    def transpositions(self, primeForm='[0, 4, 8]'):
+        '''
+        Returns a Counter of the normal orders (i.e. transpositions) of a prime form,
+        as getSetsOfType.
+        '''
+
+        starts = self.arrays['normalOrderStarts']
+        codes = np.flatnonzero(self.arrays['normalToPrime'] == self.ycac.code(primeForm))
+        return Counter({self.ycac.codes.texts[code]: int(starts[code + 1] - starts[code])
+                        for code in codes.tolist()})
+
+    def supersets(self, pcs, transpose=True, inversions=False):
+        '''
+        Returns the positions of all slices containing the pitch classes pcs (list or text),
+        or, by default, any transposition of them (and, optionally, inversion).
+        '''
+
+        return self.matchingPositions(pcs, transpose, inversions, lambda masks, q: masks & q == q)
+
+    def subsets(self, pcs, transpose=True, inversions=False):
+        '''
+        Returns the positions of all slices contained within the pitch classes pcs (list or text),
+        or, by default, any transposition of them (and, optionally, inversion).
+        '''
+
+        return self.matchingPositions(pcs, transpose, inversions, lambda masks, q: masks & ~q == 0)
+
+    def matchingPositions(self, pcs, transpose, inversions, test):
+        if isinstance(pcs, str):
+            pcs = PitchClassSets.textToPcs(pcs)
+        queryMask = PitchClassSets.pcsToMask(pcs)
+        if transpose:
+            queryMasks = PitchClassSets.allTranspositions(queryMask, inversions=inversions)
+        elif inversions:
+            queryMasks = [queryMask, PitchClassSets.invertMask(queryMask)]
+        else:
+            queryMasks = [queryMask]
+
+        masks = np.asarray(self.arrays['masks'])
+        matches = np.zeros(len(masks), dtype=bool)
+        for q in queryMasks:
+            matches |= test(masks, q)
+
+        # Normal order codes only (prime forms may be absent from / misleading for the slices).
+        starts = self.arrays['normalOrderStarts']
+        hits = [self.codePositions('normalOrder', code) for code in np.flatnonzero(matches).tolist()
+                if starts[code + 1] > starts[code]]
+        if not hits:
+            return np.array([], dtype=np.int64)
+        return np.sort(np.concatenate(hits))
+
+#------------------------------------------------------------------------------
+
+# Several questions, one reading
+
+class YCACQueryEngine:
+    '''
+    Runs several queries over one or more YCAC(-like) CSV files in one scan of each file,
+    returning all the results at the end. So:
+    >>> engine = YCACQueryEngine()
+    >>> engine.register('triads', SetTypeCounts(('major', 'minor')))
+    >>> engine.register('augPositions', LengthWeightedProportion('[0, 4, 8]'))
+    >>> engine.register('afterAug', Successors('[0, 4, 8]'))
+    >>> results = engine.run(fileList)
+    >>> results['afterAug']
+    '''
+
+    def __init__(self, chunkSize=100000):
+        self.chunkSize = chunkSize
+        self.codes = PitchClassSetCodes() # Shared by all files
+        self.queries = {}
+
+    def register(self, name, query):
+        self.queries[name] = query
+
+    def run(self, files):
+        '''
+        Scans the file (or each of a list of files) once, for all queries.
+        Chunks include the piece column (see getPieceIndex).
+        '''
+
+        if isinstance(files, str):
+            files = [files]
+
+        for file in files:
+            pieces = getPieceIndex(file, chunkSize=self.chunkSize)
+            with YCACReader(file, chunkSize=self.chunkSize, codes=self.codes, pieces=pieces) as reader:
+                for query in self.queries.values():
+                    query.startFile()
+                for chunk in reader:
+                    for query in self.queries.values():
+                        query.update(chunk, self.codes)
+                for query in self.queries.values():
+                    query.endFile()
+
+        return {name: query.result(self.codes) for name, query in self.queries.items()}
+
+class YCACQuery:
+    '''
+    Base class for queries run by YCACQueryEngine:
+    update() is called with each chunk of each file in turn (see YCACReader),
+    startFile() and endFile() around each file, and result() once at the end.
+    '''
+
+    def startFile(self):
+        pass
+
+    def update(self, chunk, codes):
+        raise NotImplementedError
+
+    def endFile(self):
+        pass
+
+    def result(self, codes):
+        raise NotImplementedError
+
+class SetTypeCounts(YCACQuery):
+    '''
+    Counts and / or proportions of triad types by prime form, as compareAllNormals.
+    '''
+
+    def __init__(self, triadsOfInterest=('major','minor'), Counts=True, Proportions=True):
+        self.hitList = getHitList(triadsOfInterest)
+        self.Counts = Counts
+        self.Proportions = Proportions
+        self.codeCounts = Counter()
+        self.total = 0
+
+    def update(self, chunk, codes):
+        uniqueCodes, counts = np.unique(chunk['primeForm'], return_counts=True)
+        self.codeCounts.update(dict(zip(uniqueCodes.tolist(), counts.tolist())))
+        self.total += len(chunk['primeForm'])
+
+    def result(self, codes):
+        counts = {codes.text(code): count for code, count in self.codeCounts.items()}
+        return tabulateCounts(counts, self.total, self.hitList,
+                              Counts=self.Counts, Proportions=self.Proportions)
+
+class NormalOrderCounts(YCACQuery):
+    '''
+    Histogram of the normal orders (i.e. transpositions) of one chord type (prime form),
+    as getSetsOfType.
+    '''
+
+    def __init__(self, chordType='[0, 4, 8]'):
+        self.chordType = chordType
+        self.codeCounts = Counter()
+
+    def update(self, chunk, codes):
+        hits = chunk['normalOrder'][chunk['primeForm'] == codes.code(self.chordType)]
+        uniqueCodes, counts = np.unique(hits, return_counts=True)
+        self.codeCounts.update(dict(zip(uniqueCodes.tolist(), counts.tolist())))
+
+    def result(self, codes):
+        return Counter({codes.text(code): count for code, count in self.codeCounts.items()})
+
+class Successors(YCACQuery):
+    '''
+    The chords (normal orders) which follow a target chord (normal order) within a piece,
+    most common first, as whatFollows (without the histogram).
+    '''
+
+    def __init__(self, targetChord='[0, 4, 8]', howMany=15, ignoreFirst=True):
+        self.targetChord = targetChord
+        self.howMany = howMany
+        self.ignoreFirst = ignoreFirst
+        self.codeCounts = Counter()
+        self.previous = None # (code, piece) for the last slice of the previous chunk
+
+    def startFile(self):
+        self.previous = None
+
+    def update(self, chunk, codes):
+        normals = chunk['normalOrder']
+        pieces = chunk['piece']
+        if self.previous is not None:
+            normals = np.concatenate(([self.previous[0]], normals))
+            pieces = np.concatenate(([self.previous[1]], pieces))
+        isFollowing = (normals[:-1] == codes.code(self.targetChord)) & (pieces[:-1] == pieces[1:])
+        uniqueCodes, counts = np.unique(normals[1:][isFollowing], return_counts=True)
+        self.codeCounts.update(dict(zip(uniqueCodes.tolist(), counts.tolist())))
+        self.previous = (normals[-1], pieces[-1])
+
+    def result(self, codes):
+        count = Counter({codes.text(code): count for code, count in self.codeCounts.items()})
+        value = 1 if self.ignoreFirst else 0
+        return count.most_common()[value:self.howMany]
+
+class LengthWeightedProportion(YCACQuery):
+    '''
+    Usage of one chord type (prime form) as a proportion of all slices,
+    both by count and weighted for 'length' (the time to the next slice), as offsetPositions.
+    '''
+
+    def __init__(self, chordType='[0, 4, 8]'):
+        self.chordType = chordType
+        self.noOfType = 0 # Slices of this type (except the last of a piece) ...
+        self.typeLength = 0.0 # ... and their total length
+        self.noOfPieces = 0
+        self.totalLength = 0.0 # Of the pieces (i.e. their final offsets)
+        self.totalSlices = 0
+        self.previous = None # (offset, isType, piece) for the last slice of the previous chunk
+
+    def startFile(self):
+        self.previous = None
+
+    def update(self, chunk, codes):
+        offsets = chunk['offset']
+        isType = chunk['primeForm'] == codes.code(self.chordType)
+        pieces = chunk['piece']
+        if self.previous is not None:
+            offsets = np.concatenate(([self.previous[0]], offsets))
+            isType = np.concatenate(([self.previous[1]], isType))
+            pieces = np.concatenate(([self.previous[2]], pieces))
+
+        steps = offsets[1:] - offsets[:-1]
+        samePiece = pieces[:-1] == pieces[1:]
+        typeSteps = steps[isType[:-1] & samePiece] # Not the last chord of a piece
+        self.noOfType += len(typeSteps)
+        self.typeLength += float(typeSteps.sum())
+        self.noOfPieces += int((~samePiece).sum())
+        self.totalLength += float(offsets[:-1][~samePiece].sum()) # Last offset of each piece
+
+        self.totalSlices += len(chunk['offset'])
+        self.previous = (offsets[-1], isType[-1], pieces[-1])
+
+    def endFile(self):
+        if self.previous is not None: # End of the last piece
+            self.noOfPieces += 1
+            self.totalLength += float(self.previous[0])
+
+    def result(self, codes):
+        returnInfo = {'No. of Works': self.noOfPieces,
+                      'No. of Slices of Type': self.noOfType,
+                      'Total Slices': self.totalSlices,
+                      'Count Proportion': self.noOfType/self.totalSlices,
+                      'Total of Type weighted for length': self.typeLength,
+                      'Total overall weighted for length': self.totalLength,
+                      'Weighted Proportion': self.typeLength/self.totalLength,}
+        return returnInfo
+
+#------------------------------------------------------------------------------
+
+# Chord succession n-grams
+
+class ChordNgramModel(YCACQuery):
+    '''
+    Chord succession model: for each order n from 1 to maxOrder, the counts of the chord
+    which follows each context of n consecutive chords (normal orders by default).
+    N-grams do not cross from one piece (see getPieceIndex) or file to the next.
+    Counts are sparse matrices (contexts x chords) over interned set codes
+    (scipy.sparse: imported here only, so the rest of the module works without scipy).
+    Built in one pass, alone or alongside other queries in a YCACQueryEngine. So:
+    >>> model = ChordNgramModel.build(fileList, maxOrder=4)
+    >>> model.successors('[0, 4, 8]', k=15) # As whatFollows
+    >>> model.successors(['[7, 11, 2]', '[0, 4, 7]']) # What follows V-I in C
+    >>> model.predecessors('[0, 4, 7]', order=2)
+    >>> model.probability('[7, 11, 2]', '[0, 4, 7]')
+    >>> bothComposers = bachModel.merge(mozartModel)
+    '''
+
+    def __init__(self, maxOrder=4, column='normalOrder'):
+        if not 1 <= maxOrder <= 4: # Contexts packed into 64 bits: 16 per code
+            raise ValueError('maxOrder must be from 1 to 4.')
+        from scipy import sparse
+        self.maxOrder = maxOrder
+        self.column = column
+        self.codes = PitchClassSetCodes()
+        self.contextIds = {n: {} for n in self.orders()} # Context (packed; see packContexts): row
+        self.contexts = {n: [] for n in self.orders()} # Row: context
+        self.counts = {n: sparse.csr_matrix((0, 0), dtype=np.int64) for n in self.orders()}
+        self.pending = {n: [] for n in self.orders()} # (rows, columns, counts) not yet in counts
+        self.columnCounts = {n: None for n in self.orders()} # CSC copies of counts, for predecessors
+        self.previous = None # Last codes and pieces of the previous chunk
+
+    def orders(self):
+        return range(1, self.maxOrder + 1)
+
+    @classmethod
+    def build(cls, files, maxOrder=4, column='normalOrder', chunkSize=100000):
+        '''
+        Builds a model from one or more YCAC(-like) CSV files.
+        '''
+
+        engine = YCACQueryEngine(chunkSize=chunkSize)
+        engine.register('ngrams', cls(maxOrder=maxOrder, column=column))
+        return engine.run(files)['ngrams']
+
+    # Building
+
+    def startFile(self):
+        self.previous = None
+
+    def update(self, chunk, codes):
+        self.codes = codes
+        values = chunk[self.column]
+        pieces = chunk['piece']
+        carried = 0
+        if self.previous is not None:
+            carried = len(self.previous[0])
+            values = np.concatenate((self.previous[0], values))
+            pieces = np.concatenate((self.previous[1], pieces))
+
+        for n in self.orders():
+            if len(values) <= n:
+                continue
+            windows = np.lib.stride_tricks.sliding_window_view(values, n + 1)
+            starts = np.arange(len(windows))
+            keep = (starts + n >= carried) & (pieces[starts] == pieces[starts + n])
+            windows = windows[keep]
+            if len(windows):
+                rows = self.internContexts(n, windows[:, :n])
+                self.pending[n].append((rows, windows[:, n], np.ones(len(rows), dtype=np.int64)))
+                self.columnCounts[n] = None
+
+        self.previous = (values[-self.maxOrder:], pieces[-self.maxOrder:])
+
+    def internContexts(self, n, contextArray):
+        '''
+        Returns the rows for an array of contexts (one per line), adding any new ones.
+        '''
+
+        uniqueKeys, inverse = np.unique(packContexts(contextArray), return_inverse=True)
+        contextIds = self.contextIds[n]
+        ids = np.empty(len(uniqueKeys), dtype=np.int64)
+        for i, key in enumerate(uniqueKeys.tolist()):
+            row = contextIds.get(key)
+            if row is None:
+                row = len(self.contexts[n])
+                contextIds[key] = row
+                self.contexts[n].append(unpackContext(key, n))
+            ids[i] = row
+        return ids[inverse.reshape(-1)]
+
+    def endFile(self):
+        self.fold()
+
+    def fold(self):
+        '''
+        Adds pending counts to the count matrices, and makes column-wise (CSC) copies of any changed.
+        '''
+
+        from scipy import sparse
+        for n in self.orders():
+            shape = (len(self.contexts[n]), len(self.codes))
+            if self.counts[n].shape != shape:
+                self.counts[n].resize(shape)
+                self.columnCounts[n] = None
+            if self.pending[n]:
+                rows, columns, counts = [np.concatenate(x) for x in zip(*self.pending[n])]
+                newCounts = sparse.coo_matrix((counts, (rows, columns)), shape=shape).tocsr()
+                self.counts[n] = (self.counts[n] + newCounts).tocsr()
+                self.pending[n] = []
+                self.columnCounts[n] = None
+            self.counts[n].sum_duplicates() # Also sorts indices
+            if self.columnCounts[n] is None:
+                self.columnCounts[n] = self.counts[n].tocsc()
+
+    def result(self, codes):
+        self.codes = codes
+        self.fold()
+        return self
+
+    # Queries
+
+    def contextRow(self, context):
+        '''
+        Returns (order, row) for a context: one set (as text) or a sequence of them.
+        The row is None if the context never occurs.
+        '''
+
+        if isinstance(context, str):
+            context = [context]
+        n = len(context)
+        if n not in self.counts:
+            raise ValueError('Contexts must be from 1 to %i chords long.' %self.maxOrder)
+        codes = [self.codes.codes.get(x) for x in context]
+        if None in codes:
+            return n, None
+        return n, self.contextIds[n].get(int(packContexts(np.array([codes]))[0]))
+
+    def contextText(self, n, row):
+        texts = tuple(self.codes.texts[x] for x in self.contexts[n][row])
+        return texts[0] if n == 1 else texts
+
+    def topK(self, labels, counts, k, ignoreFirst):
+        order = np.argsort(-counts, kind='stable')
+        value = 1 if ignoreFirst else 0
+        return [(labels(i), int(counts[i])) for i in order[value:k].tolist()]
+
+    def successors(self, context, k=15, ignoreFirst=False):
+        '''
+        Returns the k most common chords to follow a context, as [(set, count)], most common first.
+        ignoreFirst skips the most common (e.g. the chord repeated), as whatFollows.
+        '''
+
+        n, row = self.contextRow(context)
+        if row is None:
+            return []
+        matrix = self.counts[n]
+        columns = matrix.indices[matrix.indptr[row]:matrix.indptr[row + 1]]
+        counts = matrix.data[matrix.indptr[row]:matrix.indptr[row + 1]]
+        return self.topK(lambda i: self.codes.texts[columns[i]], counts, k, ignoreFirst)
+
+    def predecessors(self, chord, k=15, order=1, ignoreFirst=False):
+        '''
+        Returns the k most common contexts of order chords to precede a chord,
+        as [(set or tuple of sets, count)], most common first.
+        '''
+
+        code = self.codes.codes.get(chord)
+        if code is None or order not in self.counts:
+            return []
+        if self.columnCounts[order] is None:
+            self.fold()
+        matrix = self.columnCounts[order]
+        rows = matrix.indices[matrix.indptr[code]:matrix.indptr[code + 1]]
+        counts = matrix.data[matrix.indptr[code]:matrix.indptr[code + 1]]
+        return self.topK(lambda i: self.contextText(order, rows[i]), counts, k, ignoreFirst)
+
+    def probability(self, context, chord):
+        '''
+        Returns the probability of a chord following a context (0.0 for a context never seen).
+        '''
+
+        n, row = self.contextRow(context)
+        code = self.codes.codes.get(chord)
+        if row is None or code is None:
+            return 0.0
+        matrix = self.counts[n]
+        return matrix[row, code] / matrix.data[matrix.indptr[row]:matrix.indptr[row + 1]].sum()
+
+    def probabilities(self, context):
+        '''
+        Returns {set: probability} for all chords which follow a context.
+        '''
+
+        successors = self.successors(context, k=None)
+        total = sum([x[1] for x in successors])
+        return {text: count / total for text, count in successors}
+
+    # Combining and storing
+
+    def merge(self, other):
+        '''
+        Returns a new model with the counts of both (e.g. per-composer models), whatever their codes.
+        '''
+
+        if other.column != self.column:
+            raise ValueError('Cannot merge models of different columns.')
+        merged = ChordNgramModel(maxOrder=min(self.maxOrder, other.maxOrder), column=self.column)
+        for model in (self, other):
+            recode = np.array([merged.codes.code(x) for x in model.codes.texts], dtype=np.int64)
+            for n in merged.orders():
+                counts = model.counts[n].tocoo()
+                if not counts.nnz:
+                    continue
+                contextArray = recode[np.array(model.contexts[n], dtype=np.int64)]
+                rows = merged.internContexts(n, contextArray)
+                merged.pending[n].append((rows[counts.row], recode[counts.col], counts.data))
+        merged.fold()
+        return merged
+
+    def save(self, path):
+        '''
+        Writes the model to the directory path: model.json, codes.txt, and
+        for each order n, counts{n}.npz (sparse) and contexts{n}.npy.
+        '''
+
+        from scipy import sparse
+        self.fold()
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, 'model.json'), 'w') as fileout:
+            json.dump({'maxOrder': self.maxOrder, 'column': self.column}, fileout)
+        self.codes.save(os.path.join(path, 'codes.txt'))
+        for n in self.orders():
+            sparse.save_npz(os.path.join(path, 'counts%i.npz' %n), self.counts[n])
+            np.save(os.path.join(path, 'contexts%i.npy' %n),
+                    np.array(self.contexts[n], dtype=np.int64).reshape(-1, n))
+
+    def load(self, path):
+        '''
+        Reads a model written by save, replacing this one's counts.
+        '''
+
+        from scipy import sparse
+        with open(os.path.join(path, 'model.json')) as filein:
+            info = json.load(filein)
+        self.__init__(maxOrder=info['maxOrder'], column=info['column'])
+        self.codes.load(os.path.join(path, 'codes.txt'))
+        for n in self.orders():
+            self.counts[n] = sparse.load_npz(os.path.join(path, 'counts%i.npz' %n)).tocsr()
+            self.contexts[n] = list(map(tuple, np.load(os.path.join(path, 'contexts%i.npy' %n)).tolist()))
+            keys = packContexts(np.array(self.contexts[n], dtype=np.int64).reshape(-1, n)).tolist()
+            self.contextIds[n] = {key: row for row, key in enumerate(keys)}
+        self.fold()
+        return self
+
+def packContexts(contextArray):
+    '''
+    Packs each line of an array of codes (up to 4, each < 2**16) into one uint64.
+    '''
+
+    contextArray = np.asarray(contextArray, dtype=np.uint64)
+    if contextArray.size and contextArray.max() >= 2**16:
+        raise ValueError('Too many distinct pitch class sets for 16-bit codes.')
+    keys = np.zeros(len(contextArray), dtype=np.uint64)
+    for i in range(contextArray.shape[1]):
+        keys |= contextArray[:, i] << np.uint64(16 * i)
+    return keys
+
+def unpackContext(key, n):
+    return tuple((key >> (16 * i)) & 0xFFFF for i in range(n))
+
+#------------------------------------------------------------------------------
+
+def countRows(ycac, start, end): # For testing mapPieces
+    return end - start
+
+class Test(unittest.TestCase):
+
+    testRows = [[0.0, 'C E G', '[0, 4, 7]', '[0, 4, 7]', 1.0], # Piece 1
+                [1.0, 'C E G#', '[0, 4, 8]', '[0, 4, 8]', 0.25],
+                [1.5, 'F A C', '[0, 4, 7]', '[5, 9, 0]', 0.5],
+                [3.0, 'C E G', '[0, 4, 7]', '[0, 4, 7]', 1.0],
+                [0.0, 'A C E', '[0, 3, 7]', '[9, 0, 4]', 1.0], # Piece 2
+                [2.0, 'D F# A#', '[0, 4, 8]', '[2, 6, 10]', 0.5],
+                [2.5, 'D F# A', '[0, 4, 7]', '[2, 6, 9]', 0.25],
+                [4.0, 'G B D', '[0, 4, 7]', '[7, 11, 2]', 1.0],]
+
+    def makeTestFile(self, directory, fileName='test.csv'):
+        testFile = os.path.join(directory, fileName)
+        with open(testFile, 'w') as csvfile:
+            csvOut = csv.writer(csvfile, delimiter=',',
+                                quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            csvOut.writerow(['offset', 'chord', 'primeForm', 'normalOrder', 'beatStrength'])
+            for row in self.testRows:
+                csvOut.writerow(row)
+        return testFile
+
+    def testCorpusExport(self):
+
+        import tempfile
+        from music21 import corpus
+        with tempfile.TemporaryDirectory() as directory:
+            scorePath = os.path.join(directory, 'scores') + os.sep
+            os.makedirs(scorePath)
+            for work in ['bwv1.6', 'bwv66.6']:
+                corpus.parse('bach/' + work).write('musicxml', fp=scorePath + work + '.xml')
+
+            info = makeYCACCorpus(scorePath, directory + os.sep, 'bach.csv', workers=2)
+            makeYCACCorpus(scorePath, directory + os.sep, combined=False,
+                           columns=['offset', 'normalOrder', 'measure'])
+
+            noOfSlices = [x[1] for x in info['results']]
+            self.assertEqual([x[0] for x in info['results']], ['bwv1.6.xml', 'bwv66.6.xml'])
+            with open(os.path.join(directory, 'bach.csv')) as filein:
+                rows = list(csv.reader(filein))
+            self.assertEqual(rows[0], ['piece'] + objectsOfInterest)
+            self.assertEqual(len(rows) - 1, sum(noOfSlices))
+            self.assertEqual(rows[-1][0], 'bwv66.6.xml')
+            self.assertEqual(getPieceIndex(os.path.join(directory, 'bach.csv')).ends.tolist(),
+                             [noOfSlices[0], sum(noOfSlices)])
+
+            with open(os.path.join(directory, 'bwv1.6.csv')) as filein:
+                rows = list(csv.reader(filein))
+            self.assertEqual(rows[0], ['offset', 'normalOrder', 'measure'])
+            self.assertEqual(len(rows) - 1, noOfSlices[0])
+            self.assertEqual([x[2] for x in rows[1:5]], ['0', '1', '1', '1']) # Anacrusis, then m. 1
+            self.assertEqual(rows[-1][2], '20')
+            measures = [int(x[2]) for x in rows[1:]]
+            self.assertEqual(measures, sorted(measures))
+
+            cache = ParseCache.ParseCache(os.path.join(directory, 'cache'))
+            makeYCACCorpus(scorePath, directory + os.sep, 'cold.csv', cache=cache)
+            makeYCACCorpus(scorePath, directory + os.sep, 'warm.csv', cache=cache,
+                           columns=['offset', 'primeForm']) # Other columns, same chordified scores
+            self.assertEqual(cache.stats()['hits'], 2)
+            self.assertEqual(getFileSlices(scorePath, 'bwv66.6.xml', cache=cache, columns=['measure'])[-1],
+                             [9]) # From the cached (pickled) chordified score
+            with open(os.path.join(directory, 'cold.csv')) as filein:
+                self.assertEqual(len(list(filein)) - 1, sum(noOfSlices))
+
+            chordScore = converter.parse(scorePath + 'bwv1.6.xml').flatten().stripTies().chordify()
+            slices = getYCACSlices(converter.parse(scorePath + 'bwv1.6.xml'))
+            self.assertEqual([x[2:5] for x in slices], # As computed by music21 for each chord
+                             [[x.primeForm, x.normalOrder, x.beatStrength] for x in chordScore.notes])
+
+    def testEmptyCorpusExport(self):
+
+        import tempfile
+        with tempfile.TemporaryDirectory() as directory:
+            scorePath = os.path.join(directory, 'scores') + os.sep
+            os.makedirs(scorePath)
+            csvPath = os.path.join(directory, 'empty.csv')
+
+            info = makeYCACCorpus(scorePath, directory + os.sep, 'empty.csv')
+            self.assertEqual(info['results'], [])
+            self.assertEqual(len(getPieceIndex(csvPath)), 0)
+            self.assertEqual(getPieceIndex(csvPath).ends.tolist(), [])
+
+            with open(scorePath + 'broken.xml', 'w') as fileout: # All works fail
+                fileout.write('Not a score')
+            info = makeYCACCorpus(scorePath, directory + os.sep, 'empty.csv')
+            self.assertEqual([x[0] for x in info['errors']], ['broken.xml'])
+            pieces = getPieceIndex(csvPath)
+            self.assertEqual((len(pieces), len(pieces.ends), len(pieces.lengths), pieces.rows()), (0, 0, 0, 0))
+
+    def testReader(self):
+
+        import tempfile
+        with tempfile.TemporaryDirectory() as directory:
+            testFile = self.makeTestFile(directory)
+
+            with YCACReader(testFile, chunkSize=3) as reader:
+                chunks = list(reader)
+
+            self.assertTrue(reader.f.closed)
+            self.assertEqual([len(x['offset']) for x in chunks], [3, 3, 2])
+            self.assertEqual(chunks[0]['offset'].tolist(), [0.0, 1.0, 1.5])
+            self.assertEqual(chunks[0]['primeForm'].dtype, np.int32)
+            self.assertEqual([reader.codes.text(x) for x in chunks[1]['primeForm']],
+                             ['[0, 4, 7]', '[0, 3, 7]', '[0, 4, 8]'])
+            self.assertEqual(chunks[2]['beatStrength'].tolist(), [0.25, 1.0])
+            self.assertEqual(reader.rowsRead, 8)
+
+    def testPieceIndex(self):
+
+        import tempfile
+        with tempfile.TemporaryDirectory() as directory:
+            testFile = self.makeTestFile(directory)
+
+            pieces = getPieceIndex(testFile, chunkSize=3)
+            self.assertTrue(os.path.exists(testFile + '.pieces'))
+            self.assertEqual(pieces.starts.tolist(), [0, 4])
+            self.assertEqual(pieces.ends.tolist(), [4, 8])
+            self.assertEqual(pieces.lengths.tolist(), [3.0, 4.0])
+            self.assertEqual(pieces.sameWindow([0, 3, 4, 6, 7], 1).tolist(),
+                             [True, False, True, True, False])
+            self.assertEqual(getPieceIndex(testFile).lengths.tolist(), [3.0, 4.0]) # Saved
+
+            self.assertEqual(whatFollows(testFile, '[0, 4, 7]', histogram=False, ignoreFirst=False),
+                             [('[0, 4, 8]', 1)]) # Not [9, 0, 4], in piece 2
+            self.assertEqual(offsetPositions(testFile)['Total overall weighted for length'], 7.0)
+
+            indexPath = os.path.join(directory, 'other.pieces')
+            self.assertEqual(getPieceIndex(testFile, indexPath=indexPath).ends.tolist(), [4, 8])
+            self.assertTrue(os.path.exists(indexPath))
+
+            binaryPath = os.path.join(directory, 'binary')
+            writeYCACBinary([testFile, testFile], binaryPath)
+            self.assertEqual(YCACBinary(binaryPath).pieces.starts.tolist(), [0, 4, 8, 12])
+            info = mapPieces(countRows, binaryPath, workers=2)
+            self.assertEqual(info['results'], [(0, 4), (1, 4), (2, 4), (3, 4)])
+
+    def testPieceIndexReadOnly(self):
+
+        import tempfile
+        from unittest import mock
+        with tempfile.TemporaryDirectory() as directory:
+            testFile = self.makeTestFile(directory)
+            binaryPath = os.path.join(directory, 'binary')
+            writeYCACBinary([testFile], binaryPath)
+            if os.path.exists(os.path.join(binaryPath, 'pieces.csv')):
+                os.remove(os.path.join(binaryPath, 'pieces.csv'))
+            os.chmod(binaryPath, 0o555)
+            os.chmod(directory, 0o555)
+            try:
+                with mock.patch.object(PieceIndex, 'save', # Fails even as root, for whom chmod doesn't
+                                       side_effect=PermissionError('Read-only directory')):
+                    self.assertEqual(getPieceIndex(testFile).lengths.tolist(), [3.0, 4.0])
+                    self.assertEqual(YCACBinary(binaryPath).pieces.starts.tolist(), [0, 4])
+                    self.assertEqual(offsetPositions(testFile)['No. of Works'], 2)
+                    self.assertEqual(whatFollows(testFile, '[0, 4, 7]', histogram=False, ignoreFirst=False),
+                                     [('[0, 4, 8]', 1)])
+                self.assertFalse(os.path.exists(testFile + '.pieces'))
+            finally:
+                os.chmod(directory, 0o755)
+                os.chmod(binaryPath, 0o755)
+
+    def testBinary(self):
+
+        import tempfile
+        with tempfile.TemporaryDirectory() as directory:
+            testFile = self.makeTestFile(directory)
+            binaryPath = os.path.join(directory, 'binary')
+
+            writeYCACBinary(testFile, binaryPath, chunkSize=3)
+            writeYCACBinary([testFile], binaryPath) # Appending, with the same dictionary
+            ycac = YCACBinary(binaryPath)
+
+            self.assertEqual(len(ycac), 16)
+            self.assertIsInstance(ycac.offset, np.memmap)
+            self.assertEqual(ycac.offset[:8].tolist(), [x[0] for x in self.testRows])
+            self.assertEqual(ycac.texts('normalOrder', ycac.rows(primeForm='[0, 4, 8]')),
+                             ['[0, 4, 8]', '[2, 6, 10]'] * 2)
+            self.assertEqual(ycac.rows(primeForm='[0, 4, 7]', normalOrder='[0, 4, 7]').tolist(),
+                             [0, 3, 8, 11])
+            self.assertEqual(len(ycac.rows(primeForm='[0, 1, 2]')), 0)
+            self.assertEqual(ycac.sources, [(testFile, 8), (testFile, 8)])
+
+    def testIndex(self):
+
+        import tempfile
+        with tempfile.TemporaryDirectory() as directory:
+            testFile = self.makeTestFile(directory)
+            binaryPath = os.path.join(directory, 'binary')
+            writeYCACBinary(testFile, binaryPath)
+
+            index = PitchClassSetIndex(YCACBinary(binaryPath))
+            reloaded = PitchClassSetIndex(YCACBinary(binaryPath))
+
+            self.assertTrue(os.path.exists(os.path.join(binaryPath, 'index', 'masks.npy')))
+            self.assertEqual(reloaded.count(primeForm='[0, 4, 7]'), 5)
+            self.assertEqual(index.positions(primeForm='[0, 4, 8]').tolist(), [1, 5])
+            self.assertEqual(index.positions(normalOrder='[0, 4, 7]').tolist(), [0, 3])
+            self.assertEqual(index.count(primeForm='[0, 1, 2]'), 0)
+            self.assertEqual(index.transpositions('[0, 4, 7]'),
+                             Counter({'[0, 4, 7]': 2, '[5, 9, 0]': 1, '[2, 6, 9]': 1, '[7, 11, 2]': 1}))
+            self.assertEqual(index.supersets([0, 4]).tolist(), [0, 1, 2, 3, 4, 5, 6, 7])
+            self.assertEqual(index.supersets([0, 4, 7], transpose=False).tolist(), [0, 3])
+            self.assertEqual(index.supersets([0, 4, 7], inversions=True).tolist(), [0, 2, 3, 4, 6, 7])
+            self.assertEqual(index.subsets([0, 4, 8, 7], transpose=False).tolist(), [0, 1, 3])
+
+            writeYCACBinary(testFile, binaryPath) # Longer: rebuilt
+            self.assertEqual(PitchClassSetIndex(YCACBinary(binaryPath)).count(primeForm='[0, 4, 7]'), 10)
+
+    def testQueryEngine(self):
+
+        import tempfile
+        with tempfile.TemporaryDirectory() as directory:
+            testFile = self.makeTestFile(directory)
+
+            engine = YCACQueryEngine(chunkSize=3) # Chunk boundaries mid-piece
+            engine.register('triads', SetTypeCounts(('major', 'augmented')))
+            engine.register('augs', NormalOrderCounts('[0, 4, 8]'))
+            engine.register('afterMajor', Successors('[0, 4, 7]', ignoreFirst=False))
+            engine.register('augPositions', LengthWeightedProportion('[0, 4, 8]'))
+            results = engine.run(testFile)
+
+            self.assertEqual(results['triads'], [('Overall', 8),
+                                                 ('[0, 4, 7] Count', 5), ('[0, 4, 7] Proportion', 0.625),
+                                                 ('[0, 4, 8] Count', 2), ('[0, 4, 8] Proportion', 0.25)])
+            self.assertEqual(results['augs'], Counter({'[0, 4, 8]': 1, '[2, 6, 10]': 1}))
+            self.assertEqual(results['afterMajor'], [('[0, 4, 8]', 1)])
+            self.assertEqual(results['augPositions']['No. of Works'], 2)
+            self.assertEqual(results['augPositions']['Weighted Proportion'], 1.0 / 7.0)
+
+            # The same, file by file, in chunks
+            self.assertEqual(compareAllNormals(getAllNormals(testFile, chunkSize=3), ('major', 'augmented')),
+                             results['triads'])
+            self.assertEqual(compareAllNormals(countAllNormals(testFile, chunkSize=3), ('major', 'augmented')),
+                             results['triads'])
+            self.assertEqual(getAllNormals(testFile, chunkSize=3), [x[2] for x in self.testRows]) # A list, as before
+            self.assertEqual(getSetsOfType(testFile, chunkSize=3).item(), results['augs'])
+            self.assertEqual(whatFollows(testFile, '[0, 4, 7]', histogram=False, ignoreFirst=False,
+                                         chunkSize=3), results['afterMajor'])
+            offsetInfo = offsetPositions(testFile, chunkSize=3)
+            self.assertEqual(offsetInfo['No. of Augmented Slices'], 2)
+            self.assertEqual(offsetInfo['Total augs weighted for length'], 1.0)
+            self.assertEqual(offsetInfo['Weighted Proportion'], 1.0 / 7.0)
+
+    def testNgramModel(self):
+
+        import tempfile
+        with tempfile.TemporaryDirectory() as directory:
+            testFile = self.makeTestFile(directory)
+
+            model = ChordNgramModel.build(testFile, maxOrder=3, chunkSize=3)
+            oneChunk = ChordNgramModel.build(testFile, maxOrder=3)
+
+            self.assertEqual(model.counts[1].sum(), 6) # Not across pieces
+            self.assertEqual(model.counts[3].sum(), 2)
+            self.assertEqual((model.counts[2] != oneChunk.counts[2]).nnz, 0)
+            self.assertEqual(model.successors('[0, 4, 7]'), [('[0, 4, 8]', 1)])
+            self.assertEqual(model.successors(['[9, 0, 4]', '[2, 6, 10]']), [('[2, 6, 9]', 1)])
+            self.assertEqual(model.predecessors('[0, 4, 7]', order=2),
+                             [(('[0, 4, 8]', '[5, 9, 0]'), 1)])
+            self.assertEqual(model.probability('[0, 4, 8]', '[5, 9, 0]'), 1.0)
+            self.assertEqual(model.probability('[0, 1, 2]', '[5, 9, 0]'), 0.0)
+            self.assertRaises(ValueError, model.successors, ['[0, 4, 7]'] * 4)
+
+            other = ChordNgramModel(maxOrder=2) # Different codes
+            other.codes.code('[0, 1, 2]')
+            merged = model.merge(ChordNgramModel.build(testFile, maxOrder=2)).merge(other)
+            self.assertEqual(merged.maxOrder, 2)
+            self.assertEqual(merged.successors(['[9, 0, 4]', '[2, 6, 10]']), [('[2, 6, 9]', 2)])
+            self.assertEqual(merged.probabilities('[2, 6, 9]'), {'[7, 11, 2]': 1.0})
+            self.assertEqual(merged.predecessors('[0, 4, 7]', order=2),
+                             [(('[0, 4, 8]', '[5, 9, 0]'), 2)])
+
+            self.assertEqual(model.columnCounts[2].format, 'csc')
+            model.startFile()
+            with YCACReader(testFile, codes=model.codes, pieces=getPieceIndex(testFile)) as reader:
+                model.update(next(iter(reader)), model.codes)
+            self.assertIsNone(model.columnCounts[2]) # Until folded again
+            self.assertEqual(model.predecessors('[0, 4, 7]', order=2),
+                             [(('[0, 4, 8]', '[5, 9, 0]'), 2)])
+
+            model.save(os.path.join(directory, 'model'))
+            reloaded = ChordNgramModel().load(os.path.join(directory, 'model'))
+            self.assertEqual(reloaded.predecessors('[0, 4, 7]', order=2),
+                             model.predecessors('[0, 4, 7]', order=2))
+
+#------------------------------------------------------------------------------
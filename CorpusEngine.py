@@ -0,0 +1,150 @@
+import unittest
+
+from music21 import converter
+from music21 import stream
+
+import TextureFunctions
+import CSV_for_YCAC
+import MelodyFunctions
+
+#------------------------------------------------------------------------------
+
+# Analyses. Each takes one parsed score and returns the data for one work.
+
+def homorhythmicity(score):
+    '''
+    Weighted timepoints for the homorhythmicity metric (see TextureFunctions.doOneScore).
+    '''
+
+    return TextureFunctions.doOneScore(score)
+
+def ycacSlices(score):
+    '''
+    YCAC-like chord slices (see CSV_for_YCAC.getYCACSlices).
+    '''
+
+    return CSV_for_YCAC.getYCACSlices(score)
+
+def melodicIntervals(score):
+    '''
+    Melodic intervals (in semitones) for each part (see MelodyFunctions.countList).
+    '''
+
+    return [[x.semitones for x in MelodyFunctions.countList(part)] for part in getParts(score)]
+
+def ambitus(score):
+    '''
+    Overall range (in semitones) of each part (see MelodyFunctions.getSemitoneRange).
+    '''
+
+    return [MelodyFunctions.getSemitoneRange(part) for part in getParts(score)]
+
+def getParts(score):
+    '''
+    Returns the parts of a score, or the stream itself where there are none (e.g. a single part).
+    '''
+
+    parts = list(score.parts) if isinstance(score, stream.Score) else []
+    if not parts:
+        parts = [score]
+    return parts
+
+defaultAnalyses = {'homorhythmicity': homorhythmicity,
+                   'ycacSlices': ycacSlices,
+                   'melodicIntervals': melodicIntervals,
+                   'ambitus': ambitus,
+                   }
+
+#------------------------------------------------------------------------------
+
+class CorpusEngine:
+    '''
+    Parses each score once and passes that one parsed stream to all registered analyses,
+    returning one combined record per work. So:
+    >>> engine = CorpusEngine()
+    >>> engine.register('noOfParts', lambda score: len(score.parts))
+    >>> records = engine.doCorpus(directory)
+    >>> records[0]['metadata'], records[0]['homorhythmicity'], records[0]['noOfParts']
+    Adding an analysis never adds another parse.
+    '''
+
+    def __init__(self, analyses=None):
+        if analyses is None:
+            analyses = defaultAnalyses
+        self.analyses = dict(analyses) # name: function(parsedScore)
+
+    def register(self, name, function):
+        '''
+        Adds (or replaces) an analysis: any function taking a parsed score.
+        '''
+
+        if name == 'metadata':
+            raise ValueError("'metadata' is reserved for the work's metadata list.")
+        self.analyses[name] = function
+
+    def unregister(self, name):
+        '''
+        Removes a registered analysis.
+        '''
+
+        del self.analyses[name]
+
+    def doOneScore(self, score, fileName=None, fullPath=None):
+        '''
+        Runs all registered analyses on one score (parsed, or a path to parse) and
+        returns the combined record: {'metadata': [...], analysisName: data, ...}.
+        '''
+
+        if isinstance(score, stream.Stream):
+            parsedScore = score
+        else:
+            fullPath = score
+            parsedScore = converter.parse(fullPath)
+
+        record = {'metadata': TextureFunctions.getMetadata(parsedScore, fileName, fullPath)}
+        for name, function in self.analyses.items():
+            record[name] = function(parsedScore)
+
+        return record
+
+    def doCorpus(self, filePath, extension=None):
+        '''
+        Runs all registered analyses on all works in a corpus directory,
+        returning a list of records (one per work) in file order.
+        '''
+
+        records = []
+        for fileName in TextureFunctions.getFiles(filePath, extension=extension):
+            fullPath = filePath+fileName # Path and name
+            records.append(self.doOneScore(fullPath, fileName=fileName, fullPath=fullPath))
+
+        return records
+
+#------------------------------------------------------------------------------
+
+class Test(unittest.TestCase):
+
+    def testOneParse(self):
+
+        from music21 import corpus
+        testscore = corpus.parse('bach/bwv1.6')
+
+        engine = CorpusEngine()
+        engine.register('noOfParts', lambda score: len(score.parts))
+        record = engine.doOneScore(testscore, fileName='bwv1.6')
+
+        self.assertEqual(list(record.keys()), ['metadata', 'homorhythmicity', 'ycacSlices',
+                                               'melodicIntervals', 'ambitus', 'noOfParts'])
+        self.assertEqual(record['metadata'][0], 'bwv1.6')
+        self.assertEqual(len(record['homorhythmicity']),
+                         len(TextureFunctions.doOneScore(testscore)))
+        self.assertEqual(record['ycacSlices'][0][2], [0, 3, 7])
+        self.assertEqual(len(record['ambitus']), record['noOfParts'])
+        self.assertEqual(len(record['melodicIntervals']), record['noOfParts'])
+
+    def testReservedName(self):
+
+        engine = CorpusEngine()
+        self.assertRaises(ValueError, engine.register, 'metadata', len)
+
+#------------------------------------------------------------------------------
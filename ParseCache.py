@@ -0,0 +1,326 @@
+import unittest
+from unittest import mock
+
+import os
+import pickle
+import hashlib
+import tempfile
+
+from functools import partial
+
+import music21
+from music21 import converter
+
+import BatchProcessing
+
+#------------------------------------------------------------------------------
+
+class ParseCache:
+    '''
+    Persistent, on-disk cache for parsed scores and for data derived from them
+    (e.g. note onsets, chordified slices, metadata).
+    Entries are keyed by a hash of the file's content and the music21 version, the kind of data,
+    and the function deriving it (see functionKey),
+    so a changed file, a music21 upgrade, or a different function never returns stale data.
+    The cache is bounded to maxBytes on disk, evicting the least recently used entries first.
+    For batches across worker processes, use runBatch (below) to keep the hit / miss statistics.
+    So:
+    >>> cache = ParseCache('/Users/Mark/Desktop/Cache/')
+    >>> offsets = cache.get(filePath, 'offsets', TextureFunctions.getOffsets)
+    >>> cache.stats()
+    On a warm re-run over an unchanged corpus, derived data is returned without parsing at all.
+    '''
+
+    def __init__(self, cacheDir, maxBytes=2**30):
+        self.cacheDir = cacheDir
+        self.maxBytes = maxBytes
+        self.hits = 0
+        self.misses = 0
+        self.totalBytes = None # Size on disk, as far as known (None until the directory is first read)
+        os.makedirs(cacheDir, exist_ok=True)
+
+    def hashFile(self, filePath):
+        '''
+        Returns the hash of a file's content (together with the music21 version).
+        '''
+
+        contentHash = hashlib.sha256(music21.VERSION_STR.encode())
+        with open(filePath, 'rb') as filein:
+            for block in iter(lambda: filein.read(2**20), b''):
+                contentHash.update(block)
+        return contentHash.hexdigest()
+
+    def entryPath(self, contentHash, kind, function=None):
+        if function is not None:
+            kind = kind + '-' + functionKey(function)
+        return os.path.join(self.cacheDir, contentHash + '-' + kind + '.p')
+
+    def derive(self, filePath, functions):
+        '''
+        Returns a dict {kind: data} for a dict of {kind: function(parsedScore)},
+        retrieving what is cached and parsing the file (once) for anything that is not.
+        '''
+
+        contentHash = self.hashFile(filePath) # Raises if there's no such file
+
+        derived = {}
+        missing = {}
+        for kind, function in functions.items():
+            entryPath = self.entryPath(contentHash, kind, function)
+            try:
+                derived[kind] = self.load(entryPath)
+                self.hits += 1
+            except (OSError, EOFError, pickle.UnpicklingError):
+                missing[kind] = (function, entryPath)
+
+        if missing:
+            parsedScore = converter.parse(filePath)
+            for kind, (function, entryPath) in missing.items():
+                derived[kind] = function(parsedScore)
+                self.store(derived[kind], entryPath)
+                self.misses += 1
+            self.evict()
+
+        return derived
+
+    def get(self, filePath, kind, function):
+        '''
+        Returns one kind of data (function(parsedScore)) for a file, from the cache if possible.
+        '''
+
+        return self.derive(filePath, {kind: function})[kind]
+
+    def parse(self, filePath):
+        '''
+        Returns the whole parsed score, from the cache if possible.
+        Each call returns a new object, so it is safe to modify.
+        '''
+
+        return self.get(filePath, 'score', lambda score: score)
+
+    def load(self, entryPath):
+        with open(entryPath, 'rb') as filein:
+            obj = pickle.load(filein)
+        os.utime(entryPath) # Record use, for LRU eviction
+        return obj
+
+    def store(self, obj, entryPath):
+        '''
+        Writes an entry atomically (temporary file, then rename), so concurrent runs are safe.
+        '''
+
+        fileDescriptor, temporaryPath = tempfile.mkstemp(dir=self.cacheDir, suffix='.tmp')
+        try:
+            with os.fdopen(fileDescriptor, 'wb') as fileout:
+                pickle.dump(obj, fileout, protocol=pickle.HIGHEST_PROTOCOL)
+                size = fileout.tell()
+            os.replace(temporaryPath, entryPath)
+        except:
+            os.remove(temporaryPath)
+            raise
+        if self.totalBytes is not None:
+            self.totalBytes += size
+
+    def entries(self):
+        '''
+        Returns (last used time, size, path) for all entries, least recently used first.
+        '''
+
+        entryList = []
+        for file in os.listdir(self.cacheDir):
+            if file.endswith('.p'):
+                entryPath = os.path.join(self.cacheDir, file)
+                try:
+                    info = os.stat(entryPath)
+                except OSError: # Removed by another process
+                    continue
+                entryList.append((info.st_mtime, info.st_size, entryPath))
+        return sorted(entryList)
+
+    def evict(self):
+        '''
+        Removes the least recently used entries until the cache fits within maxBytes.
+        The directory is only read where the size (as tracked since it was last read) may be over.
+        '''
+
+        if self.maxBytes is None:
+            return
+        if self.totalBytes is not None and self.totalBytes <= self.maxBytes:
+            return
+        entryList = self.entries()
+        totalBytes = sum([x[1] for x in entryList]) # Incl. other processes' entries
+        for lastUsed, size, entryPath in entryList:
+            if totalBytes <= self.maxBytes:
+                break
+            try:
+                os.remove(entryPath)
+            except OSError:
+                pass
+            totalBytes -= size
+        self.totalBytes = totalBytes
+
+    def clear(self):
+        for lastUsed, size, entryPath in self.entries():
+            os.remove(entryPath)
+        self.totalBytes = 0
+
+    def stats(self):
+        '''
+        Returns hit / miss statistics for this cache object, and the current size on disk.
+        '''
+
+        entryList = self.entries()
+        lookups = self.hits + self.misses
+        returnInfo = {'hits': self.hits,
+                      'misses': self.misses,
+                      'hitRate': self.hits / lookups if lookups else 0.0,
+                      'entries': len(entryList),
+                      'bytes': sum([x[1] for x in entryList]),}
+        return returnInfo
+
+def functionKey(function):
+    '''
+    Returns a short key for the function deriving an entry: a hash of its qualified name
+    (with the module) and its code, so another function (or a changed one) under the same kind
+    has entries of its own.
+    '''
+
+    while isinstance(function, partial):
+        function = function.func
+    name = getattr(function, '__module__', '') + '.' + getattr(function, '__qualname__', repr(function))
+    functionHash = hashlib.sha256(name.encode())
+    code = getattr(function, '__code__', None)
+    if code is not None:
+        functionHash.update(code.co_code)
+        functionHash.update(repr(code.co_consts).encode())
+    return functionHash.hexdigest()[:12]
+
+def runBatch(function, items, cache=None, **keywords):
+    '''
+    BatchProcessing.runBatch for a function taking a cache keyword (e.g. a partial of TextureFunctions.doOneFile),
+    called as function(item, cache=cache).
+    Each worker's hits and misses come back with its results and are added to this cache's statistics
+    (which would otherwise be lost in the worker processes).
+    '''
+
+    if cache is None:
+        return BatchProcessing.runBatch(partial(function, cache=None), items, **keywords)
+
+    batch = BatchProcessing.runBatch(partial(runCounted, function, cache), items, **keywords)
+    results = []
+    for item, (result, hits, misses) in batch['results']:
+        cache.hits += hits
+        cache.misses += misses
+        results.append((item, result))
+    batch['results'] = results
+    return batch
+
+def runCounted(function, cache, item):
+    '''
+    Runs function(item, cache=cache), returning (result, hits, misses) for that item.
+    The counts are taken off the cache object again, so that they are only added once (in runBatch),
+    whether this runs in a worker process or not.
+    '''
+
+    hits, misses = cache.hits, cache.misses
+    try:
+        result = function(item, cache=cache)
+    finally:
+        newHits, newMisses = cache.hits - hits, cache.misses - misses
+        cache.hits, cache.misses = hits, misses
+    return result, newHits, newMisses
+
+def parse(filePath, cache=None):
+    '''
+    Parses a score, using the cache if one is given.
+    '''
+
+    if cache is None:
+        return converter.parse(filePath)
+    return cache.parse(filePath)
+
+#------------------------------------------------------------------------------
+
+# For the tests (picklable, for worker processes)
+
+def noOfNotes(score):
+    return len(score.recurse().notes)
+
+def noOfNotesCached(filePath, cache=None):
+    return cache.get(filePath, 'notes', noOfNotes)
+
+def writeTestScore(directory, name):
+    filePath = os.path.join(directory, name + '.tntxt')
+    with open(filePath, 'w') as fileout:
+        fileout.write('tinyNotation: 4/4 c4 d e ' + name) # Different content, so different hashes
+    return filePath
+
+#------------------------------------------------------------------------------
+
+class Test(unittest.TestCase):
+
+    def testHitsAndMisses(self):
+
+        from music21 import corpus
+        testPath = str(corpus.getWork('bach/bwv1.6'))
+
+        with tempfile.TemporaryDirectory() as cacheDir:
+            cache = ParseCache(cacheDir)
+            functions = {'noOfParts': lambda score: len(score.parts),
+                         'noOfNotes': lambda score: len(score.recurse().notes)}
+
+            cold = cache.derive(testPath, functions)
+            warm = cache.derive(testPath, functions)
+
+            self.assertEqual(cold, warm)
+            self.assertEqual(cache.stats()['misses'], 2)
+            self.assertEqual(cache.stats()['hits'], 2)
+            self.assertEqual(cache.stats()['entries'], 2)
+
+    def testEviction(self):
+
+        with tempfile.TemporaryDirectory() as cacheDir:
+            testFile = writeTestScore(cacheDir, 'f')
+
+            cache = ParseCache(os.path.join(cacheDir, 'cache'), maxBytes=0)
+            cache.store(list(range(100)), cache.entryPath(cache.hashFile(testFile), 'numbers'))
+            cache.evict()
+
+            self.assertEqual(cache.stats()['entries'], 0)
+            self.assertEqual(cache.totalBytes, 0)
+
+            cache.maxBytes = 2**20
+            cache.get(testFile, 'notes', noOfNotes)
+            with mock.patch.object(cache, 'entries', side_effect=AssertionError('Directory read again')):
+                cache.get(testFile, 'notes', lambda score: len(score.recurse().notes)) # Evicts nothing
+            self.assertGreater(cache.totalBytes, 0)
+            self.assertEqual(cache.stats()['entries'], 2) # Unpatched again
+
+    def testFunctionKeys(self):
+
+        with tempfile.TemporaryDirectory() as cacheDir:
+            testFile = writeTestScore(cacheDir, 'f')
+            cache = ParseCache(os.path.join(cacheDir, 'cache'))
+
+            self.assertEqual(cache.get(testFile, 'n', noOfNotes), 4)
+            self.assertEqual(cache.get(testFile, 'n', lambda score: 'other'), 'other') # Same kind
+            self.assertEqual(cache.stats()['misses'], 2)
+            self.assertEqual(cache.get(testFile, 'n', noOfNotes), 4)
+            self.assertEqual(functionKey(partial(noOfNotesCached, cache=None)), functionKey(noOfNotesCached))
+
+    def testStatsFromWorkers(self):
+
+        with tempfile.TemporaryDirectory() as cacheDir:
+            paths = [writeTestScore(cacheDir, x) for x in ['f', 'g', 'a']]
+
+            cache = ParseCache(os.path.join(cacheDir, 'cache'))
+            cache.get(paths[0], 'notes', noOfNotes)
+            batch = runBatch(noOfNotesCached, paths, cache=cache, workers=2, verbose=False)
+
+            self.assertEqual([x[1] for x in batch['results']], [4, 4, 4])
+            self.assertEqual((cache.hits, cache.misses), (1, 3))
+
+            runBatch(noOfNotesCached, paths, cache=cache, verbose=False)
+            self.assertEqual((cache.hits, cache.misses), (4, 3)) # Counted once in this process too
+
+#------------------------------------------------------------------------------
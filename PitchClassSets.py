@@ -0,0 +1,246 @@
+import unittest
+
+import os
+
+#------------------------------------------------------------------------------
+
+# Pitch class sets as 12-bit masks: bit n set for pitch class n (so [0, 4, 7] = 0b000010010001).
+# No music21 needed.
+
+def pcsToMask(pcs):
+    '''
+    Returns the 12-bit mask for a list of pitch classes.
+    >>> pcsToMask([0, 4, 7])
+    145
+    '''
+
+    mask = 0
+    for pc in pcs:
+        mask |= 1 << (pc % 12)
+    return mask
+
+def maskToPcs(mask):
+    '''
+    Returns the (sorted) pitch classes in a 12-bit mask.
+    >>> maskToPcs(145)
+    [0, 4, 7]
+    '''
+
+    return [pc for pc in range(12) if mask >> pc & 1]
+
+def textToPcs(text):
+    '''
+    Returns the pitch classes from their text form, as in YCAC files.
+    >>> textToPcs('[7, 11, 2]')
+    [7, 11, 2]
+    '''
+
+    text = text.strip().strip('[]')
+    if not text:
+        return []
+    return [int(x) for x in text.split(',')]
+
+def textToMask(text):
+    return pcsToMask(textToPcs(text))
+
+def transposeMask(mask, n):
+    '''
+    Transposes a 12-bit mask by n semitones.
+    >>> maskToPcs(transposeMask(pcsToMask([0, 4, 7]), 7))
+    [2, 7, 11]
+    '''
+
+    n %= 12
+    return ((mask << n) | (mask >> (12 - n))) & 0xFFF
+
+def invertMask(mask):
+    '''
+    Inverts a 12-bit mask (about pitch class 0).
+    >>> maskToPcs(invertMask(pcsToMask([0, 4, 7])))
+    [0, 5, 8]
+    '''
+
+    return pcsToMask([-pc for pc in maskToPcs(mask)])
+
+def allTranspositions(mask, inversions=False):
+    '''
+    Returns the distinct masks for all transpositions (and optionally inversions) of a mask.
+    '''
+
+    masks = {transposeMask(mask, n) for n in range(12)}
+    if inversions:
+        masks |= {transposeMask(invertMask(mask), n) for n in range(12)}
+    return sorted(masks)
+
+#------------------------------------------------------------------------------
+
+# Set classes: a lookup table for all 4096 pitch class sets (by mask), as music21 gives them.
+
+digits = '0123456789TE' # T = 10, E = 11
+
+# Forte's catalogue: the prime forms for each cardinality in order of Forte number
+# (so '037', the 11th trichord, is 3-11), as in music21's chord.tables.
+fortePrimeForms = {
+    1: '0',
+    2: '01 02 03 04 05 06',
+    3: '012 013 014 015 016 024 025 026 027 036 037 048',
+    4: ('0123 0124 0134 0125 0126 0127 0145 0156 0167 0235 0135 0236 0136 0237 0146 0157 0347 '
+        '0147 0148 0158 0246 0247 0257 0248 0268 0358 0258 0369 0137'),
+    5: ('01234 01235 01245 01236 01237 01256 01267 02346 01246 01346 02347 01356 01248 01257 '
+        '01268 01347 01348 01457 01367 01378 01458 01478 02357 01357 02358 02458 01358 02368 '
+        '01368 01468 01369 01469 02468 02469 02479 01247 03458 01258'),
+    6: ('012345 012346 012356 012456 012367 012567 012678 023457 012357 013457 012457 012467 '
+        '013467 013458 012458 014568 012478 012578 013478 014589 023468 012468 023568 013468 '
+        '013568 013578 013469 013569 013689 013679 013589 024579 023579 013579 02468T 012347 '
+        '012348 012378 023458 012358 012368 012369 012568 012569 023469 012469 012479 012579 '
+        '013479 014679'),
+    7: ('0123456 0123457 0123458 0123467 0123567 0123478 0123678 0234568 0123468 0123469 '
+        '0134568 0123479 0124568 0123578 0124678 0123569 0124569 0123589 0123679 0124789 '
+        '0124589 0125689 0234579 0123579 0234679 0134579 0124579 0135679 0124679 0124689 '
+        '0134679 0134689 012468T 013468T 013568T 0123568 0134578 0124578'),
+    8: ('01234567 01234568 01234569 01234578 01234678 01235678 01234589 01234789 01236789 '
+        '02345679 01234579 01345679 01234679 01245679 01234689 01235789 01345689 01235689 '
+        '01245689 01245789 0123468T 0123568T 0123578T 0124568T 0124678T 0124579T 0124578T '
+        '0134679T 01235679'),
+    9: ('012345678 012345679 012345689 012345789 012346789 01234568T 01234578T 01234678T '
+        '01235678T 01234679T 01235679T 01245689T'),
+    10: '0123456789 012345678T 012345679T 012345689T 012345789T 012346789T',
+    11: '0123456789T',
+    12: '0123456789TE',
+}
+
+# Common names for triad and seventh chord types, by Forte class (with A / B for inversions).
+forteCommonNames = {'3-10': 'diminished triad',
+                    '3-11A': 'minor triad',
+                    '3-11B': 'major triad',
+                    '3-12': 'augmented triad',
+                    '4-19A': 'minor-major seventh chord',
+                    '4-19B': 'augmented major seventh chord',
+                    '4-20': 'major seventh chord',
+                    '4-24': 'augmented seventh chord',
+                    '4-25': 'French augmented sixth chord',
+                    '4-26': 'minor seventh chord',
+                    '4-27A': 'half-diminished seventh chord',
+                    '4-27B': 'dominant seventh chord',
+                    '4-28': 'diminished seventh chord',
+                    }
+
+def normalForm(pcs):
+    '''
+    Returns Forte's normal form of a set of pitch classes: the rotation (of the sorted set)
+    with the smallest span, ties broken by the smallest interval from the first pitch class
+    to the second, then the third, and so on.
+    >>> normalForm([11, 7, 2])
+    [7, 11, 2]
+    '''
+
+    pcs = sorted(set([x % 12 for x in pcs]))
+    rotations = [pcs[i:] + pcs[:i] for i in range(len(pcs))]
+    if not rotations:
+        return []
+    return min(rotations, key=lambda x: [(x[-1] - x[0]) % 12] + [(y - x[0]) % 12 for y in x[1:]])
+
+def makeSetTables():
+    '''
+    Returns five lists, each indexed by mask, for all 4096 pitch class sets:
+    prime forms, normal orders (tuples), Forte classes (e.g. '3-11B'), interval vectors (tuples),
+    and common names (for the triads and sevenths in forteCommonNames; otherwise None).
+    All match music21's chord.Chord properties of the same names (commonName aside).
+    '''
+
+    # Each set class (and inversion, where different): its Forte class, the form it takes
+    # transposed to start on 0, and its prime form, for every mask it transposes to.
+    setClasses = {0: ('N/A', (), ())}
+    for cardinality, words in fortePrimeForms.items():
+        for number, word in enumerate(words.split(), start=1):
+            primeForm = tuple([digits.index(x) for x in word])
+            inversion = normalForm([-x for x in primeForm])
+            inversion = tuple([(x - inversion[0]) % 12 for x in inversion])
+            forteClass = '%i-%i' %(cardinality, number)
+            if pcsToMask(inversion) in allTranspositions(pcsToMask(primeForm)): # Symmetrical
+                forms = [(forteClass, primeForm)]
+            else:
+                forms = [(forteClass + 'A', primeForm), (forteClass + 'B', inversion)]
+            for forteName, form in forms:
+                for mask in allTranspositions(pcsToMask(form)):
+                    setClasses[mask] = (forteName, form, primeForm)
+
+    primeForms, normalOrders, forteClasses, intervalVectors, commonNames = [], [], [], [], []
+    for mask in range(4096):
+        pcs = maskToPcs(mask)
+        forteClass, form, primeForm = setClasses[mask]
+
+        normalOrder = ()
+        for transposition in pcs: # The first, from the bottom, that fits (as music21)
+            normalOrder = tuple([(x + transposition) % 12 for x in form])
+            if pcsToMask(normalOrder) == mask:
+                break
+
+        intervalVector = [0] * 6
+        for i, x in enumerate(pcs):
+            for y in pcs[i + 1:]:
+                intervalVector[min(y - x, 12 - y + x) - 1] += 1
+
+        primeForms.append(primeForm)
+        normalOrders.append(normalOrder)
+        forteClasses.append(forteClass)
+        intervalVectors.append(tuple(intervalVector))
+        commonNames.append(forteCommonNames.get(forteClass))
+
+    return primeForms, normalOrders, forteClasses, intervalVectors, commonNames
+
+primeForms, normalOrders, forteClasses, intervalVectors, commonNames = makeSetTables()
+
+def lookUp(pcs):
+    '''
+    Returns a dict of the set class information for a list of pitch classes
+    (or a mask), from the tables. So:
+    >>> lookUp([7, 11, 2, 5])['forteClass']
+    '4-27B'
+    '''
+
+    mask = pcs if isinstance(pcs, int) else pcsToMask(pcs)
+    returnInfo = {'primeForm': list(primeForms[mask]),
+                  'normalOrder': list(normalOrders[mask]),
+                  'forteClass': forteClasses[mask],
+                  'intervalVector': list(intervalVectors[mask]),
+                  'commonName': commonNames[mask],}
+    return returnInfo
+
+#------------------------------------------------------------------------------
+
+class Test(unittest.TestCase):
+
+    def testMasks(self):
+
+        self.assertEqual(pcsToMask([0, 4, 7]), 145)
+        self.assertEqual(maskToPcs(textToMask('[7, 11, 2]')), [2, 7, 11])
+        self.assertEqual(textToPcs('[]'), [])
+        self.assertEqual(transposeMask(pcsToMask([11]), 1), 1)
+        self.assertEqual(len(allTranspositions(pcsToMask([0, 4, 8]))), 4)
+        self.assertEqual(len(allTranspositions(pcsToMask([0, 4, 7]), inversions=True)), 24)
+
+    def testTablesAsMusic21(self):
+
+        import subprocess
+        import sys
+        imported = subprocess.run([sys.executable, '-c',
+                                   "import sys, PitchClassSets; print('music21' in sys.modules)"],
+                                  capture_output=True, text=True,
+                                  cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(imported.stdout.strip(), 'False') # Tables made without music21
+
+        from music21 import chord
+        masks = [x for x in range(4096) if len(maskToPcs(x)) <= 3 or x % 13 == 0] # All: ~1 min
+        for mask in masks:
+            c = chord.Chord(maskToPcs(mask))
+            self.assertEqual(list(primeForms[mask]), c.primeForm)
+            self.assertEqual(list(normalOrders[mask]), c.normalOrder)
+            self.assertEqual(forteClasses[mask], c.forteClass)
+            self.assertEqual(list(intervalVectors[mask]), c.intervalVector)
+
+        for name in ['C E G', 'C E- G', 'C E- G-', 'C E G#', 'G B D F', 'B D F A', 'B D F A-', 'C E G B']:
+            c = chord.Chord(name)
+            self.assertEqual(commonNames[pcsToMask(c.pitchClasses)], c.commonName)
+
+#------------------------------------------------------------------------------
@@ -8,326 +8,390 @@ from music21 import pitch
 from music21 import chord
 from music21 import roman
 from music21 import stream
+from music21.romanText import writeRoman
 
+import numpy as np
 from numpy import array
+from functools import cached_property, lru_cache, partial
+from collections import Counter, OrderedDict
 from copy import deepcopy
+import argparse
 import csv
+import glob
+import gzip
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+import BatchProcessing
+import ParseCache
+import PitchClassSets
 
 #------------------------------------------------------------------------------
 
-class M21: # M21 > TSV
+class LazyConversions:
     '''
-    Convertions starting with a music21 harmonic analysis stream.
+    Shared by M21 and TSV: each representation (M21Table, ABCTable, M21Array, ABC_Array)
+    is computed on first access and then kept, so a job that needs only one
+    (e.g. reduce, which needs only the M21Table) never pays for the others.
+    invalidate() drops kept representations (with those derived from them), e.g. after the source
+    has changed, to be computed again on next access; refresh() does so straight away. So:
+    >>> tsv = TSV('op18no1mov1.tsv') # Reads the file
+    >>> tsv.M21Table # Converts
+    >>> tsv.refresh('ABCTable') # Reads it again, now; M21Table etc. again on next access
     '''
-    def __init__(self, m21HarmonicAnalysis):
-        self.m21HarmonicAnalysis = m21HarmonicAnalysis
-        self.M21Array = self.toM21Array()
 
-    def toM21Array(self):
+    derived = {} # name: names of representations computed from it
+
+    def invalidate(self, *names):
+        '''
+        Drops the named representations (all, if none are named) and those derived from them.
         '''
-        Convertion from a music21 harmonic analysis to an intermediary array format.
-        '''
-
-        headers = ['chord', # 0
-                    'altchord',
-                    'measure',
-                    'beat',
-                    'totbeat',
-                    'timesig', # 5
-                    'op',
-                    'no',
-                    'mov',
-                    'length',
-                    'global_key', # 10
-                    'local_key',
-                    'pedal',
-                    'numeral',
-                    'form',
-                    'figbass', # 15
-                    'changes',
-                    'relativeroot',
-                    'phraseend']
-
-        info = [headers]
 
-        inputHarmonicAnalysis = self.m21HarmonicAnalysis
+        if not names:
+            names = list(self.derived)
+        toDrop = set()
+        toCheck = list(names)
+        while toCheck:
+            name = toCheck.pop()
+            if name not in self.derived:
+                raise ValueError('No such representation: %s' %name)
+            if name not in toDrop:
+                toDrop.add(name)
+                toCheck.extend(self.derived[name])
+        for name in toDrop:
+            self.__dict__.pop(name, None) # Where kept by cached_property
+        return self
+
+    def refresh(self, *names):
+        '''
+        Invalidates the named representations (all, if none are named) and computes them again now.
+        '''
 
-        # MD
-        opn = inputHarmonicAnalysis.metadata.opusNumber
-        no = inputHarmonicAnalysis.metadata.number
-        mvmt = inputHarmonicAnalysis.metadata.movementNumber
+        self.invalidate(*names)
+        for name in names or self.derived:
+            getattr(self, name)
+        return self
+
+    def kept(self):
+        '''
+        Returns the names of the representations computed so far.
+        '''
+
+        return [x for x in self.derived if x in self.__dict__]
+
+#------------------------------------------------------------------------------
+
+class M21(LazyConversions): # M21 > TSV
+    '''
+    Convertions starting with a music21 harmonic analysis stream
+    (or the path to one, e.g. an .rntxt file, optionally retrieved from a ParseCache).
+    Conversions are made on first access (see LazyConversions).
+    '''
+
+    derived = {'M21Table': ['M21Array', 'ABCTable'],
+               'M21Array': [],
+               'ABCTable': ['ABC_Array'],
+               'ABC_Array': [],
+               }
 
-        romans = []
+    def __init__(self, m21HarmonicAnalysis, cache=None):
+        if isinstance(m21HarmonicAnalysis, str):
+            m21HarmonicAnalysis = ParseCache.parse(m21HarmonicAnalysis, cache=cache)
+        self.m21HarmonicAnalysis = m21HarmonicAnalysis
+
+    @cached_property
+    def M21Table(self):
+        return self.toM21Table()
+
+    @cached_property
+    def M21Array(self):
+        return self.toM21Array()
+
+    @cached_property
+    def ABCTable(self):
+        return self.M21Table.toABC()
+
+    @cached_property
+    def ABC_Array(self):
+        return self.toABCArray()
 
-        for item in inputHarmonicAnalysis.recurse():
-            if 'RomanNumeral' in item.classes:
-                romans.append(item) # Still a m21 object at this stage
-            if 'TimeSignature' in item.classes:
-                ts = item.ratioString # Check for changes of ts during piece. TODO***
+    def toM21Table(self):
+        '''
+        Convertion from a music21 harmonic analysis to a (music21-format) HarmonicTable,
+        in one pass through the Roman numerals and time signatures,
+        with the time signature in force for each Roman numeral.
+        Roman numerals not in a measure have the measure -1 (see makeColumn).
+        '''
+
+        inputHarmonicAnalysis = self.m21HarmonicAnalysis
 
-        globalKey = str(romans[0].key).split()[0] # From key of first fig. Most reliable option available.
+        # MD
+        md = inputHarmonicAnalysis.metadata
+        opn = md.opusNumber if md is not None else None
+        no = md.number if md is not None else None
+        mvmt = md.movementNumber if md is not None else None
+
+        columns = {name: [] for name in abcHeaders}
+        ts = None
+        firstTS = None
+        globalKey = None
+        localKeys = {} # Key: local key (as a numeral in the global key)
+
+        for item in inputHarmonicAnalysis.recurse().getElementsByClass(['RomanNumeral', 'TimeSignature']):
+            if isinstance(item, meter.TimeSignature):
+                ts = item.ratioString
+                if firstTS is None:
+                    firstTS = ts
+                continue
 
-        for item in romans: # Intermediary list because global needed in advance.
+            if globalKey is None:
+                globalKey = str(item.key).split()[0] # From key of first fig. Most reliable option available.
 
-            # Relative root (NB duplicates vLocalKey method). TODO***
+            # Relative root: the numeral after the slash (e.g. 'ii' in 'V/ii'), as text. Its key is not needed here.
             relativeroot = None
             fig = item.figure
             if '/' in fig:
                 position = fig.index('/')
-                try:
-                    int(fig[position+1]) # If it's an int then format of e.g. I6/4 rather than V/ii
-                except:
+                if not fig[position+1:position+2].isdigit(): # e.g. V/ii rather than I6/4
                     relativeroot = fig[position+1:]
 
-            # Local key. An ugly solution to be sure. TODO***
-            pitches = item.key.pitches
-            thisChord = chord.Chord([pitches[0], pitches[2], pitches[4]])
-            rn = roman.romanNumeralFromChord(thisChord, key.Key(globalKey))
-            localKey = rn.figure
-
-            thisEntry = [item.figure, # TODO: combine key for key changes.
-                        None, #'altchord',
-                        item.measureNumber,
-                        item.offset, # beat
-                        None, # 'totbeat',
-                        ts, # 'timesig', # 5 #TODO***
-                        opn,# 'op',
-                        no,# 'no',
-                        mvmt,# 'mov',
-                        item.quarterLength, # 'length',
-                        globalKey, # 'global_key', # 10. Set below
-                        localKey, # local_key
-                        None, # 'pedal',
-                        item.figure, # 'numeral',
-                        None, # 'form',
-                        None, # 'figbass', # 15
-                        None, # 'changes',
-                        relativeroot, # 'relativeroot',
-                        None, # 'phraseend'
-                        ]     # TODO: Review these and fill remaining columns using.
-            info.append(thisEntry)
-
-        harmonicArray = array(info)
-
-        return harmonicArray
+            keyName = str(item.key)
+            localKey = localKeys.get(keyName)
+            if localKey is None:
+                localKey = keyAsNumeral(keyName, globalKey)
+                localKeys[keyName] = localKey
+
+            site = item.activeSite
+            thisMeasure = site.number if isinstance(site, stream.Measure) else item.measureNumber
+
+            thisEntry = {'chord': fig, # TODO: combine key for key changes.
+                         'measure': thisMeasure,
+                         'beat': item.offset,
+                         'timesig': ts,
+                         'op': opn,
+                         'no': no,
+                         'mov': mvmt,
+                         'length': item.quarterLength,
+                         'global_key': globalKey,
+                         'local_key': localKey,
+                         'numeral': fig,
+                         'relativeroot': relativeroot,
+                         } # TODO: Review these and fill remaining columns.
+            for name in abcHeaders:
+                columns[name].append(thisEntry.get(name))
+
+        columns['timesig'] = [firstTS if x is None else x for x in columns['timesig']] # Before the first
+
+        table = {name: makeColumn(values, dtype) for (name, dtype), values
+                 in zip(abcSchema, [columns[x] for x in abcHeaders])}
+        return HarmonicTable(table, notation='music21')
 
-    def toABCArray(self):
+    def toM21Array(self):
         '''
-        Makes an ABC-format version of a music21-format array by swapping
-        equivalent text representations for the same Roman Numeral.
+        Convertion from a music21 harmonic analysis to an intermediary array format (headers first).
         '''
 
-        ABC_Array = deepcopy(self.M21Array)
+        return self.M21Table.toArray()
 
-        globalKey = ABC_Array[1][10]
+    def toABCArray(self):
+        '''
+        Makes an ABC-format version of a music21-format array by swapping
+        equivalent text representations for the same Roman Numeral (see HarmonicTable.toABC).
+        '''
 
-        for row in ABC_Array[1:]: # Leave header.
-            if globalKey == globalKey.lower(): # If the global key is minor ...
-                row[11] = characterSwaps(row[11], minor=True, direction='m21-ABC')
-            else:
-                row[11] = characterSwaps(row[11], minor=False, direction='m21-ABC')
-
-            if row[11] == row[11].lower(): # If the local key is minor ...
-                if row[17]: # If there's a relative root
-                    if row[17] == row[17].lower(): # ... and it's minor too change it and the figure
-                        row[17] = characterSwaps(row[17], minor=True, direction='m21-ABC')
-                        row[13] = characterSwaps(row[13], minor=True, direction='m21-ABC')
-                    else: # ... rel. root but not minor
-                        row[17] = characterSwaps(row[17], minor=False, direction='m21-ABC')
-                else: # No relative root
-                    row[13] = characterSwaps(row[13], minor=True, direction='m21-ABC')
-            else: # local Key not minor
-                if row[17]: # If there's a relative root
-                    if row[17] == row[17].lower(): # ... and it's minor
-                        row[17] = characterSwaps(row[17], minor=False, direction='m21-ABC')
-                        row[13] = characterSwaps(row[13], minor=True, direction='m21-ABC')
-                    else: # ... rel. root but not minor
-                        row[17] = characterSwaps(row[17], minor=False, direction='m21-ABC')
-                else: # No relative root
-                    row[13] = characterSwaps(row[13], minor=False, direction='m21-ABC')
-
-        self.ABC_Array = ABC_Array
-
-        return ABC_Array
+        return self.ABCTable.toArray()
 
     def toTSV(self, type='ABC', outFilePath='./', outFileName='TSV_FILE.tsv',):
         '''
-        Makes a TSV file from a data array.
+        Makes a TSV file (written atomically; see TSVWriter) for this work.
+        For several works in one file, use writeTSV or a TSVWriter.
         '''
 
-        if type=='ABC':
-            harmonicInfo = self.ABC_Array
-        elif type=='music21':
-            harmonicInfo = self.M21Array
-
-        tsvOut = arrayToTSV(harmonicInfo, outFilePath=outFilePath, outFileName=outFileName)
+        writeTSV([self], outFilePath+outFileName, notation=type)
 
 #------------------------------------------------------------------------------
 
-class TSV:
+class TSV(LazyConversions):
     '''
     Conversion starting an ABC TSV file.
+    The file is read straight away (ABCTable); conversions are made on first access (see LazyConversions).
     '''
+
+    derived = {'ABCTable': ['ABC_Array', 'M21Table'],
+               'ABC_Array': [],
+               'M21Table': ['M21Array'],
+               'M21Array': [],
+               }
+
     def __init__(self, TSV_FILE):
        self.TSV_FILE = TSV_FILE
-       self.ABC_Array = self.toABCArray()
-       self.M21Array = self.toM21Array()
+       self.ABCTable # Read now
+
+    @cached_property
+    def ABCTable(self):
+        return HarmonicTable.fromTSV(self.TSV_FILE)
+
+    @cached_property
+    def M21Table(self):
+        return self.ABCTable.toM21()
+
+    @cached_property
+    def ABC_Array(self):
+        return self.toABCArray()
+
+    @cached_property
+    def M21Array(self):
+        return self.toM21Array()
 
     def toABCArray(self):
         '''
-        Takes an ABC TSV file and returns an array of the same data.
+        Takes an ABC TSV file and returns an array of the same data (headers first).
         '''
 
-        fileName = self.TSV_FILE
-
-        f = open(fileName, 'r')
-        data = []
-        for row_num, line in enumerate(f):
-            values = line.strip().split('\t')
-            # if row_num != 0: # Ignore first line (header)
-            data.append([v.strip('\"') for v in values]) # Remove the extra set of quotes
-        harmonicArray = array(data)
-        f.close()
-
-        return harmonicArray
+        return self.ABCTable.toArray()
 
     def toM21Array(self):
         '''
         Makes an m21-format version of the ABC-format data by swapping
-        equivalent text representations for the same Roman Numeral.
-        Also adds a column specifying the pitches entailed by the RN.
-        ''' # Combine with above? TODO***
-
-        M21Array = deepcopy(self.ABC_Array)
-
-        globalKey = M21Array[1][10]
-
-        for row in M21Array[1:]: # Ignore headers here
-
-            # As above, but direction='ABC-m21'. TODO Make into a separate, static function
-
-            # Global - local
-            if globalKey == globalKey.lower():
-                row[11] = characterSwaps(row[11], minor=True, direction='ABC-m21')
-            else:
-                row[11] = characterSwaps(row[11], minor=False, direction='ABC-m21')
-
-            # Local - rel and figure
-            if row[11] == row[11].lower():
-                if row[17]:
-                    if row[17] == row[17].lower():
-                        row[17] = characterSwaps(row[17], minor=True, direction='ABC-m21')
-                        row[13] = characterSwaps(row[13], minor=True, direction='ABC-m21')
-                    else:
-                        row[17] = characterSwaps(row[17], minor=False, direction='ABC-m21')
-                else:
-                    row[13] = characterSwaps(row[13], minor=True, direction='ABC-m21')
-            else: # local key not minor
-                if row[17]:
-                    if row[17] == row[17].lower(): # ... and it's minor
-                        row[17] = characterSwaps(row[17], minor=False, direction='ABC-m21')
-                        row[13] = characterSwaps(row[13], minor=True, direction='ABC-m21')
-                    else: # ... rel. root but not minor
-                        row[17] = characterSwaps(row[17], minor=False, direction='ABC-m21')
-                else: # No relative root
-                    row[13] = characterSwaps(row[13], minor=False, direction='ABC-m21')
-
-
-            numeral = str(row[13])
-            form = str(row[14])
-            figbass = str(row[15])
-            # changes = str(row[16]). TODO***
-            relativeRoot = str(row[17])
-
-            # Combined figure for column[0] (though NB no key in the m21 case).
-            combined = ''.join([numeral, form, figbass]) # , changes]). conversion TODO***
-            if relativeRoot: # special case requiring '/'.
-                combined = ''.join([combined, '/', relativeRoot])
-            row[0] = combined
-
-        self.M21Array = M21Array
+        equivalent text representations for the same Roman Numeral (see HarmonicTable.toM21).
+        '''
 
-        return M21Array
+        return self.M21Table.toArray()
 
-    def reduce(self):
+    def reduce(self, setClasses=False, cache=None):
         '''
-        Takes an m21 array and returns a simplifed harmonic reduction with specific pitch classes
+        Takes an m21 array and returns a simplifed harmonic reduction with specific pitch classes.
+        Optionally (setClasses=True), add the normalOrder, primeForm and forteClass of each,
+        from the lookup table (see PitchClassSets.makeSetTables).
+        Figures are parsed through a RomanCache (by default, the shared romanCache);
+        rows with figures that cannot be parsed are left out, and counted in self.romanStats.
         ''' # Option to integate specific pitches back into array? TODO***
 
+        if cache is None:
+            cache = romanCache
+        before = cache.stats()
+
         headers = ['measure', 'beat', 'totbeat', 'pitchClasses']
+        if setClasses:
+            headers += ['normalOrder', 'primeForm', 'forteClass']
         reducedData = [headers]
 
-        harmonicArray = self.M21Array
-        for row in harmonicArray[1:]:
-
-            thisMeasure = int(row[2])
-            beat =  float(row[3])
-            totbeat = float(row[4])
-
-            global_key = row[10]
-            local_key = row[11]
+        table = self.M21Table
+        for thisMeasure, beat, totbeat, global_key, local_key, figure in zip(
+                table['measure'].tolist(), table['beat'].tolist(), table['totbeat'].tolist(),
+                table['global_key'].tolist(), table['local_key'].tolist(), table['chord'].tolist()):
 
             local_key_V2 = getLocalKey(local_key, global_key)
-            local_key_V3 = key.Key(local_key_V2)
-
-            try: # Some RNs missing
-                rn = roman.RomanNumeral(row[0], local_key_V3) # e.g. ('VI', 'd')
-                pitches = [x.pitchClass for x in rn.pitches]
-                newRow = [thisMeasure, beat, totbeat, pitches]
-                reducedData.append(newRow)
-            except:
+
+            pitchClasses = cache.pitchClasses(figure, local_key_V2) # e.g. ('VI', 'd')
+            if pitchClasses is None: # Some RNs missing
                 continue
+            pitches = list(pitchClasses)
+            newRow = [thisMeasure, beat, totbeat, pitches]
+            if setClasses:
+                mask = PitchClassSets.pcsToMask(pitches)
+                newRow += [list(PitchClassSets.normalOrders[mask]),
+                           list(PitchClassSets.primeForms[mask]),
+                           PitchClassSets.forteClasses[mask]]
+            reducedData.append(newRow)
+
+        self.romanStats = cache.stats(since=before)
 
         return reducedData
 
-    def toM21(self):
+    def chroma(self, weighted=False, cache=None):
+        '''
+        The reduction as arrays: an N x 12 uint8 chroma matrix (1 for each pitch class in the chord)
+        and the measure, beat, totbeat and length of each row, aligned with it.
+        As reduce, rows with figures that cannot be parsed are left out (see self.romanStats);
+        'row' gives the position of each in the table.
+        Optionally (weighted=True), also the chroma weighted by duration (float32, length x chroma).
+        Returns a dict of arrays.
+        '''
+
+        if cache is None:
+            cache = romanCache
+        before = cache.stats()
+
+        table = self.M21Table
+        chroma = np.zeros((len(table), 12), dtype=np.uint8)
+        parsed = np.zeros(len(table), dtype=bool)
+        for i, (global_key, local_key, figure) in enumerate(zip(
+                table['global_key'].tolist(), table['local_key'].tolist(), table['chord'].tolist())):
+            pitchClasses = cache.pitchClasses(figure, getLocalKey(local_key, global_key))
+            if pitchClasses is None:
+                continue
+            chroma[i, list(pitchClasses)] = 1
+            parsed[i] = True
+
+        self.romanStats = cache.stats(since=before)
+
+        rows = np.flatnonzero(parsed)
+        returnInfo = {'chroma': chroma[rows],
+                      'measure': table['measure'][rows],
+                      'beat': table['beat'][rows],
+                      'totbeat': table['totbeat'][rows],
+                      'length': table['length'][rows],
+                      'row': rows,}
+        if weighted:
+            lengths = np.nan_to_num(returnInfo['length'])[:, None]
+            returnInfo['weighted'] = (returnInfo['chroma'] * lengths).astype(np.float32)
+        return returnInfo
+
+    def toM21(self, cache=None, skipFailed=False):
         '''
         Takes chords from an array and inserts them into a music21 stream prepared by .prepStream().
+        Rows are grouped by measure, and each measure (from the dict self.measures) gets all its
+        Roman numerals in one pass, so the time taken grows linearly with the number of rows.
+        Roman numerals are copies from a RomanCache (by default, the shared romanCache);
+        see self.romanStats for its hit rate.
+        Figures that cannot be parsed raise a ValueError, or (skipFailed=True) are left out,
+        and counted in self.romanStats.
         '''
 
-        self.prepStream()
-
-        s = self.prepdStream # copy.Deepcopy?
-        p = s.parts[0] # Just to get to the part, not that there are necessarily several.
-
-        harmonicArray = self.M21Array
-
-        for row in harmonicArray[1:]: # Ignore headers again ...
-
-            # Get info.
-            firstColumn = str(row[0])
-            # altchord =
-            thisMeasure = int(row[2])
-            beat =  float(row[3]) # NB beat = offset + 1, so add extra variable for ...
-            offsetInMeasure = beat - 1
-            totbeat = float(row[4]) # music21's 'offset' but again, + 1 (starts on 1)
-            # timesig = # Needed to check changes TODO
-            # op, no, mov = 4, 5, 6 # Dealt with in metadata.
-            length = float(row[9]) # music21's 'quarterLength'
-            global_key = str(row[10])
-            local_key = getLocalKey(str(row[11]), global_key)
-            # pedal =
-            numeral = str(row[13])
-            form = str(row[14])
-            figbass = str(row[15])
-            changes = str(row[16])
-            relativeRoot = str(row[17])
-            # phraseend = #
-
-            # Insert the rn to the relevant measure
-            if numeral:
-                combined = ''.join([numeral, form, figbass])
-                # Simply omit 'changes' columns for now -- more conversion needed. TODO***
-                if relativeRoot: # special case requiring '/'.
-                    combined = ''.join([combined, '/', relativeRoot])
-
-                rn = roman.RomanNumeral(combined, local_key)
-                rn.quarterLength = length
-                try:
-                    p.measure(thisMeasure).insert(offsetInMeasure, rn)
-                except:
-                    raise ValueError('No such measure number %i in this piece' %thisMeasure)
+        if cache is None:
+            cache = romanCache
+        before = cache.stats()
+
+        s = self.prepStream()
 
+        table = self.M21Table
+
+        rowsByMeasure = {} # measure number: [(offset, figure, local key, length)]
+        for thisMeasure, beat, length, global_key, local_key, numeral, form, figbass, relativeRoot in zip(
+                table['measure'].tolist(), table['beat'].tolist(), table['length'].tolist(),
+                table['global_key'].tolist(), table['local_key'].tolist(), table['numeral'].tolist(),
+                table['form'].tolist(), table['figbass'].tolist(), table['relativeroot'].tolist()):
+            # op, no, mov: dealt with in metadata. Timesig: in prepStream.
+            if not numeral:
+                continue
+            combined = ''.join([numeral, form, figbass])
+            # Simply omit 'changes' columns for now -- more conversion needed. TODO***
+            if relativeRoot: # special case requiring '/'.
+                combined = ''.join([combined, '/', relativeRoot])
+            offsetInMeasure = beat - 1 # NB beat = offset + 1
+            rowsByMeasure.setdefault(thisMeasure, []).append(
+                (offsetInMeasure, combined, getLocalKey(local_key, global_key), length))
+
+        for thisMeasure, rows in rowsByMeasure.items():
+            m = self.measures.get(thisMeasure)
+            if m is None:
+                raise ValueError('No such measure number %i in this piece' %thisMeasure)
+            for offsetInMeasure, combined, local_key, length in rows:
+                try:
+                    rn = cache.romanNumeral(combined, local_key, quarterLength=length) # length: music21's 'quarterLength'
+                except ValueError:
+                    if skipFailed:
+                        continue
+                    raise
+                m.coreInsert(offsetInMeasure - m.paddingLeft, rn)
+            m.coreElementsChanged()
+
+        self.romanStats = cache.stats(since=before)
         self.M21stream = s
         return s
 
@@ -336,47 +400,64 @@ class TSV:
         Prepares a music21 stream for the harmonic analysis to go into.
         Specifically: creates the score, part, and measure streams,
         as well as some (the available) metadata based on the orginal TSV data.
+        Time signatures follow the timesig column (as of the first row in each measure),
+        and an anacrusis (measure 0) is a measure of that length with paddingLeft for the rest.
+        The measures are also kept in self.measures by number.
         '''
 
         s = stream.Score()
         p = stream.Part()
 
-        harmonicArray = self.M21Array
+        table = self.M21Table
 
-        # Transfer metadatafrom within array. Check no in-doc changes (one doc, two mvmts). TODO***
+        # Transfer metadata from the first row (op, no and mov taken as constant: one movement per file).
         s.insert(0, metadata.Metadata())
-        s.metadata.opusNumber = harmonicArray[1][6]
-        s.metadata.number = harmonicArray[1][7]
-        s.metadata.movementNumber = harmonicArray[1][8]
+        s.metadata.opusNumber = str(table['op'][0])
+        s.metadata.number = str(table['no'][0])
+        s.metadata.movementNumber = str(table['mov'][0])
         # Would use int() except they sometimes include text like 'op2', 'no1'.
 
-        startingKeySig = str(harmonicArray[1][10])
-        ks = key.Key(startingKeySig)
-        p.insert(0, ks)
-
-        startingTimeSig = str(harmonicArray[1][5])
-        ts = meter.TimeSignature(startingTimeSig)
-        p.insert(0, ts) # Check for ts changes later. TODO***
-
-        numerator = ts.numerator
+        measures = table['measure'].tolist()
+        timeSigs = {} # measure number: timesig of its first row
+        for thisMeasure, timesig in zip(measures, table['timesig'].tolist()):
+            if timesig and thisMeasure not in timeSigs:
+                timeSigs[thisMeasure] = timesig
 
-        measures = list([int(row[2]) for row in harmonicArray[1:]]) # Headers again ...
-        firstMeasure = measures[0]
-        #
-        last = measures[-1]
-        #
-        difference = 0 # initialise. 0 where no anacrusis (piece starts at the beginning of m1).
-        if firstMeasure == 0:
+        firstMeasure = min(measures)
+        anacrusis = None # Length, where the piece starts with measure 0.
+        if firstMeasure == 0 and 1 in measures:
             measure1index = measures.index(1)
-            difference += (harmonicArray[measure1index][4] - harmonicArray[0][4]) # totbeat
+            anacrusis = table['totbeat'][measure1index] - table['totbeat'][0]
+            if anacrusis != anacrusis: # NaN: no totbeat. Assume measure 0 starts with its first chord.
+                anacrusis = None
 
         # Insert all measures into stream.
-        for eachMeasureNo in range(measures[0], measures[-1]+1): # From start (0 or 1) to end.
+        self.measures = {}
+        currentTimeSig = None
+        ts = meter.TimeSignature() # Default (4/4) where none given
+        offset = 0.0
+        for eachMeasureNo in range(firstMeasure, max(measures)+1): # From start (0 or 1) to end.
             m = stream.Measure(number=eachMeasureNo)
-            m.offset = (eachMeasureNo-1)*numerator + difference
-            # Check for timesig changes. TODO***
-            # Generalise for all timesig types (compound). TODO***
-            p.insert(m)
+            timesig = timeSigs.get(eachMeasureNo, currentTimeSig)
+            if eachMeasureNo == firstMeasure or timesig != currentTimeSig:
+                if timesig:
+                    ts = meter.TimeSignature(timesig)
+                m.coreInsert(0, ts)
+                currentTimeSig = timesig
+            if eachMeasureNo == firstMeasure:
+                m.coreInsert(0, key.Key(str(table['global_key'][0])))
+
+            barLength = ts.barDuration.quarterLength
+            if eachMeasureNo == 0:
+                if anacrusis is None:
+                    anacrusis = barLength - (table['beat'][0] - 1)
+                m.paddingLeft = barLength - anacrusis
+            m.coreElementsChanged()
+
+            p.coreInsert(offset, m)
+            self.measures[eachMeasureNo] = m
+            offset += barLength - m.paddingLeft
+        p.coreElementsChanged()
 
         s.append(p)
 
@@ -386,19 +467,593 @@ class TSV:
 
 #------------------------------------------------------------------------------
 
+# Typed, columnar table for the ABC schema
+
+abcSchema = [('chord', str), # 0
+             ('altchord', str),
+             ('measure', int),
+             ('beat', float),
+             ('totbeat', float),
+             ('timesig', str), # 5
+             ('op', str),
+             ('no', str),
+             ('mov', str),
+             ('length', float),
+             ('global_key', str), # 10
+             ('local_key', str),
+             ('pedal', str),
+             ('numeral', str),
+             ('form', str),
+             ('figbass', str), # 15
+             ('changes', str),
+             ('relativeroot', str),
+             ('phraseend', str),
+             ]
+
+abcHeaders = [x[0] for x in abcSchema]
+
+class HarmonicTable:
+    '''
+    A harmonic analysis in the 19-column ABC schema (abcSchema) as a dict of typed column arrays:
+    int for measure; float for beat, totbeat and length (NaN where empty); str otherwise ('' where empty).
+    The notation is 'ABC' or 'music21'; conversion between them works on whole columns at once. So:
+    >>> abc = HarmonicTable.fromTSV('op18no1mov1.tsv')
+    >>> m21 = abc.toM21()
+    >>> m21['numeral'][:4], m21['measure'][:4]
+    '''
+
+    def __init__(self, columns, notation='ABC'):
+        self.columns = columns # name: array. Never changed in place, so safely shared between tables.
+        self.notation = notation
+
+    @classmethod
+    def fromRows(cls, rows, notation='ABC'):
+        '''
+        Makes a table from rows of values (without headers) in the order of abcSchema.
+        '''
+
+        rows = [list(row) + [None] * (len(abcSchema) - len(row)) for row in rows]
+        columns = {}
+        for i, (name, dtype) in enumerate(abcSchema):
+            columns[name] = makeColumn([row[i] for row in rows], dtype)
+        return cls(columns, notation)
+
+    @classmethod
+    def fromTSV(cls, path, notation='ABC'):
+        '''
+        Reads a TSV file (gzipped if the path ends '.gz'),
+        ignoring header rows (including those of any further works appended).
+        '''
+
+        with openText(path) as tsvfile:
+            rows = [row for row in csv.reader(tsvfile, delimiter='\t', quotechar='"')
+                    if row and row[0] != abcHeaders[0]]
+        return cls.fromRows(rows, notation)
+
+    def __len__(self):
+        return len(self.columns['measure'])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def toRows(self):
+        '''
+        Returns the rows as lists of Python values (None where empty), in the order of abcSchema.
+        '''
+
+        columnLists = []
+        for name, dtype in abcSchema:
+            values = self.columns[name].tolist()
+            if dtype is str:
+                values = [x if x else None for x in values]
+            elif dtype is float:
+                values = [None if x != x else x for x in values] # NaN
+            columnLists.append(values)
+        return [list(row) for row in zip(*columnLists)]
+
+    def toArray(self):
+        '''
+        Returns an array of the headers and rows, as the ABC_Array and M21Array of the classes above.
+        '''
+
+        return array([abcHeaders] + self.toRows(), dtype=object)
+
+    def toTSV(self, path, append=False):
+        '''
+        Writes the table to a TSV file (atomically; see TSVWriter).
+        With append=True, adds the rows to the end of an existing file instead (headers only if new).
+        '''
+
+        if not append:
+            with TSVWriter(path) as writer:
+                writer.writeTable(self)
+        elif os.path.exists(path) and os.path.getsize(path):
+            arrayToTSV(self.toRows(), '', path, mode='a')
+        else:
+            arrayToTSV([abcHeaders] + self.toRows(), '', path, mode='a')
+
+    def toABC(self):
+        if self.notation == 'ABC':
+            return self
+        return self.converted('m21-ABC')
+
+    def toM21(self):
+        if self.notation == 'music21':
+            return self
+        return self.converted('ABC-m21')
+
+    def converted(self, direction):
+        '''
+        Returns a new table with the local key, numeral and relative root columns swapped to
+        the other notation (see characterSwaps), working from the global key to the local key,
+        and from there to the relative root and numeral.
+        From ABC, the chord column is made from the m21 numeral, form, figbass and relative root.
+        '''
+
+        columns = dict(self.columns)
+
+        globalMinor = isLowerCase(columns['global_key'])
+        localKey = swapColumn(columns['local_key'], globalMinor, direction)
+        localMinor = isLowerCase(localKey)
+
+        relativeRoot = columns['relativeroot']
+        hasRelative = relativeRoot != ''
+        relativeMinor = isLowerCase(relativeRoot)
+        relativeRoot = np.where(hasRelative,
+                                swapColumn(relativeRoot, localMinor & relativeMinor, direction),
+                                relativeRoot)
+
+        numeral = columns['numeral']
+        numeral = np.where(hasRelative & ~relativeMinor, # Unchanged
+                           numeral,
+                           swapColumn(numeral, np.where(hasRelative, True, localMinor), direction))
+
+        columns['local_key'] = localKey
+        columns['relativeroot'] = relativeRoot
+        columns['numeral'] = numeral
+
+        if direction == 'ABC-m21': # Combined figure (though NB no key in the m21 case).
+            combined = np.char.add(np.char.add(numeral, columns['form']), columns['figbass'])
+            columns['chord'] = np.where(hasRelative,
+                                        np.char.add(np.char.add(combined, '/'), relativeRoot),
+                                        combined)
+            notation = 'music21'
+        else:
+            notation = 'ABC'
+
+        return HarmonicTable(columns, notation)
+
+def makeColumn(values, dtype):
+    '''
+    Returns a typed column array from a list of values (None or '' where empty):
+    empty values are '' (str), NaN (float) or -1 (int, e.g. the measure of a chord not in a measure).
+    '''
+
+    if dtype is str:
+        return np.array(['' if x is None else str(x) for x in values], dtype=str)
+    if dtype is float:
+        return np.array([np.nan if x is None or x == '' else float(x) for x in values], dtype=np.float64)
+    return np.array([-1 if x is None or x == '' else int(float(x)) for x in values], dtype=np.int64)
+
+def isLowerCase(values):
+    return values == np.char.lower(values)
+
+def swapColumn(values, minor, direction):
+    '''
+    Applies characterSwaps to a whole column of strings (with minor, a boolean, per row),
+    calling it only once for each distinct combination.
+    '''
+
+    minor = np.broadcast_to(minor, values.shape)
+    keys = np.char.add(np.where(minor, 'm', 'M'), values)
+    uniqueKeys, inverse = np.unique(keys, return_inverse=True)
+    swapped = [characterSwaps(x[1:], minor=(x[0] == 'm'), direction=direction)
+               for x in uniqueKeys.tolist()]
+    return np.array(swapped + [''], dtype=str)[inverse.reshape(-1)] # + [''] for empty columns
+
+#------------------------------------------------------------------------------
+
+# Streaming output for many works
+
+class TSVWriter:
+    '''
+    Writes any number of works (HarmonicTables, or M21 and TSV objects) to one TSV file in one pass:
+    the headers once at the top, then buffered rows.
+    Gzipped if compress=True (by default, where the path ends '.gz').
+    The file is written to a temporary file in the same directory and only renamed to the path
+    on closing, so other processes (e.g. concurrent batch jobs) never see a half-written file,
+    and an interrupted run leaves no file to resume from by mistake. So:
+    >>> with TSVWriter('corpus.tsv.gz') as writer:
+    ...     for path in tsvPaths:
+    ...         writer.writeWork(TSV(path))
+    '''
+
+    def __init__(self, path, headers=abcHeaders, compress=None, bufferSize=10000):
+        self.path = path
+        self.bufferSize = bufferSize
+        self.buffer = []
+        self.noOfRows = 0
+        self.noOfWorks = 0
+        if compress is None:
+            compress = path.endswith('.gz')
+
+        directory = os.path.dirname(os.path.abspath(path))
+        fileDescriptor, self.temporaryPath = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        self.rawFile = os.fdopen(fileDescriptor, 'wb')
+        self.gzipFile = None
+        binaryFile = self.rawFile
+        if compress:
+            self.gzipFile = gzip.GzipFile(filename='', mode='wb', fileobj=self.rawFile, mtime=0)
+            binaryFile = self.gzipFile
+        self.textFile = io.TextIOWrapper(binaryFile, encoding='utf-8', newline='')
+        self.csvOut = csv.writer(self.textFile, delimiter='\t',
+                                 quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        if headers:
+            self.csvOut.writerow(headers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exceptionType, exception, traceback):
+        if exceptionType is None:
+            self.close()
+        else:
+            self.abort()
+
+    def writeRows(self, rows):
+        self.buffer.extend(rows)
+        if len(self.buffer) >= self.bufferSize:
+            self.flush()
+
+    def writeTable(self, table, notation=None):
+        '''
+        Writes all rows of a HarmonicTable, converted to notation ('ABC' or 'music21') if given.
+        '''
+
+        if notation == 'ABC':
+            table = table.toABC()
+        elif notation == 'music21':
+            table = table.toM21()
+        rows = table.toRows()
+        self.writeRows(rows)
+        self.noOfWorks += 1
+        return len(rows)
+
+    def writeWork(self, work, notation='ABC'):
+        '''
+        Writes one M21 or TSV object in the ABC or music21 notation.
+        '''
+
+        return self.writeTable(work.M21Table, notation=notation)
+
+    def flush(self):
+        self.csvOut.writerows(self.buffer)
+        self.noOfRows += len(self.buffer)
+        self.buffer = []
+
+    def close(self):
+        '''
+        Writes any buffered rows, and moves the finished file into place.
+        '''
+
+        try:
+            self.flush()
+            self.closeFiles()
+        except:
+            self.abort()
+            raise
+        os.chmod(self.temporaryPath, 0o644) # Not the temporary file's 0o600
+        os.replace(self.temporaryPath, self.path)
+
+    def abort(self):
+        '''
+        Discards everything written (leaving any existing file at the path as it was).
+        '''
+
+        self.buffer = []
+        try:
+            self.closeFiles()
+        finally:
+            if os.path.exists(self.temporaryPath):
+                os.remove(self.temporaryPath)
+
+    def closeFiles(self):
+        if not self.textFile.closed:
+            self.textFile.close() # Also closes the gzip layer (which leaves the raw file open)
+        self.rawFile.close()
+
+def writeTSV(works, path, notation='ABC', compress=None):
+    '''
+    Writes several works (M21 or TSV objects, or HarmonicTables) to one TSV file,
+    with the headers once. Returns the number of rows written.
+    '''
+
+    with TSVWriter(path, compress=compress) as writer:
+        for work in works:
+            if isinstance(work, HarmonicTable):
+                writer.writeTable(work, notation=notation)
+            else:
+                writer.writeWork(work, notation=notation)
+        writer.flush()
+    return writer.noOfRows
+
+#------------------------------------------------------------------------------
+
+# Chroma arrays for a corpus
+
+def chromaDtype(weighted=False):
+    '''
+    The structured dtype of the corpus chroma file: one record per chord (see reduceCorpus).
+    '''
+
+    fields = [('piece', np.int32), # Line number in the .works file
+              ('row', np.int32),
+              ('measure', np.int32),
+              ('beat', np.float64),
+              ('totbeat', np.float64),
+              ('length', np.float64),
+              ('chroma', np.uint8, (12,)),]
+    if weighted:
+        fields.append(('weighted', np.float32, (12,)))
+    return np.dtype(fields)
+
+def chromaForFile(path, weighted=False):
+    '''
+    TSV.chroma for one TSV file, with the number of rows left out.
+    '''
+
+    tsv = TSV(path)
+    returnInfo = tsv.chroma(weighted=weighted)
+    returnInfo['failed'] = tsv.romanStats['failed']
+    return returnInfo
+
+def reduceCorpus(tsvPaths, npyPath, weighted=False, workers=1, chunkSize=None, timeout=None):
+    '''
+    Reduces many TSV files to chroma (see TSV.chroma) across a pool of worker processes
+    (see BatchProcessing.runBatch), and writes all of them to one structured .npy file (chromaDtype),
+    in the order given, with the work names (one per line; line number = 'piece') in npyPath + '.works'.
+    Both are written atomically. Load with loadChroma, which maps the file rather than reading it. So:
+    >>> reduceCorpus(sorted(glob.glob('ABC/data/tsv/*.tsv')), 'ABC.npy', weighted=True, workers=None)
+    >>> data, works = loadChroma('ABC.npy')
+    >>> data['chroma'].sum(axis=0) # Pitch class counts for the corpus
+    Returns a dict of the numbers of works, rows and failed figures, the errors, and the time taken.
+    '''
+
+    batch = BatchProcessing.runBatch(partial(chromaForFile, weighted=weighted), tsvPaths,
+                                     workers=workers, chunkSize=chunkSize, timeout=timeout, verbose=False)
+    results = batch['results']
+
+    data = np.zeros(sum([len(x['row']) for path, x in results]), dtype=chromaDtype(weighted))
+    start = 0
+    for piece, (path, arrays) in enumerate(results):
+        end = start + len(arrays['row'])
+        data['piece'][start:end] = piece
+        for name in data.dtype.names[1:]:
+            data[name][start:end] = arrays[name]
+        start = end
+
+    works = [os.path.basename(path) for path, arrays in results]
+    writeAtomically(npyPath + '.works', lambda fileout: fileout.write(''.join([x + '\n' for x in works]).encode()))
+    writeAtomically(npyPath, lambda fileout: np.save(fileout, data))
+
+    returnInfo = {'noOfWorks': len(results),
+                  'noOfRows': len(data),
+                  'failed': sum([x['failed'] for path, x in results]),
+                  'errors': batch['errors'],
+                  'seconds': batch['seconds'],}
+    return returnInfo
+
+def loadChroma(npyPath):
+    '''
+    Returns the structured array of a corpus chroma file (memory-mapped, read only),
+    and the list of work names.
+    '''
+
+    with open(npyPath + '.works') as filein:
+        works = [line.rstrip('\n') for line in filein]
+    return np.load(npyPath, mmap_mode='r'), works
+
+def writeAtomically(path, write):
+    '''
+    Calls write(binary file) on a temporary file, then moves it to the path.
+    '''
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fileDescriptor, temporaryPath = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fileDescriptor, 'wb') as fileout:
+            write(fileout)
+        os.chmod(temporaryPath, 0o644)
+        os.replace(temporaryPath, path)
+    except:
+        os.remove(temporaryPath)
+        raise
+
+#------------------------------------------------------------------------------
+
+# Batch conversion, both ways, for a corpus (also from the command line; see main)
+
+analysisExtensions = {'.rntxt': 'M21-ABC', # Input extension: direction
+                      '.tsv': 'ABC-M21',
+                      '.tsv.gz': 'ABC-M21',}
+
+def getAnalysisFiles(inputs):
+    '''
+    Returns the analysis files (see analysisExtensions) from a list of directories, files,
+    and / or glob patterns (e.g. 'ABC/data/tsv/op18*.tsv'), sorted, without duplicates.
+    '''
+
+    paths = []
+    for entry in inputs:
+        if os.path.isdir(entry):
+            paths.extend([os.path.join(entry, x) for x in os.listdir(entry)])
+        else:
+            paths.extend(glob.glob(entry))
+    return sorted(set([x for x in paths if os.path.isfile(x) and splitExtension(x)[1] in analysisExtensions]))
+
+def splitExtension(path):
+    '''
+    Splits a file name into its stem and (analysis) extension, e.g. ('op18no1mov1', '.tsv.gz').
+    '''
+
+    name = os.path.basename(path)
+    for extension in sorted(analysisExtensions, key=len, reverse=True):
+        if name.endswith(extension):
+            return name[:-len(extension)], extension
+    return os.path.splitext(name)
+
+def convertFile(path, outPath='./', writeTSVFile=True):
+    '''
+    Converts one analysis file:
+    RomanText (or another music21 harmonic analysis) to an ABC TSV file, or
+    an ABC TSV file to RomanText (leaving out, and counting, figures that cannot be parsed),
+    named as the input, in the outPath directory.
+    With writeTSVFile=False, the TSV is not written but the table returned (e.g. for a combined file).
+    Returns a dict of the direction, output, number of rows, failed figures, and time taken.
+    '''
+
+    start = time.perf_counter()
+    stem, extension = splitExtension(path)
+    direction = analysisExtensions[extension]
+    returnInfo = {'direction': direction,
+                  'output': None,
+                  'table': None,}
+
+    if direction == 'M21-ABC':
+        work = M21(path)
+        returnInfo['rows'] = len(work.M21Table)
+        returnInfo['failedFigures'] = {}
+        if writeTSVFile:
+            returnInfo['output'] = os.path.join(outPath, stem + '.tsv')
+            writeTSV([work], returnInfo['output'])
+        else:
+            returnInfo['table'] = work.ABCTable
+    else:
+        work = TSV(path)
+        returnInfo['rows'] = len(work.M21Table)
+        returnInfo['output'] = os.path.join(outPath, stem + '.rntxt')
+        analysis = work.toM21(skipFailed=True)
+        text = '\n'.join(writeRoman.RnWriter(analysis).combinedList) + '\n'
+        writeAtomically(returnInfo['output'], lambda fileout: fileout.write(text.encode()))
+        returnInfo['failedFigures'] = {'%s in %s' %figureKey: n
+                                       for figureKey, n in work.romanStats['failedFigures'].items()}
+
+    returnInfo['failed'] = sum(returnInfo['failedFigures'].values())
+    returnInfo['seconds'] = time.perf_counter() - start
+    return returnInfo
+
+def convertCorpus(inputs, outPath='./', combined=None, workers=1, chunkSize=None, timeout=None):
+    '''
+    Converts all the analysis files in inputs (see getAnalysisFiles) across a pool of worker processes
+    (see BatchProcessing.runBatch): RomanText to ABC TSV, and ABC TSV to RomanText (see convertFile).
+    Per work, in the outPath directory, or (for the TSV files) combined into one file of that name.
+    Returns a summary report: numbers of files, rows and failed figures (in total and per direction),
+    the most common failed figures, the errors, and the time taken.
+    '''
+
+    paths = getAnalysisFiles(inputs)
+    os.makedirs(outPath, exist_ok=True)
+    batch = BatchProcessing.runBatch(partial(convertFile, outPath=outPath, writeTSVFile=combined is None),
+                                     paths,
+                                     workers=workers, chunkSize=chunkSize, timeout=timeout, verbose=False)
+
+    if combined is not None:
+        tables = [x['table'] for path, x in batch['results'] if x['table'] is not None]
+        writeTSV(tables, os.path.join(outPath, combined))
+
+    directions = {}
+    failedFigures = Counter()
+    for path, result in batch['results']:
+        summary = directions.setdefault(result['direction'], {'noOfFiles': 0, 'rows': 0, 'failed': 0, 'seconds': 0.0})
+        summary['noOfFiles'] += 1
+        summary['rows'] += result['rows']
+        summary['failed'] += result['failed']
+        summary['seconds'] += result['seconds']
+        failedFigures.update(result['failedFigures'])
+
+    returnInfo = {'noOfFiles': len(paths),
+                  'converted': len(batch['results']),
+                  'rows': sum([x['rows'] for x in directions.values()]),
+                  'failed': sum(failedFigures.values()),
+                  'directions': directions,
+                  'failedFigures': failedFigures.most_common(),
+                  'errors': batch['errors'],
+                  'seconds': batch['seconds'],
+                  'filesPerSecond': batch['filesPerSecond'],
+                  'outputs': [x['output'] for path, x in batch['results'] if x['output'] is not None],}
+    if combined is not None:
+        returnInfo['outputs'].append(os.path.join(outPath, combined))
+    return returnInfo
+
+def printReport(report, noOfFigures=10):
+    '''
+    Prints the summary report of convertCorpus.
+    '''
+
+    print('Converted %i of %i files (%i rows) in %.2f seconds (%.2f files per second)'
+          %(report['converted'], report['noOfFiles'], report['rows'], report['seconds'], report['filesPerSecond']))
+    for direction, summary in sorted(report['directions'].items()):
+        print('  %s: %i files, %i rows, %i failed figures'
+              %(direction, summary['noOfFiles'], summary['rows'], summary['failed']))
+    if report['failedFigures']:
+        print('Most common failed figures:')
+        for figureKey, n in report['failedFigures'][:noOfFigures]:
+            print('  %s: %i' %(figureKey, n))
+    for path, message in report['errors']:
+        print('Error in processing '+path+': '+message)
+
+def main(argv=None):
+    '''
+    Command line batch conversion (see convertCorpus). So:
+    python TSV_for_ABC.py ABC/data/tsv/ 'monteverdi/*.rntxt' -o converted/ --workers 0 --report report.json
+    Returns 1 if any file could not be converted, and 0 otherwise.
+    '''
+
+    parser = argparse.ArgumentParser(description='Convert harmonic analyses between RomanText (.rntxt) '
+                                                 'and ABC TSV (.tsv, .tsv.gz), both ways.')
+    parser.add_argument('inputs', nargs='+', help='directories, files, or glob patterns')
+    parser.add_argument('-o', '--out', default='./', help='output directory')
+    parser.add_argument('--combined', default=None,
+                        help='write all TSV output to one file of this name (in the output directory)')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='worker processes (0 for all cores)')
+    parser.add_argument('--timeout', type=float, default=None, help='time limit per file (seconds)')
+    parser.add_argument('--report', default=None, help='also write the summary report to this JSON file')
+    args = parser.parse_args(argv)
+
+    report = convertCorpus(args.inputs, outPath=args.out, combined=args.combined,
+                           workers=args.workers or None, timeout=args.timeout)
+    printReport(report)
+    if args.report is not None:
+        with open(args.report, 'w') as fileout:
+            json.dump(report, fileout, indent=1)
+
+    return 1 if report['errors'] else 0
+
+def openText(path):
+    '''
+    Opens a (possibly gzipped) text file for reading with the csv module.
+    '''
+
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', newline='')
+    return open(path, newline='')
+
+#------------------------------------------------------------------------------
+
 # No class -- static functions needed in both directions.
 
-def arrayToTSV(infoArray, outFilePath, outFileName):
+def arrayToTSV(infoArray, outFilePath, outFileName, mode='a'):
     '''
     Takes an array (of any kind) and writes a TSV file.
     '''
 
-    with open(outFilePath+outFileName, 'a') as csvfile: # 'a' to allow multiple works
+    with open(outFilePath+outFileName, mode, newline='') as csvfile: # 'a' to allow multiple works
         csvOut = csv.writer(csvfile, delimiter='\t',
                             quotechar='"', quoting=csv.QUOTE_MINIMAL)
         for sublist in infoArray:
             csvOut.writerow([x for x in sublist])
 
+@lru_cache(maxsize=4096)
 def characterSwaps(preString, minor=True, direction='m21-ABC'):
     '''
     Character swap function to coordinate between the two notational versions.
@@ -460,6 +1115,7 @@ def characterSwaps(preString, minor=True, direction='m21-ABC'):
 
     return postString
 
+@lru_cache(maxsize=4096)
 def getLocalKey(local_key, global_key, convert=False):
     '''
     Re-casts comparative local key (e.g. 'V of G major') in its own terms ('D').
@@ -473,23 +1129,144 @@ def getLocalKey(local_key, global_key, convert=False):
     Set convert=True to convert from TSV to m21 formats. Hence;
     >>> getLocalKey('vii', 'a', convert=True)
     'g'
+    Results are cached (see cacheStats), and common numerals come from the key tables
+    (whether the global key is spelt as in music21, 'E-', or in the TSV files, 'Eb').
     '''
 
+    global_key = m21KeyName(global_key)
     if convert==True:
         if global_key[0] == global_key[0].lower(): # Minor. Given by first character (e.g. D, d, F#, f#, Bb, bb)
             local_key = characterSwaps(local_key, minor=True, direction='ABC-m21')
         else:
             local_key = characterSwaps(local_key, minor=False, direction='ABC-m21')
 
+    table = getKeyTable(global_key)
+    if local_key in table:
+        return table[local_key]
+    return computeLocalKey(local_key, global_key)
+
+def computeLocalKey(local_key, global_key):
+    '''
+    Works out getLocalKey (m21 format) with music21, uncached.
+    '''
+
     asRoman = roman.RomanNumeral(local_key, global_key)
     rt = asRoman.root().name
     if asRoman.isMajorTriad():
         newKey = rt.upper()
     elif asRoman.isMinorTriad():
         newKey = rt.lower()
+    else:
+        raise ValueError('%s in %s is neither a major nor a minor triad.' %(local_key, global_key))
 
     return newKey
 
+# Key relationships: the local key for each of the common numerals in each key.
+
+allKeys = ['C', 'C#', 'D', 'E-', 'E', 'F', 'F#', 'G', 'A-', 'A', 'B-', 'B',
+           'c', 'c#', 'd', 'e-', 'e', 'f', 'f#', 'g', 'g#', 'a', 'b-', 'b']
+
+commonNumerals = ['I', 'i', 'II', 'ii', 'III', 'iii', 'IV', 'iv', 'V', 'v', 'VI', 'vi', 'VII', 'vii',
+                  'bII', 'bIII', 'biii', 'bVI', 'bvi', 'bVII', 'bvii', '#iv', '#vi', '#vii']
+
+keyTables = {} # Global key: {numeral: local key}
+
+def makeKeyTable(global_key, numerals=commonNumerals):
+    '''
+    Returns {numeral: local key} for the numerals (where a major or minor triad) in a global key.
+    >>> makeKeyTable('G')['V']
+    'D'
+    '''
+
+    table = {}
+    for numeral in numerals:
+        try:
+            table[numeral] = computeLocalKey(numeral, global_key)
+        except ValueError:
+            continue
+    return table
+
+def m21KeyName(keyName):
+    '''
+    Returns a key name with music21's flats (the key tables' names) for one with TSV flats.
+    >>> m21KeyName('Eb'), m21KeyName('bb'), m21KeyName('b')
+    ('E-', 'b-', 'b')
+    '''
+
+    return keyName[:1] + keyName[1:].replace('b', '-')
+
+def getKeyTable(global_key):
+    '''
+    Returns the key table for a global key (in either spelling; see m21KeyName), making it on first use.
+    '''
+
+    global_key = m21KeyName(global_key)
+    table = keyTables.get(global_key)
+    if table is None:
+        table = makeKeyTable(global_key)
+        keyTables[global_key] = table
+    return table
+
+def makeKeyTables(keys=allKeys):
+    '''
+    Makes the key tables for all 24 keys (or those given) in advance,
+    e.g. before starting worker processes.
+    '''
+
+    for eachKey in keys:
+        getKeyTable(eachKey)
+    return keyTables
+
+@lru_cache(maxsize=1024)
+def keyAsNumeral(keyName, global_key):
+    '''
+    Returns a key (as music21 prints it, e.g. 'E major', or a key name, e.g. 'E')
+    as the Roman numeral of its tonic triad in the global key.
+    >>> keyAsNumeral('E major', 'a')
+    'V'
+    '''
+
+    if ' ' in keyName:
+        tonic, mode = keyName.split()
+        thisKey = key.Key(tonic, mode)
+    else:
+        thisKey = getKey(keyName)
+    pitches = thisKey.pitches
+    thisChord = chord.Chord([pitches[0], pitches[2], pitches[4]])
+    return roman.romanNumeralFromChord(thisChord, getKey(global_key)).figure
+
+@lru_cache(maxsize=256)
+def getKey(keyName):
+    '''
+    Returns a music21 Key, shared between all uses of the same name.
+    '''
+
+    return key.Key(keyName)
+
+def cacheStats():
+    '''
+    Returns hits, misses, hit rate and size for each of the cached key conversions,
+    and the number of key tables made.
+    '''
+
+    returnInfo = {}
+    for function in (characterSwaps, getLocalKey, vLocalKey, getKey):
+        info = function.cache_info()
+        lookups = info.hits + info.misses
+        returnInfo[function.__name__] = {'hits': info.hits,
+                                         'misses': info.misses,
+                                         'hitRate': info.hits / lookups if lookups else 0.0,
+                                         'size': info.currsize,
+                                         'maxSize': info.maxsize,}
+    returnInfo['keyTables'] = len(keyTables)
+    return returnInfo
+
+def clearCaches():
+    for function in (characterSwaps, getLocalKey, vLocalKey, getKey):
+        function.cache_clear()
+    keyTables.clear()
+
+@lru_cache(maxsize=4096)
 def vLocalKey(rn, local_key):
     '''
     Separates comparative roman numeral for tonicisiations like 'V/IV' into the component parts of
@@ -513,6 +1290,132 @@ def vLocalKey(rn, local_key):
 
     return very_local_as_key
 
+#------------------------------------------------------------------------------
+
+# Roman numerals, parsed once per (figure, key)
+
+class RomanCache:
+    '''
+    Bounded (least recently used) cache of parsed Roman numerals by (figure, key name),
+    as figures repeat constantly within a movement.
+    Stores the pitch classes and a template RomanNumeral (never put in a stream);
+    romanNumeral() hands out copies of the template for use in streams.
+    Figures that music21 cannot parse are counted (by figure and key), not silently dropped.
+    So:
+    >>> cache = RomanCache()
+    >>> cache.pitchClasses('V65/V', 'D')
+    (8, 11, 2, 4)
+    >>> rn = cache.romanNumeral('V65/V', 'D', quarterLength=2)
+    >>> cache.stats()['hitRate']
+    0.5
+    '''
+
+    def __init__(self, maxSize=4096):
+        self.maxSize = maxSize
+        self.entries = OrderedDict() # (figure, key name): (template or None, pitch classes or error)
+        self.hits = 0
+        self.misses = 0
+        self.failures = Counter() # (figure, key name): no. of failed look ups
+
+    def lookUp(self, figure, keyName):
+        '''
+        Returns the (template, pitch classes) entry for a figure in a key,
+        or (None, error message) where the figure cannot be parsed.
+        '''
+
+        entryKey = (figure, keyName)
+        entry = self.entries.get(entryKey)
+        if entry is None:
+            self.misses += 1
+            try:
+                template = roman.RomanNumeral(figure, getKey(keyName))
+                entry = (template, tuple([x.pitchClass for x in template.pitches]))
+            except Exception as error:
+                entry = (None, type(error).__name__+': '+str(error))
+            self.entries[entryKey] = entry
+            if self.maxSize is not None and len(self.entries) > self.maxSize:
+                self.entries.popitem(last=False)
+        else:
+            self.hits += 1
+            self.entries.move_to_end(entryKey)
+
+        if entry[0] is None:
+            self.failures[entryKey] += 1
+        return entry
+
+    def pitchClasses(self, figure, keyName):
+        '''
+        Returns the pitch classes (tuple) of a figure in a key, or None if it cannot be parsed.
+        '''
+
+        template, pitchClasses = self.lookUp(figure, keyName)
+        if template is None:
+            return None
+        return pitchClasses
+
+    def romanNumeral(self, figure, keyName, quarterLength=None):
+        '''
+        Returns a new RomanNumeral object (safe to put in a stream) for a figure in a key.
+        Raises a ValueError if the figure cannot be parsed.
+        '''
+
+        template, pitchClasses = self.lookUp(figure, keyName)
+        if template is None:
+            raise ValueError('Cannot parse %s in %s (%s)' %(figure, keyName, pitchClasses))
+        rn = copyRoman(template)
+        if quarterLength is not None:
+            rn.quarterLength = quarterLength
+        return rn
+
+    def stats(self, since=None):
+        '''
+        Returns hits, misses, hit rate, and failed look ups (in total, and by (figure, key)).
+        For the figures of one run, pass the stats from before it as since. So:
+        >>> before = cache.stats()
+        >>> ...
+        >>> cache.stats(since=before)
+        '''
+
+        hits = self.hits
+        misses = self.misses
+        failures = Counter(self.failures)
+        if since is not None:
+            hits -= since['hits']
+            misses -= since['misses']
+            failures.subtract(since['failedFigures'])
+            failures = +failures # Drop those unchanged
+        lookups = hits + misses
+        returnInfo = {'hits': hits,
+                      'misses': misses,
+                      'hitRate': hits / lookups if lookups else 0.0,
+                      'failed': sum(failures.values()),
+                      'failedFigures': dict(failures),
+                      'entries': len(self.entries),}
+        return returnInfo
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+        self.failures.clear()
+
+romanCache = RomanCache() # Shared by default
+
+def copyRoman(template):
+    '''
+    Copies a RomanNumeral (deep copy) while sharing its key, scale, and parsing objects,
+    which are not changed by putting the copy in a stream (music21 also shares keys between them).
+    Several times faster than parsing the figure again.
+    '''
+
+    memo = {}
+    for name in ['_key', '_scale', 'impliedScale', 'secondaryRomanNumeralKey',
+                 'secondaryRomanNumeral', 'figuresNotationObj', 'pivotChord']:
+        shared = getattr(template, name, None)
+        if shared is not None:
+            memo[id(shared)] = shared
+    return deepcopy(template, memo)
+
 # NB: not used
 
 def extricateRoman(col0String):
@@ -558,8 +1461,188 @@ class Test(unittest.TestCase):
         self.assertEqual(m21Monteverdi[175][13], 'viio6')
         self.assertEqual(TSVMonteverdi[175][13], '#viio6')
 
+    def testM21Table(self):
+
+        from music21 import converter
+        analysis = converter.parse('\n'.join(['Composer: X', 'Title: Y', 'Analyst: Z',
+                                              'Time Signature: 3/4',
+                                              'm1 a: i b3 V',
+                                              'Time Signature: 2/4',
+                                              'm2 C: IV',
+                                              'm3 V7/IV']), format='romanText')
+        table = M21(analysis).M21Table
+
+        self.assertEqual(table['measure'].tolist(), [1, 1, 2, 3])
+        self.assertEqual(table['beat'].tolist(), [0.0, 2.0, 0.0, 0.0])
+        self.assertEqual(table['timesig'].tolist(), ['3/4', '3/4', '2/4', '2/4']) # Per measure
+        self.assertEqual(table['local_key'].tolist(), ['i', 'i', 'III', 'III'])
+        self.assertEqual(table['relativeroot'].tolist(), ['', '', '', 'IV'])
+        self.assertEqual(keyAsNumeral('E major', 'a'), 'V')
+
+    def testM21TableWithoutMeasures(self):
+
+        from music21 import roman
+        analysis = stream.Stream()
+        for offset, figure in ((0.0, 'I'), (2.0, 'V7'), (4.0, 'I')):
+            analysis.insert(offset, roman.RomanNumeral(figure, 'C'))
+        table = M21(analysis).M21Table
+
+        self.assertEqual(table['measure'].tolist(), [-1, -1, -1])
+        self.assertEqual(table['numeral'].tolist(), ['I', 'V7', 'I'])
+        self.assertEqual(makeColumn([None, '', '3', 4.0], int).tolist(), [-1, -1, 3, 4])
+
     # def testTSVtoM21(self): # TODO
 
+    def testHarmonicTable(self):
+
+        import os
+        import tempfile
+        rows = [['.a.i', '', '1', '1.0', '1.0', '3/4', '', '', '', '2.0', 'a', 'i', '', 'i', '', '', '', '', ''],
+                ['', '', '1', '3.0', '3.0', '3/4', '', '', '', '1.0', 'a', 'i', '', '#vii', 'o', '7', '', '', ''],
+                ['', '', '2', '1.0', '4.0', '3/4', '', '', '', '3.0', 'a', 'III', '', 'vii', '%', '43', '', 'vii', '']]
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'test.tsv')
+            HarmonicTable.fromRows(rows).toTSV(path)
+            tsv = TSV(path)
+
+        m21 = tsv.M21Table
+        self.assertEqual(m21.notation, 'music21')
+        self.assertEqual(m21['measure'].dtype, np.int64)
+        self.assertEqual(m21['length'].tolist(), [2.0, 1.0, 3.0])
+        self.assertEqual(m21['local_key'].tolist(), ['i', 'i', 'III'])
+        self.assertEqual(m21['numeral'].tolist(), ['i', 'vii', 'bvii']) # Minor (local / relative)
+        self.assertEqual(m21['relativeroot'].tolist(), ['', '', 'vii']) # Major local key
+        self.assertEqual(m21['chord'].tolist(), ['i', 'viio7', 'bvii%43/vii']) # Not truncated
+        self.assertEqual(tsv.M21Array[2][13], 'vii') # Headers first, as before
+        self.assertEqual(m21.toABC()['numeral'].tolist(), tsv.ABCTable['numeral'].tolist())
+        self.assertEqual(tsv.ABCTable['numeral'].tolist(), ['i', '#vii', 'vii']) # Unchanged
+
+    def testLazyConversions(self):
+
+        import tempfile
+        rows = [['.C.I', '', '1', '1.0', '1.0', '4/4', '', '', '', '4.0', 'C', 'I', '', 'I', '', '', '', '', '']]
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'test.tsv')
+            HarmonicTable.fromRows(rows).toTSV(path)
+            tsv = TSV(path)
+            self.assertEqual(tsv.kept(), ['ABCTable']) # Read, but not converted
+
+            tsv.reduce()
+            self.assertEqual(sorted(tsv.kept()), ['ABCTable', 'M21Table'])
+            self.assertEqual(tsv.ABC_Array[1][13], 'I')
+
+            rows[0][13] = 'V'
+            HarmonicTable.fromRows(rows).toTSV(path)
+            self.assertEqual(tsv.M21Table['numeral'].tolist(), ['I']) # Kept
+            tsv.refresh('ABCTable')
+            self.assertEqual(tsv.kept(), ['ABCTable']) # Derived ones dropped
+            self.assertEqual(tsv.M21Table['numeral'].tolist(), ['V'])
+
+        self.assertEqual(tsv.invalidate().kept(), [])
+        self.assertRaises(ValueError, tsv.invalidate, 'M21stream')
+
+    def testTSVtoM21Stream(self):
+
+        import tempfile
+        rows = [['.a.i', '', '0', '3.0', '0.0', '3/4', '', '', '', '1.0', 'a', 'i', '', 'i', '', '', '', '', ''],
+                ['', '', '1', '1.0', '1.0', '3/4', '', '', '', '3.0', 'a', 'i', '', 'V', '', '7', '', '', ''],
+                ['', '', '2', '1.0', '4.0', '6/8', '', '', '', '3.0', 'a', 'i', '', 'i', '', '', '', '', ''],
+                ['', '', '4', '2.0', '8.0', '', '', '', '', '1.0', 'a', 'i', '', 'V', '', '', '', 'III', '']]
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'test.tsv')
+            HarmonicTable.fromRows(rows).toTSV(path)
+            tsv = TSV(path)
+        s = tsv.toM21()
+
+        self.assertEqual(sorted(tsv.measures), [0, 1, 2, 3, 4]) # Incl. 3, with no chords
+        self.assertEqual([tsv.measures[x].offset for x in range(5)], [0.0, 1.0, 4.0, 7.0, 10.0])
+        self.assertEqual(tsv.measures[0].paddingLeft, 2.0) # Anacrusis of one beat
+        self.assertEqual(tsv.measures[2].timeSignature.ratioString, '6/8')
+        self.assertIsNone(tsv.measures[3].timeSignature) # Unchanged
+        romans = list(s.recurse().getElementsByClass('RomanNumeral'))
+        self.assertEqual([x.figure for x in romans], ['i', 'V7', 'i', 'V/III'])
+        self.assertEqual([x.getOffsetInHierarchy(s) for x in romans], [0.0, 1.0, 4.0, 11.0])
+        self.assertEqual(tsv.romanStats['failed'], 0)
+
+    def testReduceCorpus(self):
+
+        import tempfile
+        rows = [['.C.I', '', '1', '1.0', '1.0', '4/4', '', '', '', '4.0', 'C', 'I', '', 'I', '', '', '', '', ''],
+                ['', '', '2', '1.0', '5.0', '4/4', '', '', '', '2.0', 'C', 'I', '', 'Xyz', '', '', '', '', ''],
+                ['', '', '2', '3.0', '7.0', '4/4', '', '', '', '2.0', 'C', 'I', '', 'V', '', '7', '', '', '']]
+
+        with tempfile.TemporaryDirectory() as directory:
+            paths = [os.path.join(directory, x) for x in ['a.tsv', 'b.tsv']]
+            for path in paths:
+                HarmonicTable.fromRows(rows).toTSV(path)
+            npyPath = os.path.join(directory, 'corpus.npy')
+            info = reduceCorpus(paths, npyPath, weighted=True)
+            data, works = loadChroma(npyPath)
+
+            self.assertEqual((info['noOfWorks'], info['noOfRows'], info['failed']), (2, 4, 2))
+            self.assertIsInstance(data, np.memmap)
+            self.assertEqual(works, ['a.tsv', 'b.tsv'])
+            self.assertEqual(data['piece'].tolist(), [0, 0, 1, 1])
+            self.assertEqual(data['row'].tolist(), [0, 2, 0, 2]) # Xyz left out
+            self.assertEqual(data['chroma'][0].nonzero()[0].tolist(), [0, 4, 7])
+            self.assertEqual(data['chroma'][1].nonzero()[0].tolist(), [2, 5, 7, 11])
+            self.assertEqual(data['weighted'][0].max(), 4.0)
+            self.assertEqual(data['totbeat'][1], 7.0)
+            del data
+
+    def testConvertCorpus(self):
+
+        import tempfile
+        rows = [['.C.I', '', '1', '1.0', '1.0', '4/4', '', '', '', '2.0', 'C', 'I', '', 'I', '', '', '', '', ''],
+                ['', '', '1', '3.0', '3.0', '4/4', '', '', '', '2.0', 'C', 'I', '', 'Xyz', '', '', '', '', ''],
+                ['', '', '2', '1.0', '5.0', '4/4', '', '', '', '4.0', 'C', 'I', '', 'V', '', '7', '', '', '']]
+
+        with tempfile.TemporaryDirectory() as directory:
+            inPath = os.path.join(directory, 'in')
+            outPath = os.path.join(directory, 'out')
+            os.mkdir(inPath)
+            HarmonicTable.fromRows(rows).toTSV(os.path.join(inPath, 'a.tsv'))
+            with open(os.path.join(inPath, 'b.rntxt'), 'w') as fileout:
+                fileout.write('Composer: X\nTitle: Y\nAnalyst: Z\nTime Signature: 3/4\nm1 a: i b3 V\nm2 i\n')
+            with open(os.path.join(inPath, 'notes.txt'), 'w') as fileout:
+                fileout.write('Not an analysis')
+
+            report = convertCorpus([inPath], outPath=outPath)
+            self.assertEqual((report['noOfFiles'], report['converted'], report['rows']), (2, 2, 6))
+            self.assertEqual(report['directions']['ABC-M21']['failed'], 1)
+            self.assertEqual(report['failedFigures'], [('Xyz in C', 1)])
+            self.assertEqual(sorted(os.listdir(outPath)), ['a.rntxt', 'b.tsv'])
+            self.assertEqual(TSV(os.path.join(outPath, 'b.tsv')).ABCTable['numeral'].tolist(), ['i', 'V', 'i'])
+            self.assertEqual(len(list(M21(os.path.join(outPath, 'a.rntxt')).M21Table['chord'])), 2)
+
+            self.assertEqual(main([os.path.join(inPath, '*.rntxt'), '-o', outPath, '--combined', 'all.tsv']), 0)
+            self.assertEqual(len(HarmonicTable.fromTSV(os.path.join(outPath, 'all.tsv'))), 3)
+
+    def testTSVWriter(self):
+
+        import tempfile
+        rows = [['.C.I', '', '1', '0.0', '', '4/4', '', '', '', '4.0', 'C', 'I', '', 'I', '', '', '', '', ''],
+                ['', '', '2', '0.0', '', '4/4', '', '', '', '4.0', 'C', 'I', '', 'V', '', '7', '', '', '']]
+        table = HarmonicTable.fromRows(rows)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'corpus.tsv.gz')
+            self.assertEqual(writeTSV([table, table, table], path), 6)
+            with gzip.open(path, 'rt') as filein:
+                self.assertEqual(filein.read().count(abcHeaders[1]), 1) # Headers once
+            self.assertEqual(HarmonicTable.fromTSV(path)['numeral'].tolist(), ['I', 'V'] * 3)
+
+            try: # Nothing written if interrupted
+                with TSVWriter(os.path.join(directory, 'failed.tsv')) as writer:
+                    writer.writeTable(table)
+                    raise KeyboardInterrupt
+            except KeyboardInterrupt:
+                pass
+            self.assertEqual(os.listdir(directory), ['corpus.tsv.gz'])
+
     def testOfCharacter(self):
 
         startText = 'before%after'
@@ -615,6 +1698,47 @@ class Test(unittest.TestCase):
         self.assertIsInstance(veryLocalKey, str)
         self.assertEqual(veryLocalKey, 'b')
 
+    def testKeyCaches(self):
+
+        clearCaches()
+        for i in range(3):
+            self.assertEqual(getLocalKey('VI', 'c'), 'A-')
+            self.assertEqual(getLocalKey('V/V', 'G'), 'A') # Not in the key tables
+        stats = cacheStats()
+        self.assertEqual(stats['getLocalKey']['misses'], 2)
+        self.assertEqual(stats['getLocalKey']['hits'], 4)
+        self.assertEqual(stats['keyTables'], 2)
+
+        self.assertEqual(len(makeKeyTables()), 24)
+        for numeral, localKey in keyTables['E-'].items():
+            self.assertEqual(localKey, computeLocalKey(numeral, 'E-'))
+        self.assertRaises(ValueError, computeLocalKey, 'V7', 'C')
+
+        self.assertEqual(getLocalKey('V', 'Eb'), 'B-') # TSV spelling, same table
+        self.assertEqual(getLocalKey('iv', 'bb'), 'e-')
+        self.assertEqual(len(keyTables), 24)
+        self.assertEqual(m21KeyName('b'), 'b')
+        self.assertIs(getKey('g#'), getKey('g#'))
+
+    def testRomanCache(self):
+
+        cache = RomanCache()
+        self.assertEqual(cache.pitchClasses('V65/V', 'D'), (8, 11, 2, 4))
+        first = cache.romanNumeral('V65/V', 'D', quarterLength=2)
+        second = cache.romanNumeral('V65/V', 'D')
+        self.assertIsNot(first, second)
+        self.assertEqual((first.quarterLength, second.quarterLength), (2.0, 1.0))
+        self.assertEqual(first.figure, 'V65/V')
+        self.assertEqual(first.pitches, roman.RomanNumeral('V65/V', 'D').pitches)
+
+        before = cache.stats()
+        self.assertIsNone(cache.pitchClasses('Xyz', 'D'))
+        self.assertRaises(ValueError, cache.romanNumeral, 'Xyz', 'D')
+        run = cache.stats(since=before)
+        self.assertEqual((run['hits'], run['misses'], run['failed']), (1, 1, 2))
+        self.assertEqual(run['failedFigures'], {('Xyz', 'D'): 2})
+        self.assertEqual(cache.stats()['hitRate'], 0.6)
+
     def testExtricateRoman(self):
 
         col0String = 'ii.#viio2'
@@ -630,3 +1754,8 @@ class Test(unittest.TestCase):
 
         self.assertIsInstance(index, int)
         self.assertEqual(index, 2)
+
+#------------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    sys.exit(main())
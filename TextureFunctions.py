@@ -1,12 +1,14 @@
 import unittest
 
 import os
+import csv
 import pickle
 import numpy as np
 import matplotlib.pyplot as plt
 
 from fractions import Fraction
 from collections import Counter
+from functools import partial
 
 from music21 import common
 from music21 import exceptions21
@@ -15,6 +17,9 @@ from music21 import interval
 from music21 import stream
 from music21 import converter
 
+import BatchProcessing
+import ParseCache
+
 #------------------------------------------------------------------------------
 
 countryDict = {'Agricola, Alexander': 'Franco-Flemish',
@@ -64,7 +69,7 @@ def getOffsets(score):
     #NB: score necessarily already parsed
     #TODO: include expression in terms of bars / meter
 
-    allNotes = score.stripTies().flat.notes
+    allNotes = score.stripTies().flatten().notes
     allOffsets = [x.offset for x in allNotes]
     return allOffsets
 
@@ -72,71 +77,117 @@ def allTimePointOffsetCounts(allOffsets, minRhyDenom=8):
     '''
     Lists number of offsets for every timepoint (integrating timepoints with no offsets).
     Specify minimum rhythmic value by 'denominator' i.e. 1/4 note = 4; 1/8 note = 8.
+    Returns a NumPy array of counts.
     '''
     # E.g. use 4 for scores in original values (JRP), but 8 for modern editions.
 
-    filteredOffsets = [x for x in allOffsets if Fraction(x).denominator <= minRhyDenom/4]
+    offsetArray = np.array(allOffsets, dtype=float)
+
+    # Denominators (as for Fraction(x).denominator) only for the distinct values.
+    uniqueOffsets, firstIndices = np.unique(offsetArray, return_index=True)
+    denoms = np.array([allOffsets[i].as_integer_ratio()[1] for i in firstIndices])
+    maxDenom = int(denoms[denoms <= minRhyDenom/4].max())
     # TODO. Not currently dealing with triplets. Fix with lcm(x, y)?
 
     # Multiply up to have only integer timepoints (no fractions).
     # This is both for processing the lists and to remove editorial differences.
-    denoms = [Fraction(x).denominator for x in filteredOffsets]
-    maxDenom = max(denoms)
-
-    allOffsetsNoFractions = [x*maxDenom for x in allOffsets]
+    allOffsetsNoFractions = offsetArray * maxDenom
 
-    counts = Counter(allOffsetsNoFractions) # keys = 'positions'; values = counts
-    firstOffset = int(min(allOffsetsNoFractions))
-    lastOffset = int(max(allOffsetsNoFractions))
-    # numberOfOffsets = len(allOffsets)
+    firstOffset = int(allOffsetsNoFractions.min())
+    lastOffset = int(allOffsetsNoFractions.max())
     spanRange = lastOffset - firstOffset
 
-    allTimePointOffsetCounts = []
-    for x in range(spanRange):
-        if x in counts.keys(): # keys = positions;
-            allTimePointOffsetCounts.append(counts[x]) # values = counts
-        else:
-            allTimePointOffsetCounts.append(0) # No offsets at this position
+    # Positions counted: integer timepoints in range(spanRange); finer values fall between them.
+    inRange = ((allOffsetsNoFractions == np.floor(allOffsetsNoFractions))
+               & (allOffsetsNoFractions >= 0)
+               & (allOffsetsNoFractions < spanRange))
+    positions = allOffsetsNoFractions[inRange].astype(np.int64)
+
+    allTimePointOffsetCounts = np.bincount(positions, minlength=spanRange) # 0 = no offsets here
 
     return allTimePointOffsetCounts
-    # To do: consider returning a new dict at this point; working with values thereafter
 
 def allTimePointsWeighted(allTimePointOffsetCounts):
     '''
     Weights each offset count / timepoint by proximity to maximum/minimum no. of voices (0-n).
+    Returns a NumPy array of weighted values.
     '''
 
-    allTimePointsWeighted = []
-    maxInSection = max(allTimePointOffsetCounts)
-    for x in allTimePointOffsetCounts:
+    ## This is the homorhythmicity metric, wih range 0-1.
+    ## Low value = low homorhythmicity; high value = highly homorhythmic.
+    ## I.e. 2 * the distance from 0.5 of the count as a proportion of the maximum.
 
-        ## This is the homorhythmicity metric, wih range 0-1.
-        ## Low value = low homorhythmicity; high value = highly homorhythmic.
-        firstValue = x/maxInSection
-        if firstValue > 0.5:
-            weightedValue = 2*round(firstValue - 0.5, 2)
-        elif firstValue <= 0.5:
-            weightedValue = 2*round(0.5 - firstValue, 2)
-        allTimePointsWeighted.append(weightedValue)
-    return allTimePointsWeighted
+    counts = np.asarray(allTimePointOffsetCounts)
+    maxInSection = counts.max().item()
 
-def doOneScore(score):
+    # Weight each distinct count once (Python's round, as ever), then look them all up together.
+    uniqueCounts, inverse = np.unique(counts, return_inverse=True)
+    weights = np.array([2*round(abs(x/maxInSection - 0.5), 2) for x in uniqueCounts.tolist()])
+
+    return weights[inverse.reshape(-1)]
+
+def doOneScore(score, cache=None):
     '''
     Runs the functions up to and including windowed average for an input score or passageself.
     Can be called on a parsed score or path to the file for conversion.
+    Given a ParseCache and a path, the offsets come from the cache (no parsing) where possible.
     '''
 
-    try:
+    if isinstance(score, stream.Stream):
+        offsets = getOffsets(score) # if alredy parsed
+    elif cache is not None:
+        offsets = cache.get(score, 'offsets', getOffsets)
+    else:
         parsedScore = converter.parse(score) # Simplest way; covers both corpus and non-corpus
-    except:
-        parsedScore = score # if alredy parsed
+        offsets = getOffsets(parsedScore)
 
-    offsets = getOffsets(parsedScore)
     timePoints = allTimePointOffsetCounts(offsets)
     weightedTimePoints = allTimePointsWeighted(timePoints)
     # windowedAverages = getWindowedAverage(weightedTimePoints, windowSize=windowSize)
     return weightedTimePoints #windowedAverages removed to after pickling
 
+def getMetadata(parsedScore, fileName, fullPath):
+    '''
+    Returns the metadata list stored alongside the data for one work:
+    [fileName, fullPath, composer, parentTitle, title, country, uniqueName],
+    or just [fileName, fullPath] where the score has no (or incomplete) metadata.
+    '''
+
+    return [fileName, fullPath] + getMetadataFields(parsedScore)
+
+def getMetadataFields(parsedScore):
+    '''
+    Returns the metadata from the score itself: [composer, parentTitle, title, country, uniqueName],
+    stopping at the first that is not available.
+    '''
+
+    medataList = []
+    # ... adding as many as possible in try except
+
+    try: # try except for case of no metadata
+
+        comp = parsedScore.metadata.composer
+        medataList.append(comp)
+        parent = parsedScore.metadata.parentTitle
+        medataList.append(parent)
+        title = parsedScore.metadata.title
+        medataList.append(title)
+        country=countryDict[comp]
+        medataList.append(country)
+
+        combined = [comp, '-', parent, '-', title]
+        # uniqueName = [comp[0:4], '-', #Start of composer name
+        #               parent[5:10], '-', #Start of title, ommitting 'Missa'
+        #               title] #Whole title for case of Agnus I vs II
+        uniqueName = str(''.join(combined))
+        medataList.append(uniqueName)
+
+    except: # forget metadata and work from the directory and file names
+
+        pass
+
+    return medataList
+
 #------------------------------------------------------------------------------
 
 # Corpus processing, saving, retrieving
@@ -163,54 +214,83 @@ def getFiles(filePath='/Users/', extension=None):
                         fileList.append(file)
     return fileList
 
-def doCorpus(filePath, noOfWorks=5): #LocalCorpus
+def doCorpus(filePath, noOfWorks=5, workers=1, chunkSize=None, timeout=None, cache=None,
+             store=None, picklePath='/Users/Mark/Desktop/Pickles/',
+             manifestPath=None, minRhyDenom=8): #LocalCorpus
     '''
     Runs the functions up to and including windowed average for all works in a corpus.
+    Each score is parsed once and that parsed stream used for both the data and the metadata.
+    Set workers > 1 (or None for all cores) to process files in parallel;
+    results are the same whatever the number of workers (see BatchProcessing.runBatch).
+    Given a ParseCache, unchanged files are not parsed again at all.
+    Given a HomorhythmStore, the results are appended to that store (replacing any for the same files),
+    otherwise pickled one per work.
+    Given a manifestPath, only new or changed files are processed (all of them if minRhyDenom
+    has changed) and the outputs for deleted files are removed (see BatchProcessing.Manifest).
+    Returns the batch summary with any errors and the throughput.
     '''
 
     fileList = getFiles(filePath)
-    for fileName in fileList:
     # Alternatively, for score in corpus.corpora.LocalCorpus(str(LocalCorpusName)).all()[:noOfWorks]:
     # NB 'all' when using local corpus
 
-        fullPath = filePath+fileName # Path and name
-
-        data = doOneScore(fullPath)
-        info = [data] # So info[0] is all the data
+    removed = []
+    if manifestPath is not None:
+        manifest = BatchProcessing.Manifest(manifestPath, parameters={'minRhyDenom': minRhyDenom})
+        fileList, skipped, removed = manifest.compare({x: [filePath+x] for x in fileList})
+
+    batch = ParseCache.runBatch(partial(doOneFile, filePath, minRhyDenom=minRhyDenom), fileList, cache=cache,
+                                workers=workers, chunkSize=chunkSize, timeout=timeout)
+
+    # Old outputs are only replaced once the new ones are written (failed works keep theirs)
+    if store is not None: # Replace works already in the store (with or without a manifest), drop removed ones
+        store.remove([fileName for fileName, info in batch['results']] + removed)
+        store.appendMany([info for fileName, info in batch['results']])
+    for fileName, info in batch['results']:
+        if store is not None:
+            outputs = []
+        else:
+            outputs = [storePickle(info, fileName, path=picklePath)]
+        if manifestPath is not None:
+            staleOutputs = [x for x in manifest.outputs(fileName) if x not in outputs]
+            manifest.record(fileName, [filePath+fileName], outputs=outputs)
+            BatchProcessing.removeFiles(staleOutputs)
+
+    if manifestPath is not None:
+        for fileName in removed:
+            outputs = manifest.forget(fileName)
+            if store is None:
+                BatchProcessing.removeFiles(outputs)
+        for fileName, message in batch['errors']: # So failed files are retried next time
+            manifest.retry(fileName)
+        manifest.save()
+        BatchProcessing.printSummary(skipped, batch['results'], removed)
+
+    return batch
+
+def doOneFile(filePath, fileName, cache=None, minRhyDenom=8):
+    '''
+    Parses one file (once; or not at all, given a ParseCache with this file)
+    and returns [data, metadata] as stored by doCorpus.
+    '''
 
-        medataList = [] # Later to be added as info[1]
-        medataList.append(fileName) # info[1][0] = metadata[0] = fileName
-        medataList.append(fullPath) # info[1][1] = metadata[1] = fullPath
-        # ... adding more if possible in try except
+    fullPath = filePath+fileName # Path and name
 
+    if cache is not None:
+        derived = cache.derive(fullPath, {'offsets': getOffsets,
+                                          'metadataFields': getMetadataFields})
+        offsets = derived['offsets']
+        metadataFields = derived['metadataFields']
+    else:
         parsedScore = converter.parse(fullPath)
-        # TODO efficiency issue: currently having to parse each score twice: here and in doOneScore.
-
-        try: # try except for case of no metadata
-
-            comp = parsedScore.metadata.composer
-            medataList.append(comp)
-            parent = parsedScore.metadata.parentTitle
-            medataList.append(parent)
-            title = parsedScore.metadata.title
-            medataList.append(title)
-            country=countryDict[comp]
-            medataList.append(country)
-
-            combined = [comp, '-', parent, '-', title]
-            # uniqueName = [comp[0:4], '-', #Start of composer name
-            #               parent[5:10], '-', #Start of title, ommitting 'Missa'
-            #               title] #Whole title for case of Agnus I vs II
-            uniqueName = str(''.join(combined))
-            medataList.append(uniqueName)
-
-        except: # forget metadata and work from the directory and file names
+        offsets = getOffsets(parsedScore)
+        metadataFields = getMetadataFields(parsedScore)
 
-            pass
+    data = allTimePointsWeighted(allTimePointOffsetCounts(offsets, minRhyDenom=minRhyDenom))
+    info = [data] # So info[0] is all the data
+    info.append([fileName, fullPath] + metadataFields) # ([data],[metadata])
 
-        info.append(medataList) # ([data],[metadata])
-
-        storePickle(info, fileName)
+    return info
 
 def storePickle(obj, filename, path='/Users/Mark/Desktop/Pickles/'):
     filename = path + filename + '.p'
@@ -224,6 +304,192 @@ def loadPickle(filename, path='/Users/Mark/Desktop/Pickles/'):
         obj = pickle.load(filein)
     return obj
 
+class HomorhythmStore:
+    '''
+    Columnar on-disk store for the weighted timepoints of a whole corpus,
+    in place of one pickle per work. A directory holding:
+    values.f8: every work's weighted timepoints, one after another (memory-mapped on reading);
+    ends.i8: the index of each work's end in values (so work i is values[ends[i-1]:ends[i]]);
+    metadata.csv: each work's metadata list (as for doCorpus, though None is read back as '').
+    Works are appended to all three in that order, so on opening, anything after the last complete work
+    (i.e. from an interrupted append) is cut off.
+    So:
+    >>> store = HomorhythmStore('/Users/Mark/Desktop/Homorhythm/')
+    >>> doCorpus(directory, store=store)
+    >>> store[0] # Weighted timepoints for the first work (without copying)
+    >>> store.overallHValues() # getOverallHValue for each work, reading one file
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.valuesPath = os.path.join(path, 'values.f8')
+        self.endsPath = os.path.join(path, 'ends.i8')
+        self.metadataPath = os.path.join(path, 'metadata.csv')
+        self.refresh()
+        self.truncate()
+
+    def refresh(self):
+        '''
+        (Re)opens the store's files, e.g. after another process has appended to them.
+        Only the works complete in all three files are read (see truncate).
+        '''
+
+        self.ends = np.array([], dtype='<i8')
+        if os.path.exists(self.endsPath):
+            with open(self.endsPath, 'rb') as filein:
+                endBytes = filein.read()
+            self.ends = np.frombuffer(endBytes[:len(endBytes) - len(endBytes) % 8], dtype='<i8')
+
+        self.metadataRows = []
+        if os.path.exists(self.metadataPath):
+            with open(self.metadataPath, newline='') as csvfile:
+                text = csvfile.read()
+            if not text.endswith('\n'): # Last row incomplete
+                text = text[:text.rfind('\n') + 1]
+            self.metadataRows = [row for row in csv.reader(text.splitlines(keepends=True))]
+
+        noOfValues = os.path.getsize(self.valuesPath) // 8 if os.path.exists(self.valuesPath) else 0
+        noOfWorks = min(len(self.metadataRows), int(np.searchsorted(self.ends, noOfValues, side='right')))
+        self.ends = self.ends[:noOfWorks]
+        self.metadataRows = self.metadataRows[:noOfWorks]
+        self.mapValues()
+
+    def mapValues(self):
+        if len(self.ends) and self.ends[-1] > 0:
+            self.values = np.memmap(self.valuesPath, dtype='<f8', mode='r', shape=(int(self.ends[-1]),))
+        else:
+            self.values = np.array([], dtype='<f8')
+
+    def truncate(self):
+        '''
+        Cuts the files back to the works read by refresh,
+        removing what is left of an append that was interrupted part way through.
+        '''
+
+        noOfValues = int(self.ends[-1]) if len(self.ends) else 0
+        for path, size in ((self.valuesPath, 8 * noOfValues), (self.endsPath, 8 * len(self.ends))):
+            if os.path.exists(path) and os.path.getsize(path) > size:
+                os.truncate(path, size)
+        if os.path.exists(self.metadataPath) and len(self.metadataRows) != self.noOfMetadataLines():
+            self.writeMetadata(self.metadataRows)
+
+    def noOfMetadataLines(self):
+        with open(self.metadataPath, newline='') as csvfile:
+            return len([row for row in csv.reader(csvfile)])
+
+    def writeMetadata(self, rows):
+        '''
+        Replaces the metadata file (atomically, via a temporary file) with these rows.
+        '''
+
+        with open(self.metadataPath + '.tmp', 'w', newline='') as csvfile:
+            csvOut = csv.writer(csvfile, delimiter=',',
+                                quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            for row in rows:
+                csvOut.writerow(row)
+        os.replace(self.metadataPath + '.tmp', self.metadataPath)
+
+    def append(self, weightedTimePoints, metadataList):
+        '''
+        Adds one work to the end of the store (for many, appendMany is faster).
+        '''
+
+        self.appendMany([[weightedTimePoints, metadataList]])
+
+    def appendMany(self, works):
+        '''
+        Adds works ([weightedTimePoints, metadataList] each, as returned by doOneFile) to the end of the store,
+        opening each file once for all of them.
+        The metadata is written last, so a work only counts as stored once its metadata row is complete.
+        '''
+
+        works = list(works)
+        if not works:
+            return
+        valuesList = [np.asarray(x[0], dtype='<f8') for x in works]
+        previousEnd = int(self.ends[-1]) if len(self.ends) else 0
+        ends = previousEnd + np.cumsum([len(x) for x in valuesList], dtype='<i8')
+
+        with open(self.valuesPath, 'ab') as fileout:
+            for values in valuesList:
+                fileout.write(values.tobytes())
+        with open(self.endsPath, 'ab') as fileout:
+            fileout.write(ends.astype('<i8').tobytes())
+        with open(self.metadataPath, 'a', newline='') as csvfile:
+            csvOut = csv.writer(csvfile, delimiter=',',
+                                quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            for work in works:
+                csvOut.writerow(work[1])
+
+        self.ends = np.concatenate([self.ends, ends])
+        self.metadataRows += [[str(x) if x is not None else '' for x in work[1]] for work in works]
+        self.mapValues()
+
+    def appendPickles(self, fileNames, path='/Users/Mark/Desktop/Pickles/'):
+        '''
+        Adds works previously stored by storePickle (one pickle per work) to the store.
+        '''
+
+        self.appendMany([loadPickle(fileName, path=path) for fileName in fileNames])
+
+    def remove(self, fileNames):
+        '''
+        Removes works (by file name, the first metadata entry) from the store,
+        rewriting its files without them.
+        '''
+
+        fileNames = set(fileNames)
+        keep = [i for i in range(len(self)) if self.metadataRows[i][0] not in fileNames]
+        if len(keep) == len(self):
+            return
+
+        keptValues = [np.array(self[i]) for i in keep]
+        keptRows = [self.metadataRows[i] for i in keep]
+        ends = np.cumsum([len(x) for x in keptValues], dtype='<i8')
+
+        self.values = np.array([], dtype='<f8') # Release the memory map before replacing the file
+        for path, content in ((self.valuesPath, np.concatenate(keptValues + [np.array([])]).astype('<f8')),
+                              (self.endsPath, ends)):
+            with open(path + '.tmp', 'wb') as fileout:
+                fileout.write(content.tobytes())
+            os.replace(path + '.tmp', path)
+        self.writeMetadata(keptRows)
+
+        self.refresh()
+
+    def __len__(self):
+        return len(self.ends)
+
+    def __getitem__(self, index):
+        '''
+        Returns one work's weighted timepoints: a view on the memory-mapped file, not a copy.
+        '''
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('No work %i in this store' %index)
+        start = int(self.ends[index - 1]) if index else 0
+        return self.values[start:int(self.ends[index])]
+
+    def metadata(self, index):
+        return self.metadataRows[index]
+
+    def overallHValues(self):
+        '''
+        Returns getOverallHValue for each work in the store.
+        '''
+
+        return [getOverallHValue(self[i].tolist()) for i in range(len(self))]
+
+    def overallHValue(self):
+        '''
+        Returns getOverallHValue for all the timepoints of all works in the store together.
+        '''
+
+        return getOverallHValue(self.values.tolist())
+
 #------------------------------------------------------------------------------
 
 # Working with the data
@@ -239,19 +505,55 @@ def getOverallHValue(listOfWeightedTimePoints):
 def getWindowedAverage(listOfWeightedTimePoints, windowSize=16):
     '''
     Takes an average for a certain number (input) of weighted timepoints.
+    Give a list of window sizes (e.g. range(4, 65)) to get them all from one pass:
+    a 2-D array with one row per window size, the shorter rows padded at the end with NaN.
     '''
 
-    numberOfTimepoints = len(listOfWeightedTimePoints)
-    averagePerWindow = []
-    for i in range(numberOfTimepoints - windowSize):
-        valuesList = []
-        for j in range(windowSize):
-            temporaryValue = listOfWeightedTimePoints[i+j]
-            valuesList.append(temporaryValue)
-        ourAverage = sum([x for x in valuesList]) / windowSize
-        averagePerWindow.append(round(ourAverage, 2))
+    values = np.asarray(listOfWeightedTimePoints, dtype=float)
+    windowSizes = np.atleast_1d(windowSize).tolist()
+    numberOfTimepoints = len(values)
+    averagePerWindow = np.full((len(windowSizes), max(numberOfTimepoints - min(windowSizes), 0)), np.nan)
+
+    # Weighted timepoints are exact hundredths, so window sums can be exact integer differences.
+    hundredths = np.rint(values * 100)
+    if np.array_equal(hundredths / 100, values):
+        cumulative = np.concatenate(([0], np.cumsum(hundredths.astype(np.int64))))
+    else:
+        cumulative = None
+
+    for row, size in enumerate(windowSizes):
+        numberOfWindows = numberOfTimepoints - size
+        if numberOfWindows <= 0:
+            continue
+        starts = np.arange(numberOfWindows)
+        if cumulative is None:
+            averagePerWindow[row, :numberOfWindows] = roundedWindowAverages(values, starts, size)
+            continue
+        # Round sum / size (in hundredths) to the nearest integer, except for exact halves:
+        # for those, the floating-point sum decides (as in Python), so work it out as such.
+        twiceSums = 2 * (cumulative[size:size + numberOfWindows] - cumulative[:numberOfWindows])
+        ties = (twiceSums % size == 0) & ((twiceSums // size) % 2 == 1)
+        ourAverages = ((twiceSums + size) // (2 * size)) / 100
+        ourAverages[ties] = roundedWindowAverages(values, starts[ties], size)
+        averagePerWindow[row, :numberOfWindows] = ourAverages
+
+    if np.ndim(windowSize) == 0:
+        return averagePerWindow[0]
     return averagePerWindow
 
+def roundedWindowAverages(values, starts, windowSize):
+    '''
+    Averages of the windows beginning at each of starts, summed in order and rounded
+    exactly as sum(valuesList) / windowSize and round(ourAverage, 2) on Python floats.
+    '''
+
+    sums = values[starts].copy()
+    for j in range(1, windowSize):
+        sums += values[starts + j]
+    uniqueAverages, inverse = np.unique(sums / windowSize, return_inverse=True)
+    rounded = np.array([round(x, 2) for x in uniqueAverages.tolist()])
+    return rounded[inverse.reshape(-1)]
+
 def getRankedLocalMax(info, #Input data
                       n=10, #How many to return
                       threshold=0.25, #Minimum peak value. Depends on input minimum rhythmic value.
@@ -263,19 +565,9 @@ def getRankedLocalMax(info, #Input data
     '''
     ## Remember: homorhythmicity range 0-1; low value = low homorhythmicity.
 
-    shortList = []
-    for lineIndex in range(len(info)-windowSize):
-        currentValues = []
-        for ws in range(windowSize):
-            x = lineIndex+ws # timepoint
-            y = info[lineIndex+ws] #value
-            currentTuple = (x,y)
-            currentValues.append(currentTuple)
-        localMax = max(currentValues,key=lambda item:item[1])
-        if localMax[1] > threshold:
-            shortList.append(localMax)
-
-    return [x for x in Counter(shortList).most_common(n) if x[1] > 1]
+    maxPositions = getLocalMaxPositions(info, windowSize=windowSize)
+    values = np.asarray(info)
+    return rankPositions(info, maxPositions[values[maxPositions] > threshold], n=n)
 
 def getRankedLocalMin(info, #Input data
                       n=10, #How many to return
@@ -289,19 +581,98 @@ def getRankedLocalMin(info, #Input data
     '''
     #TODO Rank-by options. RankByDict= {'x':***,'y':***, 'timePoints':***}
 
-    shortList = []
-    for lineIndex in range(len(info)-windowSize):
-        currentValues = []
-        for ws in range(windowSize):
-            x = lineIndex+ws # timepoint
-            y = info[lineIndex+ws] #value
-            currentTuple = (x,y)
-            currentValues.append(currentTuple)
-        localMin = min(currentValues,key=lambda item:item[1])
-        if localMin[1] < threshold:
-            shortList.append(localMin)
+    minPositions = getLocalMinPositions(info, windowSize=windowSize)
+    values = np.asarray(info)
+    return rankPositions(info, minPositions[values[minPositions] < threshold], n=n)
+
+def getRankedLocalExtrema(info, #Input data
+                          n=10, #How many to return
+                          maxThreshold=0.25, #Minimum peak value (as for getRankedLocalMax)
+                          minThreshold=0.75, #Maximum trough value (as for getRankedLocalMin)
+                          windowSize=16): #Minimum range of 'local'
+    '''
+    Returns the results of both getRankedLocalMax and getRankedLocalMin (in that order) together.
+    '''
+
+    maxPositions, minPositions = getLocalExtremaPositions(info, windowSize=windowSize)
+    values = np.asarray(info)
+    rankedMax = rankPositions(info, maxPositions[values[maxPositions] > maxThreshold], n=n)
+    rankedMin = rankPositions(info, minPositions[values[minPositions] < minThreshold], n=n)
+    return rankedMax, rankedMin
 
-    return [x for x in Counter(shortList).most_common(n) if x[1] > 1]
+def getLocalExtremaPositions(info, windowSize=16):
+    '''
+    Returns the timepoints of the maximum and of the minimum in each window of windowSize
+    (see getLocalMaxPositions and getLocalMinPositions).
+    '''
+
+    return getLocalMaxPositions(info, windowSize=windowSize), getLocalMinPositions(info, windowSize=windowSize)
+
+def getLocalMaxPositions(info, windowSize=16):
+    '''
+    Returns the timepoint of the maximum in each window of windowSize
+    (the first such, where tied), for every window start in range(len(info) - windowSize).
+    '''
+
+    return slidingArgmax(np.asarray(info, dtype=np.float64), windowSize)
+
+def getLocalMinPositions(info, windowSize=16):
+    '''
+    As getLocalMaxPositions, for the minimum.
+    '''
+
+    return slidingArgmax(-np.asarray(info, dtype=np.float64), windowSize)
+
+def slidingArgmax(values, windowSize):
+    '''
+    Returns the position of the (first) maximum in each window of windowSize,
+    for every window start in range(len(values) - windowSize), in O(n) whatever the windowSize:
+    in blocks of windowSize, each window is the end of one block and the start of the next,
+    so its maximum is the greater of a suffix maximum and a prefix maximum (van Herk / Gil-Werman).
+    '''
+
+    numberOfWindows = len(values) - windowSize
+    if numberOfWindows <= 0:
+        return np.array([], dtype=np.int64)
+
+    noOfBlocks = -(-len(values) // windowSize)
+    padded = np.full(noOfBlocks * windowSize, -np.inf)
+    padded[:len(values)] = values
+    blocks = padded.reshape(noOfBlocks, windowSize)
+    positions = np.arange(len(padded)).reshape(noOfBlocks, windowSize)
+
+    # Prefix: the position of the first maximum from the block start, i.e. the last new (strict) maximum
+    runningMax = np.maximum.accumulate(blocks, axis=1)
+    isNew = np.ones(blocks.shape, dtype=bool)
+    isNew[:, 1:] = blocks[:, 1:] > runningMax[:, :-1]
+    prefix = np.maximum.accumulate(np.where(isNew, positions, -1), axis=1).reshape(-1)
+
+    # Suffix: the position of the first maximum to the block end (from the right, ties move left)
+    reversedBlocks = blocks[:, ::-1]
+    runningMax = np.maximum.accumulate(reversedBlocks, axis=1)
+    isAtMax = reversedBlocks == runningMax
+    suffix = np.minimum.accumulate(np.where(isAtMax, positions[:, ::-1], len(padded)), axis=1)
+    suffix = suffix[:, ::-1].reshape(-1)
+
+    starts = np.arange(numberOfWindows)
+    left = suffix[starts]
+    right = prefix[starts + windowSize - 1]
+    return np.where(padded[left] >= padded[right], left, right)
+
+def rankPositions(info, positions, n=10):
+    '''
+    Ranks local extremum positions by the number of windows in which each is the extremum,
+    returning the n most common ((x, y), count) where count > 1,
+    as for Counter(shortList).most_common(n).
+    '''
+
+    # Extremum positions never move backwards as the window moves on, so (ascending) unique
+    # positions are in the order first found, as for Counter ties.
+    uniquePositions, counts = np.unique(positions, return_counts=True)
+    order = np.argsort(-counts, kind='stable')[:n]
+    return [((x, info[x]), count)
+            for x, count in zip(uniquePositions[order].tolist(), counts[order].tolist())
+            if count > 1]
 
 #------------------------------------------------------------------------------
 
@@ -356,8 +727,8 @@ class Test(unittest.TestCase):
         testOffsets = getOffsets(testscore)
         testAllOffsets = allTimePointOffsetCounts(testOffsets)
 
-        self.assertIsInstance(testAllOffsets, list)
-        self.assertIsInstance(testAllOffsets[0], int)
+        self.assertIsInstance(testAllOffsets, np.ndarray)
+        self.assertIsInstance(testAllOffsets[0], np.integer)
 
     def testAllTimePointsWeighted(self):
 
@@ -366,9 +737,18 @@ class Test(unittest.TestCase):
         testAllOffsets = allTimePointOffsetCounts(testOffsets)
         testAllOffsetsWeighted = allTimePointsWeighted(testAllOffsets)
 
-        self.assertIsInstance(testAllOffsetsWeighted, list)
+        self.assertIsInstance(testAllOffsetsWeighted, np.ndarray)
         self.assertIsInstance(testAllOffsets[0], float)
 
+    def testTimePointsArrays(self):
+
+        testOffsets = [0.0, 0.0, 0.5, 1.0, 1.0, 1.0, 1.25, Fraction(4, 3), 2.5, 3.0, 3.0]
+        testCounts = allTimePointOffsetCounts(testOffsets)
+        testWeighted = allTimePointsWeighted(testCounts)
+
+        self.assertEqual(testCounts.tolist(), [2, 1, 3, 0, 0, 1]) # Doubled; 1.25, 4/3 between
+        self.assertEqual(testWeighted.tolist(), [0.34, 0.34, 1.0, 1.0, 1.0, 0.34])
+
     def testWindowedAverage(self):
 
         testscore = corpus.parse('bach/bwv1.6')
@@ -377,9 +757,19 @@ class Test(unittest.TestCase):
         testAllOffsetsWeighted = allTimePointsWeighted(testAllOffsets)
         avs = getWindowedAverage(testAllOffsetsWeighted)
 
-        self.assertIsInstance(avs, list)
+        self.assertIsInstance(avs, np.ndarray)
         self.assertIsInstance(avs[0], float)
 
+    def testWindowedAverageBatch(self):
+
+        testWeighted = [0.34, 0.34, 1.0, 1.0, 1.0, 0.34, 0.0, 0.66, 1.0, 0.34]
+        avs = getWindowedAverage(testWeighted, windowSize=[2, 4])
+
+        self.assertEqual(avs.shape, (2, 8))
+        self.assertEqual(avs[0].tolist(), getWindowedAverage(testWeighted, windowSize=2).tolist())
+        self.assertEqual(avs[1, :6].tolist(), [0.67, 0.83, 0.83, 0.58, 0.5, 0.5])
+        self.assertTrue(np.isnan(avs[1, 6:]).all())
+
     # def testDoOneScore(self):
 
     def testGetRankedLocalMax(self):
@@ -408,4 +798,123 @@ class Test(unittest.TestCase):
         self.assertIsInstance(testResult[0][0][1], float) # Value (average)
         self.assertIsInstance(testResult[0][1], int) # Count
 
+    def testSlidingArgmax(self):
+
+        testInfo = [0.1, 0.5, 0.5, 0.2, 0.9, 0.9, 0.1, 0.3, 0.3, 0.0, 0.5]
+        for windowSize in [1, 2, 3, 4, 7]:
+            windows = [testInfo[i:i + windowSize] for i in range(len(testInfo) - windowSize)]
+            self.assertEqual(getLocalMaxPositions(testInfo, windowSize=windowSize).tolist(), # First, where tied
+                             [i + x.index(max(x)) for i, x in enumerate(windows)])
+            self.assertEqual(getLocalMinPositions(testInfo, windowSize=windowSize).tolist(),
+                             [i + x.index(min(x)) for i, x in enumerate(windows)])
+        self.assertEqual(getLocalMaxPositions(testInfo, windowSize=11).tolist(), [])
+
+    def testHomorhythmStore(self):
+
+        import tempfile
+        with tempfile.TemporaryDirectory() as storePath:
+            store = HomorhythmStore(storePath)
+            store.append(np.array([0.34, 1.0, 0.0]), ['work1.xml', '/path/work1.xml'])
+            store.append([1.0, 1.0], ['work2.xml', '/path/work2.xml', 'Mouton, Jean'])
+
+            reopened = HomorhythmStore(storePath)
+
+            self.assertEqual(len(reopened), 2)
+            self.assertIsInstance(reopened.values, np.memmap)
+            self.assertEqual(reopened[0].tolist(), [0.34, 1.0, 0.0])
+            self.assertEqual(reopened[-1].tolist(), [1.0, 1.0])
+            self.assertEqual(reopened.metadata(1)[2], 'Mouton, Jean')
+            self.assertEqual(reopened.overallHValues(), [0.45, 1.0])
+            self.assertEqual(reopened.overallHValue(), getOverallHValue([0.34, 1.0, 0.0, 1.0, 1.0]))
+
+    def testDoCorpusRetriesErrors(self):
+
+        import tempfile
+        with tempfile.TemporaryDirectory() as directory:
+            scorePath = directory + os.sep
+            for fileName, notes in (('a.krn', '4c\n4d\n4e\n4f\n'), ('b.krn', '4g\n4a\n4b\n4c\n')):
+                with open(scorePath + fileName, 'w') as fileout:
+                    fileout.write('**kern\n' + notes + '*-\n')
+            mtime = (2**33, 2**33) # In the future, so music21's own cache never has it as up to date
+            os.utime(scorePath + 'a.krn', mtime)
+            store = HomorhythmStore(os.path.join(directory, 'store'))
+            manifestPath = os.path.join(directory, 'manifest.json')
+
+            doCorpus(scorePath, store=store, manifestPath=manifestPath, minRhyDenom=8)
+
+            with open(scorePath + 'a.krn') as filein: # Make a.krn fail with other parameters ...
+                content = filein.read()
+            with open(scorePath + 'a.krn', 'w') as fileout:
+                fileout.write('x' * (len(content) - 1) + '\n')
+            os.utime(scorePath + 'a.krn', mtime)
+            batch = doCorpus(scorePath, store=store, manifestPath=manifestPath, minRhyDenom=4)
+            self.assertEqual([x[0] for x in batch['errors']], ['a.krn'])
+            self.assertEqual([store.metadata(i)[0] for i in range(len(store))], ['a.krn', 'b.krn']) # Kept
+
+            with open(scorePath + 'a.krn', 'w') as fileout: # ... then put it back as it was
+                fileout.write(content)
+            os.utime(scorePath + 'a.krn', mtime)
+            batch = doCorpus(scorePath, store=store, manifestPath=manifestPath, minRhyDenom=4)
+            self.assertEqual([x[0] for x in batch['results']], ['a.krn'])
+            self.assertEqual(sorted([store.metadata(i)[0] for i in range(len(store))]), ['a.krn', 'b.krn'])
+
+            picklePath = os.path.join(directory, 'pickles') + os.sep # The same, one pickle per work
+            os.makedirs(picklePath)
+            manifestPath = os.path.join(directory, 'pickles.json')
+            doCorpus(scorePath, picklePath=picklePath, manifestPath=manifestPath, minRhyDenom=8)
+            with open(scorePath + 'a.krn', 'w') as fileout:
+                fileout.write('x' * (len(content) - 1) + '\n')
+            os.utime(scorePath + 'a.krn', mtime)
+            batch = doCorpus(scorePath, picklePath=picklePath, manifestPath=manifestPath, minRhyDenom=4)
+            self.assertEqual([x[0] for x in batch['errors']], ['a.krn'])
+            self.assertTrue(os.path.exists(picklePath + 'a.krn.p')) # The last good output
+
+    def testDoCorpusStoreRerun(self):
+
+        import tempfile
+        with tempfile.TemporaryDirectory() as directory:
+            scorePath = directory + os.sep
+            for fileName, notes in (('a.krn', '4c\n4d\n'), ('b.krn', '4g\n8a\n8b\n')):
+                with open(scorePath + fileName, 'w') as fileout:
+                    fileout.write('**kern\n' + notes + '*-\n')
+            store = HomorhythmStore(os.path.join(directory, 'store'))
+
+            for i in range(2): # No manifest, so both works each time
+                doCorpus(scorePath, store=store)
+            self.assertEqual(sorted([store.metadata(i)[0] for i in range(len(store))]), ['a.krn', 'b.krn'])
+
+    def testHomorhythmStoreInterrupted(self):
+
+        import tempfile
+        with tempfile.TemporaryDirectory() as storePath:
+            store = HomorhythmStore(storePath)
+            store.appendMany([[[0.34, 1.0], ['work1.xml', '/path/work1.xml', None]],
+                              [[1.0], ['work2.xml', '/path/work2.xml']]])
+            self.assertEqual(store.metadata(0), HomorhythmStore(storePath).metadata(0))
+
+            with open(store.valuesPath, 'ab') as fileout: # An append interrupted before its metadata
+                fileout.write(np.array([0.0, 0.0], dtype='<f8').tobytes())
+            with open(store.endsPath, 'ab') as fileout:
+                fileout.write(np.array([5], dtype='<i8').tobytes()[:4])
+
+            reopened = HomorhythmStore(storePath)
+            self.assertEqual(len(reopened), 2)
+            self.assertEqual(os.path.getsize(reopened.endsPath), 16)
+            reopened.append([0.0], ['work3.xml', '/path/work3.xml'])
+            self.assertEqual(HomorhythmStore(storePath)[2].tolist(), [0.0])
+
+    def testGetRankedLocalExtrema(self):
+
+        testInfo = [0.04, 0.04, 0.04, 0.05, 0.05, 0.05, 0.06, 0.08, 0.09, 0.09, 0.09, 0.1, 0.1,
+        0.1, 0.1, 0.09, 0.09, 0.09, 0.09, 0.08, 0.08, 0.08, 0.06, 0.05, 0.05, 0.05, 0.05, 0.05,
+        0.06, 0.06, 0.06, 0.07, 0.07, 0.07, 0.07, 0.1, 0.1, 0.1, 0.1,]
+
+        testMax, testMin = getRankedLocalExtrema(testInfo, n=2, maxThreshold=0.09,
+                                                 minThreshold=0.09, windowSize=4)
+
+        self.assertEqual(testMax, getRankedLocalMax(testInfo, n=2, threshold=0.09, windowSize=4))
+        self.assertEqual(testMin, getRankedLocalMin(testInfo, n=2, threshold=0.09, windowSize=4))
+        self.assertEqual(testMax, [((11, 0.1), 4), ((35, 0.1), 3)])
+        self.assertEqual(testMin, [((23, 0.05), 4), ((19, 0.08), 3)])
+
 #-------------------------------------------------------------------------------
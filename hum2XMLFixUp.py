@@ -11,38 +11,79 @@ from music21 import metadata
 import numpy as np
 import os
 
+from functools import partial
+
+import BatchProcessing
+import ParseCache
+
 #-------------------------------------------------------------------------------
 
-def oneKrnToXml(fileSourcePath, fileName):
+def oneKrnToXml(fileSourcePath, fileName, cache=None):
     '''
     Processes one pair of corresponding KRN and XML files,
     producing a new XML score with the original metadata (from the KRN score)
     and any necessary character swaps in both the metadata and lyrics.
+    Optionally, retrieve the parsed scores from a ParseCache.
     '''
 
-    interimScore = transferMetadata(fileSourcePath, fileName)
+    interimScore = transferMetadata(fileSourcePath, fileName, cache=cache)
     newScore = lyricSwap(interimScore)
 
     return newScore
 
 def corpusKrnToXml(fileSourcePath, fileDestinationPath,
-                    searchTerm=None, fileFormat='.krn'): # Either, to avoid both
+                    searchTerm=None, fileFormat='.krn', # Either, to avoid both
+                    workers=1, chunkSize=None, timeout=None, cache=None, manifestPath=None):
     '''
     Batch processes a corpus of corresponding KRN and XML files;
     assumes the same folder (fileSourcePath) and file name, but different extensions (KRN vs XML).
     Call either fileFormat='.krn' or '.xml' to avoid other files in the folder.
+    Set workers > 1 (or None for all cores) to process files in parallel.
+    Given a ParseCache, unchanged KRN and XML files are not parsed again.
+    Given a manifestPath, only new or changed KRN / XML pairs are processed and the outputs
+    for deleted ones are removed (see BatchProcessing.Manifest).
+    Returns the batch summary (see BatchProcessing.runBatch) with any errors and the throughput.
     '''
 
     preparedFileList = prepFileList(fileSourcePath, searchTerm, fileFormat)
-    for eachFile in preparedFileList: #[n]:
-        try:
-            xmlScore = oneKrnToXml(fileSourcePath, eachFile)
-            comp = commasIn(xmlScore.metadata.composer)
-            tit = xmlScore.metadata.title
-            xmlScore.write(fmt='musicxml',
-                            fp=fileDestinationPath+comp+' - '+tit+'.xml')
-        except:
-            print('Error in processing '+eachFile)
+
+    if manifestPath is not None:
+        manifest = BatchProcessing.Manifest(manifestPath)
+        inputs = {x: [fileSourcePath+x[0:-4]+'.krn', fileSourcePath+x[0:-4]+'.xml']
+                  for x in preparedFileList}
+        preparedFileList, skipped, removed = manifest.compare(inputs)
+
+    batch = ParseCache.runBatch(partial(oneKrnToXmlFile, fileSourcePath, fileDestinationPath), preparedFileList,
+                                cache=cache, workers=workers, chunkSize=chunkSize, timeout=timeout)
+
+    if manifestPath is not None:
+        # Old outputs (names may have changed) are only removed once the new ones are written and recorded
+        for eachFile, outPath in batch['results']:
+            staleOutputs = [x for x in manifest.outputs(eachFile) if x != outPath]
+            manifest.record(eachFile, inputs[eachFile], outputs=[outPath])
+            BatchProcessing.removeFiles(staleOutputs)
+        for eachFile in removed:
+            BatchProcessing.removeFiles(manifest.forget(eachFile))
+        for eachFile, message in batch['errors']: # Retried next time; the last good output is kept
+            manifest.retry(eachFile)
+        manifest.save()
+        BatchProcessing.printSummary(skipped, batch['results'], removed)
+
+    return batch
+
+def oneKrnToXmlFile(fileSourcePath, fileDestinationPath, eachFile, cache=None):
+    '''
+    Processes one pair of KRN and XML files (see oneKrnToXml) and writes the new XML score
+    to fileDestinationPath as 'Surname, FirstName - Title.xml'. Returns the path written.
+    '''
+
+    xmlScore = oneKrnToXml(fileSourcePath, eachFile, cache=cache)
+    comp = commasIn(xmlScore.metadata.composer)
+    tit = xmlScore.metadata.title
+    outPath = fileDestinationPath+comp+' - '+tit+'.xml'
+    xmlScore.write(fmt='musicxml', fp=outPath)
+
+    return outPath
 
 #-------------------------------------------------------------------------------
 
@@ -151,17 +192,18 @@ def commasIn(text):
 
 #-------------------------------------------------------------------------------
 
-def transferMetadata(fileSourcePath, fileName):
+def transferMetadata(fileSourcePath, fileName, cache=None):
     '''
     Taking an KRN score and initial XML conversion using humtools,
     transferMetadata returns an XML score with the original metadata (from the KRN score),
     including character swaps.
     Use either the '.krn' or the '.xml' version for the fileName.
+    Optionally, retrieve the parsed scores from a ParseCache.
     '''
 
 #     try:
-    krnScore = converter.parse(fileSourcePath+fileName[0:-4]+'.krn')
-    xmlScore = converter.parse(fileSourcePath+fileName[0:-4]+'.xml')
+    krnScore = ParseCache.parse(fileSourcePath+fileName[0:-4]+'.krn', cache=cache)
+    xmlScore = ParseCache.parse(fileSourcePath+fileName[0:-4]+'.xml', cache=cache)
 #     except:
 #     ScoreError:
 #         print('Error in converting score: '+fileName[0:-4])